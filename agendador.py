@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Agendador - tarefas periódicas do PCP (varredura de atrasos, limpezas...)
+
+Gatilhos no formato do cron (minuto hora dia mês dia_da_semana), por
+exemplo "*/5 * * * *" a cada 5 minutos ou "30 2 * * *" todo dia às 02:30.
+
+Com vários workers do gunicorn todos sobem o agendador, mas só um deles
+(o líder) executa os jobs:
+    - PostgreSQL: pg_try_advisory_lock numa conexão dedicada
+    - SQLite/local: trava de arquivo (travas.py, fcntl.flock) em PCP_AGENDADOR_TRAVA
+Se o líder morrer a trava é liberada e outro worker assume na próxima
+tentativa de eleição.
+
+Cada execução fica registrada na tabela execucao_job (início, duração,
+sucesso, erro) e nas métricas do /metrics.
+
+Linha de comando:
+    python agendador.py --listar
+    python agendador.py tarefas_atrasadas      (executa o job uma vez, agora)
+
+Variáveis de ambiente:
+    PCP_AGENDADOR          1 liga / 0 desliga o agendador (padrão: 1)
+    PCP_AGENDADOR_TRAVA    arquivo da trava de líder (padrão: <tmp>/pcp_agendador.lock)
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import log_estruturado
+import metricas
+from travas import TravaArquivo
+
+# Chave do advisory lock do PostgreSQL (número qualquer, fixo)
+CHAVE_ADVISORY = 7310421
+ELEICAO_SEG = 30
+
+log = log_estruturado.obter("agendador")
+
+metricas.registro.contador("pcp_jobs_execucoes_total", "Execuções de jobs agendados por resultado")
+metricas.registro.histograma("pcp_job_segundos", "Duração das execuções de jobs agendados")
+
+
+# ============ GATILHO CRON ============
+
+_LIMITES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+
+def _campo(texto, minimo, maximo):
+    valores = set()
+    for parte in texto.split(","):
+        passo = 1
+        if "/" in parte:
+            parte, passo = parte.split("/")
+            passo = int(passo)
+        if parte == "*":
+            inicio, fim = minimo, maximo
+        elif "-" in parte:
+            inicio, fim = (int(x) for x in parte.split("-"))
+        else:
+            inicio = fim = int(parte)
+        if inicio < minimo or fim > maximo or inicio > fim:
+            raise ValueError(f"Valor fora do intervalo {minimo}-{maximo}: {texto}")
+        valores.update(range(inicio, fim + 1, passo))
+    return frozenset(valores)
+
+
+class Cron:
+    """Gatilho "minuto hora dia mês dia_da_semana" (0 = domingo)"""
+
+    def __init__(self, expressao):
+        campos = expressao.split()
+        if len(campos) != 5:
+            raise ValueError(f"Expressão cron inválida: {expressao}")
+        self.expressao = expressao
+        self.minutos, self.horas, self.dias, self.meses, self.dias_semana = (
+            _campo(c, mi, ma) for c, (mi, ma) in zip(campos, _LIMITES)
+        )
+        # Como no cron: se dia e dia da semana foram restritos, vale qualquer um dos dois
+        self._dia_livre = campos[2] == "*"
+        self._semana_livre = campos[4] == "*"
+
+    def _dia_ok(self, momento):
+        dia = momento.day in self.dias
+        semana = (momento.isoweekday() % 7) in self.dias_semana
+        if self._dia_livre or self._semana_livre:
+            return dia and semana
+        return dia or semana
+
+    def proxima(self, depois_de):
+        """Próximo horário estritamente depois de `depois_de`"""
+        momento = depois_de.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limite = momento + timedelta(days=366 * 4)
+        while momento < limite:
+            if momento.month not in self.meses or not self._dia_ok(momento):
+                momento = (momento + timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if momento.hour not in self.horas:
+                momento = (momento + timedelta(hours=1)).replace(minute=0)
+                continue
+            if momento.minute not in self.minutos:
+                momento += timedelta(minutes=1)
+                continue
+            return momento
+        raise ValueError(f"Expressão cron nunca dispara: {self.expressao}")
+
+    def __str__(self):
+        return f"cron[{self.expressao}]"
+
+
+# ============ LÍDER ============
+
+class TravaAdvisory:
+    """Advisory lock do PostgreSQL preso a uma conexão dedicada"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.conexao = None
+
+    def tentar(self):
+        if self.conexao is not None:
+            try:
+                self.conexao.execute(text("SELECT 1"))
+                return True
+            except Exception:
+                # Conexão caiu: o lock foi junto
+                self.conexao = None
+        conexao = self.engine.connect()
+        ok = conexao.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": CHAVE_ADVISORY}).scalar()
+        conexao.commit()
+        if ok:
+            self.conexao = conexao
+        else:
+            conexao.close()
+        return bool(ok)
+
+
+# ============ AGENDADOR ============
+
+class Job:
+    def __init__(self, funcao, gatilho, id, name):
+        self.funcao = funcao
+        self.gatilho = gatilho
+        self.id = id
+        self.name = name
+        self.next_run_time = None
+        self.executando = False
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.gatilho} próxima={self.next_run_time}>"
+
+
+class Agendador:
+    def __init__(self):
+        self.jobs = {}
+        self.running = False
+        self.lider = False
+        self._thread = None
+        self._parar = threading.Event()
+        self._pool = None
+        self._trava = None
+        self._app = None
+        self._db = None
+        self._modelo = None
+
+    def add_job(self, funcao, cron, id, name=None):
+        self.jobs[id] = Job(funcao, Cron(cron), id, name or id)
+        return self.jobs[id]
+
+    def job(self, cron, id=None, name=None):
+        """Decorator: @scheduler.job("*/5 * * * *")"""
+        def decorador(funcao):
+            self.add_job(funcao, cron, id or funcao.__name__, name or (funcao.__doc__ or "").strip() or None)
+            return funcao
+        return decorador
+
+    def get_jobs(self):
+        return list(self.jobs.values())
+
+    def init_app(self, app, db, modelo_execucao):
+        self._app, self._db, self._modelo = app, db, modelo_execucao
+
+    # ----- execução -----
+
+    def executar(self, job_id):
+        """Executa um job agora, registra o histórico e devolve o resultado"""
+        job = self.jobs[job_id]
+        inicio = datetime.now()
+        t0 = time.perf_counter()
+        erro = None
+        resultado = None
+        with self._app.app_context():
+            try:
+                resultado = job.funcao()
+            except Exception as e:
+                self._db.session.rollback()
+                erro = f"{type(e).__name__}: {e}"
+                log.exception("Erro no job", extra={"job": job_id})
+            duracao = time.perf_counter() - t0
+
+            self._db.session.add(self._modelo(
+                job_id=job_id,
+                inicio=inicio,
+                duracao_ms=round(duracao * 1000, 1),
+                sucesso=erro is None,
+                resultado=None if resultado is None else str(resultado)[:200],
+                erro=erro[:500] if erro else None,
+            ))
+            self._db.session.commit()
+
+        metricas.registro.inc("pcp_jobs_execucoes_total", job=job_id, resultado="ok" if erro is None else "erro")
+        metricas.registro.observar("pcp_job_segundos", duracao, job=job_id)
+        log.info("Job executado", extra={"job": job_id, "duracao_ms": round(duracao * 1000, 1),
+                                         "sucesso": erro is None, "resultado": resultado})
+        return resultado
+
+    def _executar_agendado(self, job):
+        try:
+            self.executar(job.id)
+        finally:
+            job.executando = False
+
+    def _eleger(self):
+        if self._trava is None:
+            with self._app.app_context():
+                engine = self._db.engine
+            if engine.url.get_backend_name() == "postgresql":
+                self._trava = TravaAdvisory(engine)
+            else:
+                caminho = os.environ.get("PCP_AGENDADOR_TRAVA") or os.path.join(tempfile.gettempdir(), "pcp_agendador.lock")
+                self._trava = TravaArquivo(caminho)
+        try:
+            lider = self._trava.tentar()
+        except Exception:
+            log.exception("Erro na eleição do líder do agendador")
+            lider = False
+        if lider and not self.lider:
+            log.info("Este processo é o líder do agendador", extra={"pid": os.getpid()})
+        self.lider = lider
+
+    def _loop(self):
+        proxima_eleicao = 0.0
+        while not self._parar.is_set():
+            if time.monotonic() >= proxima_eleicao:
+                self._eleger()
+                proxima_eleicao = time.monotonic() + ELEICAO_SEG
+
+            agora = datetime.now()
+            for job in self.jobs.values():
+                if job.next_run_time > agora:
+                    continue
+                job.next_run_time = job.gatilho.proxima(agora)
+                if not self.lider:
+                    continue
+                if job.executando:
+                    log.warning("Job ainda em execução, pulando", extra={"job": job.id})
+                    continue
+                job.executando = True
+                self._pool.submit(self._executar_agendado, job)
+
+            proximo = min((j.next_run_time for j in self.jobs.values()), default=agora + timedelta(seconds=ELEICAO_SEG))
+            espera = min(max((proximo - datetime.now()).total_seconds(), 0.5), ELEICAO_SEG)
+            self._parar.wait(espera)
+
+    def start(self):
+        """Sobe a thread do agendador neste processo"""
+        if self.running or os.environ.get("PCP_AGENDADOR", "1") == "0":
+            return
+        agora = datetime.now()
+        for job in self.jobs.values():
+            job.next_run_time = job.gatilho.proxima(agora)
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="job")
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._loop, name="agendador", daemon=True)
+        self._thread.start()
+        self.running = True
+
+    def shutdown(self):
+        self._parar.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._pool:
+            self._pool.shutdown(wait=False)
+        self.running = False
+
+
+def main():
+    from app import scheduler
+
+    if len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help", "--listar"):
+        print("Jobs disponíveis:")
+        for job in scheduler.get_jobs():
+            print(f"   {job.id:<25} {job.gatilho}  {job.name}")
+        print("\nUso: python agendador.py <job_id>")
+        return
+
+    job_id = sys.argv[1]
+    if job_id not in scheduler.jobs:
+        print(f"❌ Job desconhecido: {job_id}")
+        sys.exit(1)
+    print(f"▶️ Executando {job_id}...")
+    resultado = scheduler.executar(job_id)
+    print(f"✅ Concluído: {resultado}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Horas realizadas agregadas por etapa, operador e dia
+
+Cada apontamento finalizado soma a sua duração na tabela horas_realizadas
+(etapa_id, operador_id, dia), quebrada na meia-noite quando atravessa
+dias. A soma é feita na mesma transação do apontamento_finalizar, com
+upsert atômico (segundos = segundos + delta), então as horas realizadas de
+uma etapa ou de todas as etapas são uma consulta agregada, sem varrer os
+apontamentos:
+
+    agregado_horas.registrar(apontamento)          # ao finalizar
+    agregado_horas.registrar(apontamento, -1)      # antes de refinalizar
+    agregado_horas.horas_etapa(etapa_id)
+
+Linha de comando (recalcula a tabela a partir dos apontamentos):
+    python agregado_horas.py --reconstruir
+"""
+
+import sys
+from collections import defaultdict
+
+from sqlalchemy import func, select
+
+import intervalos
+
+_db = None
+_Apontamento = _Horas = None
+
+
+def _partes(apontamento):
+    """[(dia, segundos)] do apontamento, quebrado na meia-noite"""
+    if not apontamento.inicio or not apontamento.fim:
+        return []
+    return [
+        (dia, intervalos.segundos(partes))
+        for dia, partes in intervalos.por_dia([(apontamento.inicio, apontamento.fim)]).items()
+    ]
+
+
+def _upsert(linhas):
+    """Soma segundos/apontamentos nas linhas (insere as que não existem)"""
+    tabela = _Horas.__table__
+    dialeto = _db.session.get_bind(clause=tabela.insert()).dialect.name
+    if dialeto in ("postgresql", "sqlite"):
+        if dialeto == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        comando = insert(tabela)
+        comando = comando.on_conflict_do_update(
+            index_elements=["etapa_id", "operador_id", "dia"],
+            set_={
+                "segundos": tabela.c.segundos + comando.excluded.segundos,
+                "apontamentos": tabela.c.apontamentos + comando.excluded.apontamentos,
+            },
+        )
+        for linha in linhas:
+            _db.session.execute(comando, linha)
+        return
+    # Outros bancos: UPDATE e, se não havia linha, INSERT
+    for linha in linhas:
+        chave = (tabela.c.etapa_id == linha["etapa_id"]) & (tabela.c.operador_id == linha["operador_id"]) & (tabela.c.dia == linha["dia"])
+        resultado = _db.session.execute(tabela.update().where(chave).values(
+            segundos=tabela.c.segundos + linha["segundos"],
+            apontamentos=tabela.c.apontamentos + linha["apontamentos"],
+        ))
+        if resultado.rowcount == 0:
+            _db.session.execute(tabela.insert().values(**linha))
+
+
+def registrar(apontamento, sinal=1):
+    """Soma (sinal=1) ou tira (sinal=-1) as horas do apontamento (sem commit)"""
+    partes = _partes(apontamento)
+    if not partes:
+        return
+    _upsert([{
+        "etapa_id": apontamento.etapa_id,
+        "operador_id": apontamento.operador_id,
+        "dia": dia,
+        "segundos": sinal * segundos,
+        # O apontamento conta no dia em que terminou
+        "apontamentos": sinal if dia == apontamento.fim.date() else 0,
+    } for dia, segundos in partes])
+
+
+def reconstruir():
+    """Recalcula a tabela inteira a partir dos apontamentos finalizados; devolve as linhas gravadas"""
+    tabela = _Horas.__table__
+    _db.session.execute(tabela.delete())
+    ap = _Apontamento
+    consulta = (_db.session.query(ap.etapa_id, ap.operador_id, ap.inicio, ap.fim)
+                .filter(ap.status == "FINALIZADO", ap.inicio.isnot(None), ap.fim.isnot(None)))
+    somas = defaultdict(lambda: [0.0, 0])
+    for linha in consulta.yield_per(5000):
+        for dia, segundos in _partes(linha):
+            soma = somas[(linha.etapa_id, linha.operador_id, dia)]
+            soma[0] += segundos
+            soma[1] += dia == linha.fim.date()
+    novas = [
+        {"etapa_id": e, "operador_id": o, "dia": d, "segundos": s, "apontamentos": n}
+        for (e, o, d), (s, n) in somas.items()
+    ]
+    if novas:
+        _db.session.execute(tabela.insert(), novas)
+    return len(novas)
+
+
+def horas_etapa(etapa_id):
+    tabela = _Horas.__table__
+    segundos = _db.session.execute(
+        select(func.coalesce(func.sum(tabela.c.segundos), 0.0)).where(tabela.c.etapa_id == etapa_id)
+    ).scalar()
+    return round(segundos / 3600, 2)
+
+
+def subconsulta_por_etapa():
+    """SELECT etapa_id, segundos (somados) - para juntar com etapa numa consulta só"""
+    tabela = _Horas.__table__
+    return (select(tabela.c.etapa_id, func.sum(tabela.c.segundos).label("segundos"))
+            .group_by(tabela.c.etapa_id).subquery())
+
+
+def init_app(db, apontamento, modelo):
+    """Liga o agregado aos modelos Apontamento e HorasRealizadas"""
+    global _db, _Apontamento, _Horas
+    _db, _Apontamento, _Horas = db, apontamento, modelo
+
+
+def main():
+    from app import app, db
+
+    if len(sys.argv) < 2 or sys.argv[1] != "--reconstruir":
+        print("Uso: python agregado_horas.py --reconstruir")
+        return
+    with app.app_context():
+        print("⚙️ Recalculando horas realizadas por etapa/operador/dia...")
+        linhas = reconstruir()
+        db.session.commit()
+    print(f"✅ {linhas} linhas gravadas em horas_realizadas")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,37 @@
 from datetime import date, datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
+from html import escape
+from flask import Flask, Response, abort, g, render_template, request, redirect, url_for, session, jsonify
+from werkzeug.security import check_password_hash
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
 import calendar
+import json
+import math
 import os
 
+from config_banco import SessaoRoteada, configurar_sqlite, opcoes_engine, travar
+import log_estruturado
+import agendador
+import agregado_horas
+import busca
+import cache_cadastros
+import contadores
+import eventos
+import intervalos
+import lote_apontamentos
+import metricas
+import modelos_op
+import notificacoes
+import paginacao
+import perfil_requisicoes
+import permissoes
+import resumo_atrasos
+import seguranca_login
+import sequencias
+import tokens_api
+import utilizacao_maquinas
+
 # Detectar banco de dados: PostgreSQL (Railway) ou SQLite (local)
 database_url = os.environ.get('DATABASE_URL')
 if database_url and database_url.startswith('postgres://'):
@@ -22,14 +49,24 @@ if database_url:
     app.config["SQLALCHEMY_DATABASE_URI"] = database_url
 else:
     app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///pcp.db"
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = opcoes_engine(app.config["SQLALCHEMY_DATABASE_URI"])
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SECRET_KEY"] = "pcp-secret"
+app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "pcp-secret")
 app.config["SESSION_COOKIE_SECURE"] = False  # False para desenvolvimento local
 app.config["SESSION_COOKIE_HTTPONLY"] = True
 app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
 app.config["PERMANENT_SESSION_LIFETIME"] = 86400  # 24 horas
 
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={"class_": SessaoRoteada})
+log_estruturado.init_app(app)
+metricas.init_app(app)
+perfil_requisicoes.init_app(app)
+eventos.init_app(app)
+
+log_auth = log_estruturado.obter("auth")
+log_permissao = log_estruturado.obter("permissao")
+log_materiais = log_estruturado.obter("materiais")
+log_api = log_estruturado.obter("api")
 
 
 # ============ MIDDLEWARE DE AUTENTICACAO ============
@@ -56,18 +93,34 @@ def verificar_autenticacao():
     
     # Verificar se usuário está na sessão
         if 'usuario_id' not in session:
-            print(f"[AUTH] Acesso negado para {request.remote_addr} em {request.path}")
+            log_auth.warning("Acesso negado", extra={"ip": request.remote_addr, "rota": request.path})
             return redirect(url_for("login"))
         else:
             # Guardar email na sessão para uso no template de erro
-            usuario = Usuario.query.get(session.get('usuario_id'))
+            usuario = usuario_atual()
             if usuario:
                 session['usuario_email'] = usuario.email
-            print(f"[AUTH] Acesso permitido para usuario em {request.path}")
+            log_auth.info("Acesso permitido", extra={"rota": request.path})
 
 
 # ============ DECORATOR DE PERMISSOES ============
-from functools import wraps
+from functools import lru_cache, wraps
+
+def usuario_atual():
+    """Perfil de acesso do usuário logado, carregado uma vez por requisição"""
+    if "usuario_acesso" not in g:
+        usuario_id = session.get('usuario_id')
+        g.usuario_acesso = permissoes.cache.obter(usuario_id, _carregar_perfil_acesso) if usuario_id else None
+    return g.usuario_acesso
+
+
+def _carregar_perfil_acesso(usuario_id):
+    usuario = Usuario.query.get(usuario_id)
+    if not usuario:
+        return None
+    etapas = [e.etapa_nome for e in UsuarioEtapa.query.filter_by(usuario_id=usuario_id)]
+    return permissoes.montar_perfil(usuario, etapas)
+
 
 def requer_permissao(acao):
     """Decorator para verificar permissão do usuário"""
@@ -78,8 +131,8 @@ def requer_permissao(acao):
             if 'usuario_id' not in session:
                 return redirect(url_for("login"))
             
-            # Obter usuário
-            usuario = Usuario.query.get(session['usuario_id'])
+            # Obter usuário (cache por requisição / processo)
+            usuario = usuario_atual()
             
             if not usuario:
                 session.clear()
@@ -87,10 +140,10 @@ def requer_permissao(acao):
             
             # Verificar permissão
             if not usuario.tem_permissao(acao):
-                print(f"[PERMISSAO] Acesso negado para {usuario.email} em {acao}")
+                log_permissao.warning("Acesso negado", extra={"usuario": usuario.email, "acao": acao})
                 return render_template("erro_permissao.html", mensagem=f"Você não tem permissão para {acao}"), 403
             
-            print(f"[PERMISSAO] Acesso permitido para {usuario.email} em {acao}")
+            log_permissao.info("Acesso permitido", extra={"usuario": usuario.email, "acao": acao})
             return f(*args, **kwargs)
         return decorated_function
     return decorator
@@ -138,6 +191,10 @@ class Obra(db.Model):
     montagem_eletro_inicio = db.Column(db.Date)
     montagem_eletro_fim = db.Column(db.Date)
 
+    # Mantidos por contadores.py a cada flush
+    ops_total = db.Column(db.Integer, default=0, server_default="0", nullable=False)
+    ops_concluidas = db.Column(db.Integer, default=0, server_default="0", nullable=False)
+
     produtos = db.relationship(
         "ObraProduto",
         backref="obra",
@@ -158,34 +215,154 @@ class Usuario(db.Model):
     data_criacao = db.Column(db.DateTime, default=datetime.now)
     
     def definir_senha(self, senha):
-        self.senha_hash = generate_password_hash(senha)
+        self.senha_hash = seguranca_login.gerar_hash(senha)
     
     def verificar_senha(self, senha):
         return check_password_hash(self.senha_hash, senha)
     
     def tem_permissao(self, acao, etapa_nome=None):
         """Verifica se o usuario tem permissao para uma acao"""
-        permissoes = {
-            "ADMIN": ["criar_obra", "editar_obra", "deletar_obra", "criar_op", "editar_op", "deletar_op", "criar_tarefa", "editar_tarefa", "deletar_tarefa", "visualizar"],
-            "GERENTE": ["criar_op", "editar_op", "criar_tarefa", "editar_tarefa", "visualizar"],
-            "OPERADOR": ["editar_tarefa", "visualizar"],
-            "ESPECIALISTA": ["criar_tarefa", "editar_tarefa", "deletar_tarefa", "visualizar"],
-            "VISUALIZADOR": ["visualizar"]
-        }
-        if acao not in permissoes.get(self.tipo, []):
+        if acao not in permissoes.PERMISSOES_POR_TIPO.get(self.tipo, ()):
             return False
         if self.tipo == "ESPECIALISTA" and etapa_nome:
-            etapas_por_email = {
-                "estrutura@nexon.com": ["CORTE", "DOBRA", "PINTURA"],
-                "caldeiraria@nexon.com": ["CALDEIRARIA"],
-                "montagem@nexon.com": ["MONTAGEM"],
-                "startup@nexon.com": ["START UP"]
-            }
-            etapas_permitidas = etapas_por_email.get(self.email, [])
-            return etapa_nome in etapas_permitidas
+            perfil = permissoes.cache.obter(self.id, _carregar_perfil_acesso)
+            return perfil is not None and etapa_nome in perfil.etapas
         return True
 
 
+class UsuarioEtapa(db.Model):
+    """Etapas em que um usuario ESPECIALISTA pode criar/editar tarefas"""
+    __tablename__ = 'usuario_etapa'
+    __table_args__ = (db.UniqueConstraint("usuario_id", "etapa_nome"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey("usuario.id"), nullable=False, index=True)
+    etapa_nome = db.Column(db.String(50), nullable=False)
+
+    usuario = db.relationship("Usuario", backref=db.backref("etapas_liberadas", lazy=True, cascade="all,delete"))
+
+
+permissoes.observar_modelo(Usuario, lambda u: u.id)
+permissoes.observar_modelo(UsuarioEtapa, lambda e: e.usuario_id)
+
+
+class TokenRevogado(db.Model):
+    """Tokens da API mobile revogados no logout (até expirarem)"""
+    __tablename__ = 'token_revogado'
+
+    jti = db.Column(db.String(32), primary_key=True)
+    expira_em = db.Column(db.DateTime, nullable=False, index=True)
+
+
+def _carregar_tokens_revogados():
+    agora = datetime.now()
+    return {t.jti: t.expira_em.timestamp() for t in TokenRevogado.query.filter(TokenRevogado.expira_em > agora)}
+
+
+def revogar_token(claims):
+    """Coloca o token na lista de revogados e limpa os já expirados
+
+    O INSERT é a reivindicação: devolve False se o jti já estava revogado
+    (outro worker/requisição chegou antes), sem depender da lista em memória.
+    """
+    TokenRevogado.query.filter(TokenRevogado.expira_em <= datetime.now()).delete()
+    db.session.add(TokenRevogado(jti=claims["jti"], expira_em=datetime.fromtimestamp(claims["exp"])))
+    try:
+        db.session.commit()
+        revogou = True
+    except IntegrityError:
+        db.session.rollback()
+        revogou = False
+    tokens_api.revogados.adicionar(claims["jti"], claims["exp"])
+    return revogou
+
+
+tokens_api.init_app(app, _carregar_tokens_revogados)
+
+
+class NotificacaoOutbox(db.Model):
+    """Fila de notificações a enviar (ver notificacoes.py)"""
+    __tablename__ = 'notificacao_outbox'
+    __table_args__ = (db.Index("ix_notificacao_outbox_fila", "status", "proxima_tentativa"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    canal = db.Column(db.String(30), nullable=False)  # telegram / whatsapp_api / http_local
+    destino = db.Column(db.String(120))  # chat / telefone; vazio = destino padrão do canal
+    mensagem = db.Column(db.Text, nullable=False)
+
+    status = db.Column(db.String(20), default="PENDENTE", nullable=False)  # PENDENTE / ENVIANDO / ENVIADA / MORTA
+    tentativas = db.Column(db.Integer, default=0, nullable=False)
+    proxima_tentativa = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    ultimo_erro = db.Column(db.String(500))
+
+    criado_em = db.Column(db.DateTime, default=datetime.now)
+    enviado_em = db.Column(db.DateTime)
+
+
+notificacoes.init_app(app, db, NotificacaoOutbox)
+
+
+class EstadoNotificacao(db.Model):
+    """Último resumo enviado de cada grupo (evita repetir a mesma mensagem)"""
+    __tablename__ = 'estado_notificacao'
+
+    chave = db.Column(db.String(80), primary_key=True)  # ex: atrasos:obra:12
+    impressao = db.Column(db.String(64), nullable=False)
+    titulo = db.Column(db.String(200))
+    enviado_em = db.Column(db.DateTime, default=datetime.now)
+
+
+def verificar_tarefas_atrasadas(forcar=False, canal="telegram"):
+    """Enfileira um resumo por obra com as tarefas atrasadas que mudaram
+
+    Retorna quantas mensagens foram para a fila de notificações.
+    """
+    hoje = date.today()
+    agora = datetime.now()
+    tarefas = (
+        Tarefa.query
+        .options(
+            joinedload(Tarefa.etapa).joinedload(Etapa.op).joinedload(OP.obra),
+            joinedload(Tarefa.responsavel),
+        )
+        .filter(Tarefa.data_fim_prev < hoje, Tarefa.status.notin_(["CONCLUIDO", "FINALIZADO"]))
+        .all()
+    )
+
+    estados = {e.chave: e for e in EstadoNotificacao.query.filter(EstadoNotificacao.chave.like("atrasos:%"))}
+    enfileiradas = 0
+
+    for chave, lista in resumo_atrasos.agrupar(tarefas).items():
+        impressao = resumo_atrasos.impressao_digital(lista)
+        estado = estados.pop(chave, None)
+        lembrete = (
+            estado is not None and resumo_atrasos.LEMBRETE_HORAS > 0
+            and agora - estado.enviado_em >= timedelta(hours=resumo_atrasos.LEMBRETE_HORAS)
+        )
+        if estado and estado.impressao == impressao and not (forcar or lembrete):
+            continue
+
+        for mensagem in resumo_atrasos.mensagens_grupo(lista, hoje):
+            notificacoes.enfileirar(canal, mensagem)
+            enfileiradas += 1
+
+        if estado is None:
+            estado = EstadoNotificacao(chave=chave)
+            db.session.add(estado)
+        estado.impressao = impressao
+        estado.titulo = resumo_atrasos.titulo_grupo(lista)[:200]
+        estado.enviado_em = agora
+
+    # Grupos que estavam atrasados e agora estão em dia
+    for estado in estados.values():
+        notificacoes.enfileirar(canal, resumo_atrasos.mensagem_resolvido(estado.titulo or estado.chave))
+        enfileiradas += 1
+        db.session.delete(estado)
+
+    db.session.commit()
+    return enfileiradas
+
+
 class OP(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     numero = db.Column(db.String(50), nullable=False, unique=True)
@@ -201,6 +378,10 @@ class OP(db.Model):
     percentual = db.Column(db.Float, default=0.0)
     status = db.Column(db.String(30), default="ABERTA")
 
+    # Mantidos por contadores.py a cada flush
+    tarefas_total = db.Column(db.Integer, default=0, server_default="0", nullable=False)
+    tarefas_concluidas = db.Column(db.Integer, default=0, server_default="0", nullable=False)
+
     obra = db.relationship("Obra", backref=db.backref("ops", lazy=True))
 
     @property
@@ -262,14 +443,8 @@ class Etapa(db.Model):
     
     @property
     def horas_realizadas(self):
-        """Calcula horas realizadas a partir dos apontamentos"""
-        aponts = Apontamento.query.filter_by(etapa_id=self.id).filter_by(status="FINALIZADO").all()
-        total = 0
-        for ap in aponts:
-            if ap.fim and ap.inicio:
-                duracao = (ap.fim - ap.inicio).total_seconds() / 3600  # converte para horas
-                total += duracao
-        return round(total, 2)
+        """Horas realizadas dos apontamentos finalizados (tabela agregada, ver agregado_horas.py)"""
+        return agregado_horas.horas_etapa(self.id)
 
 
 class Operador(db.Model):
@@ -289,6 +464,9 @@ class Maquina(db.Model):
 
 
 class Apontamento(db.Model):
+    # Busca de sobreposição por operador (apontamento_sobreposto)
+    __table_args__ = (db.Index("ix_apontamento_operador_inicio", "operador_id", "inicio"),)
+
     id = db.Column(db.Integer, primary_key=True)
 
     obra_id = db.Column(db.Integer, db.ForeignKey("obra.id"), nullable=False)
@@ -322,6 +500,22 @@ class Apontamento(db.Model):
         return 0.0
 
 
+class HorasRealizadas(db.Model):
+    """Horas dos apontamentos finalizados por etapa, operador e dia (ver agregado_horas.py)"""
+    __tablename__ = "horas_realizadas"
+
+    etapa_id = db.Column(db.Integer, db.ForeignKey("etapa.id"), primary_key=True)
+    operador_id = db.Column(db.Integer, db.ForeignKey("operador.id"), primary_key=True)
+    dia = db.Column(db.Date, primary_key=True)
+    segundos = db.Column(db.Float, nullable=False, default=0.0)
+    apontamentos = db.Column(db.Integer, nullable=False, default=0)
+
+
+agregado_horas.init_app(db, Apontamento, HorasRealizadas)
+cache_cadastros.init_app(db, Obra, OP, Etapa, Operador, Maquina)
+lote_apontamentos.init_app(db, Apontamento, Operador, cache_cadastros, agregado_horas)
+
+
 class CronogramaItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     obra_id = db.Column(db.Integer, db.ForeignKey("obra.id"), nullable=False)
@@ -338,22 +532,34 @@ class CronogramaItem(db.Model):
     obra = db.relationship("Obra", backref=db.backref("cronograma", lazy=True, cascade="all,delete"))
 
 
-# MODELO PARA TEMPLATES DE OP POR PRODUTO
+# MODELO PARA TEMPLATES DE OP POR PRODUTO (versões; ver modelos_op.py)
 class ModeloOP(db.Model):
     __tablename__ = "modelo_op"
+    __table_args__ = (db.Index("ix_modelo_op_produto_versao", "produto", "versao", unique=True),)
     
     id = db.Column(db.Integer, primary_key=True)
     produto = db.Column(db.String(120), nullable=False)
     nome = db.Column(db.String(160), nullable=False)
     descricao = db.Column(db.String(500))
     
-    # Armazenar estrutura de etapas e tarefas em JSON
+    # {"etapas": [hash, ...]} - as etapas e tarefas ficam em BlocoModelo
     dados = db.Column(db.JSON, nullable=False)
+    hash = db.Column(db.String(64))  # hash do conteúdo (versões iguais não se repetem)
+    versao = db.Column(db.Integer)
     
     data_criacao = db.Column(db.DateTime, default=datetime.now)
     
     def __repr__(self):
-        return f'<ModeloOP {self.produto} - {self.nome}>'
+        return f'<ModeloOP {self.produto} v{self.versao} - {self.nome}>'
+
+
+class BlocoModelo(db.Model):
+    """Etapa ou tarefa de modelo, gravada uma vez e endereçada pelo hash"""
+    __tablename__ = "bloco_modelo"
+
+    hash = db.Column(db.String(64), primary_key=True)
+    tipo = db.Column(db.String(10), nullable=False)  # etapa / tarefa
+    dados = db.Column(db.JSON, nullable=False)
 
 
 # NOVO MODELO PARA TAREFAS (opcional, para rastreamento mais detalhado)
@@ -420,6 +626,46 @@ class Tarefa(db.Model):
         return 0.0  # Planejado = 0%
 
 
+contadores.init_app(OP, Obra, Etapa, Tarefa)
+
+
+class Sequencia(db.Model):
+    """Numeração de OPs e tarefas (ver sequencias.py)"""
+    __tablename__ = 'sequencia'
+
+    nome = db.Column(db.String(80), primary_key=True)  # ex: op, tarefa:op:12
+    valor = db.Column(db.Integer, nullable=False, default=0)  # último número entregue
+
+
+sequencias.init_app(db, Sequencia)
+
+
+def _ultimo_numero_op():
+    """Maior número de OP já usado (só na criação da sequência)"""
+    numeros = [int(n) for (n,) in db.session.query(OP.numero) if n and n.isdigit()]
+    return max(numeros, default=0)
+
+
+def proximo_numero_op():
+    return f"{sequencias.proximo('op', inicial=_ultimo_numero_op):02d}"
+
+
+def chave_tarefas_op(op_id):
+    return f"tarefa:op:{op_id}"
+
+
+def reservar_numeros_tarefa(op, quantidade=1):
+    """Primeiro de `quantidade` números de tarefa seguidos da OP"""
+    def ultimo_da_op():
+        sufixos = [
+            int(n.rsplit(".", 1)[-1])
+            for (n,) in db.session.query(Tarefa.numero).join(Etapa).filter(Etapa.op_id == op.id)
+            if n and n.rsplit(".", 1)[-1].isdigit()
+        ]
+        return max(sufixos, default=0)
+    return sequencias.reservar(chave_tarefas_op(op.id), quantidade, inicial=ultimo_da_op)
+
+
 class PendenciaMaterial(db.Model):
     __tablename__ = "pendencia_material"
     
@@ -462,6 +708,9 @@ class ProjetoProduto(db.Model):
         return f'<ProjetoProduto {self.obra.nome} - {self.produto.nome}>'
 
 
+busca.init_app(db, Obra, OP, Tarefa, PendenciaMaterial, ProjetoProduto)
+
+
 # ---------------- FUNÇÕES ----------------
 
 def parse_date(s):
@@ -470,6 +719,7 @@ def parse_date(s):
     return datetime.strptime(s, "%Y-%m-%d").date()
 
 
+@lru_cache(maxsize=4096)
 def calcular_data_fim(data_inicio, horas_previstas, horas_por_dia=9):
     """
     Calcula a data de fim baseada na data de inicio e horas previstas.
@@ -478,17 +728,17 @@ def calcular_data_fim(data_inicio, horas_previstas, horas_por_dia=9):
     if not data_inicio or not horas_previstas or horas_previstas <= 0:
         return data_inicio
     
-    horas_restantes = float(horas_previstas)
-    data_atual = data_inicio
-    
-    while horas_restantes > 0:
-        if data_atual.weekday() < 5:  # Segunda a sexta (0-4)
-            horas_restantes -= horas_por_dia
-        
-        if horas_restantes > 0:
-            data_atual += timedelta(days=1)
-    
-    return data_atual
+    # A data de fim é o N-ésimo dia útil a partir da data de inicio (inclusive)
+    dias_uteis = math.ceil(float(horas_previstas) / horas_por_dia)
+    while data_inicio.weekday() >= 5:
+        data_inicio += timedelta(days=1)
+    semanas, resto = divmod(dias_uteis - 1, 5)
+    if data_inicio.weekday() + resto >= 5:
+        resto += 2  # passa pelo fim de semana
+    return data_inicio + timedelta(days=semanas * 7 + resto)
+
+
+modelos_op.init_app(db, OP, Etapa, Tarefa, ModeloOP, BlocoModelo, calcular_data_fim, chave_tarefas_op)
 
 
 # ---------------- ROTAS ----------------
@@ -642,6 +892,14 @@ def add_maquina():
 
 # --------- OBRAS ---------
 
+@app.template_global()
+def url_pagina(**cursor):
+    """URL da listagem atual com os mesmos filtros/ordem e outro cursor (apos=/antes=)"""
+    args = {k: v for k, v in request.args.items() if k not in ("apos", "antes")}
+    args.update({k: v for k, v in cursor.items() if v})
+    return url_for(request.endpoint, **request.view_args, **args)
+
+
 @app.route("/obras")
 def obras():
     query = Obra.query
@@ -705,12 +963,21 @@ def obras():
     
     coluna = colunas_validas.get(coluna_ordem, Obra.corte_dobra_inicio)
     
-    if ordem == 'asc':
-        obras = query.order_by(coluna.asc()).all()
-    else:
-        obras = query.order_by(coluna.desc()).all()
+    # % da obra e produtos de cada linha: carregados de uma vez para a página
+    query = query.options(
+        selectinload(Obra.ops).selectinload(OP.etapas).selectinload(Etapa.tarefas),
+        selectinload(Obra.produtos).joinedload(ObraProduto.produto),
+    )
+    try:
+        pagina = paginacao.paginar(
+            query, coluna, Obra.id, ordem,
+            apos=request.args.get('apos'), antes=request.args.get('antes'),
+            limite=paginacao.por_pagina(request.args.get('por_pagina')),
+        )
+    except paginacao.CursorInvalido:
+        return redirect(url_pagina())
     
-    return render_template("obras.html", obras=obras, ordem_atual=ordem, coluna_ordem=coluna_ordem)
+    return render_template("obras.html", obras=pagina.itens, pagina=pagina, ordem_atual=ordem, coluna_ordem=coluna_ordem)
 
 
 @app.route("/obras/nova", methods=["GET"])
@@ -763,7 +1030,13 @@ def obra_criar():
 def detalhe_obra(obra_id):
     obra = Obra.query.get_or_404(obra_id)
     produtos = Produto.query.filter_by(ativo=True).order_by(Produto.nome.asc()).all()
-    return render_template("obra_detail.html", obra=obra, produtos=produtos)
+    produtos_ops = {op.produto for op in obra.ops if op.produto}
+    # Só a última versão de cada produto
+    ultimas = (db.session.query(ModeloOP.produto, db.func.max(ModeloOP.versao).label("versao"))
+               .filter(ModeloOP.produto.in_(produtos_ops)).group_by(ModeloOP.produto).subquery())
+    modelos = (ModeloOP.query.join(ultimas, db.and_(ModeloOP.produto == ultimas.c.produto, ModeloOP.versao == ultimas.c.versao))
+               .order_by(ModeloOP.produto).all())
+    return render_template("obra_detail.html", obra=obra, produtos=produtos, modelos=modelos)
 
 
 @app.route("/obras/<int:obra_id>/produto/adicionar", methods=["POST"])
@@ -822,12 +1095,13 @@ def obra_excluir(obra_id):
 
 @app.route("/ops")
 def ops():
-    query = OP.query
+    # Obra de cada linha vem no mesmo SELECT (a tabela mostra código, cliente e datas)
+    query = OP.query.join(Obra, OP.obra_id == Obra.id).options(contains_eager(OP.obra))
     
     # Filtro por cliente
     cliente = request.args.get('cliente', '').strip()
     if cliente:
-        query = query.join(Obra).filter(Obra.cliente.ilike(f'%{cliente}%'))
+        query = query.filter(Obra.cliente.ilike(f'%{cliente}%'))
     
     # Filtro por data de início
     data_inicio_de = request.args.get('data_inicio_de', '').strip()
@@ -889,16 +1163,23 @@ def ops():
     
     coluna = colunas_validas.get(coluna_ordem, OP.id)
     
-    # Se ordenar por colunas de Obra, fazer join
+    # Colunas de Obra: o valor do cursor sai da obra da OP
+    valor = None
     if coluna_ordem in ['corte_dobra_inicio', 'corte_dobra_fim', 'montagem_eletro_inicio', 'montagem_eletro_fim']:
-        query = query.join(Obra, OP.obra_id == Obra.id)
+        valor = lambda op: getattr(op.obra, coluna_ordem)
     
-    if ordem == 'asc':
-        ops = query.order_by(coluna.asc()).all()
-    else:
-        ops = query.order_by(coluna.desc()).all()
+    # % de cada linha (percentual_calc) usa etapas e tarefas: carregadas de uma vez para a página
+    query = query.options(selectinload(OP.etapas).selectinload(Etapa.tarefas))
+    try:
+        pagina = paginacao.paginar(
+            query, coluna, OP.id, ordem,
+            apos=request.args.get('apos'), antes=request.args.get('antes'),
+            limite=paginacao.por_pagina(request.args.get('por_pagina')), valor=valor,
+        )
+    except paginacao.CursorInvalido:
+        return redirect(url_pagina())
     
-    return render_template("ops.html", ops=ops, ordem_atual=ordem, coluna_ordem=coluna_ordem)
+    return render_template("ops.html", ops=pagina.itens, pagina=pagina, ordem_atual=ordem, coluna_ordem=coluna_ordem)
 
 
 @app.route("/ops/nova")
@@ -949,9 +1230,7 @@ def op_criar():
     obra_id = int(request.form["obra_id"])
     
     # Gerar numero automatico de OP
-    ultima_op = OP.query.order_by(OP.id.desc()).first()
-    proximo_numero = 1 if not ultima_op else int(ultima_op.numero) + 1
-    numero = f"{proximo_numero:02d}"
+    numero = proximo_numero_op()
     produto = request.form["produto"].strip()
     quantidade = int(request.form.get("quantidade", 1) or 1)
     prev_inicio = parse_date(request.form.get("prev_inicio"))
@@ -967,7 +1246,7 @@ def op_criar():
     )
 
     db.session.add(op)
-    db.session.commit()
+    db.session.flush()
 
     # Criar etapas padrão
     for etapa_nome in ETAPAS_FIXAS:
@@ -1002,6 +1281,7 @@ def detalhe_op(op_id):
 def excluir_op(op_id):
     op = OP.query.get_or_404(op_id)
     db.session.delete(op)
+    sequencias.remover(chave_tarefas_op(op_id))
     db.session.commit()
     return redirect(url_for("ops"))
 
@@ -1032,15 +1312,18 @@ def salvar_modelo_op(op_id):
             etapa_data['tarefas'].append(tarefa_data)
         dados_etapas.append(etapa_data)
     
-    # Criar modelo
-    modelo = ModeloOP(
-        produto=produto,
-        nome=f"Modelo - {op.numero}",
-        descricao=f"Modelo baseado na OP {op.numero}",
-        dados={'etapas': dados_etapas}
-    )
-    
-    db.session.add(modelo)
+    # Nova versão do modelo do produto (nada é gravado se igual à última)
+    try:
+        modelos_op.salvar(
+            produto,
+            nome=f"Modelo - {op.numero}",
+            descricao=f"Modelo baseado na OP {op.numero}",
+            dados={'etapas': dados_etapas},
+        )
+    except modelos_op.ModeloInvalido as e:
+        db.session.rollback()
+        operadores = Operador.query.filter_by(ativo=True).order_by(Operador.nome.asc()).all()
+        return render_template("op_detail.html", op=op, operadores=operadores, erro=str(e)), 400
     db.session.commit()
     
     return redirect(url_for("detalhe_op", op_id=op_id))
@@ -1053,97 +1336,83 @@ def carregar_modelo_op(op_id):
     op = OP.query.get_or_404(op_id)
     
     if request.method == "GET":
-        modelos = ModeloOP.query.filter_by(produto=op.produto).all()
-        return render_template("carregar_modelo.html", op=op, modelos=modelos)
-    
-    modelo_id = int(request.form.get("modelo_id"))
-    modelo = ModeloOP.query.get_or_404(modelo_id)
+        return render_template("carregar_modelo.html", op=op, modelos=modelos_op.versoes(op.produto))
     
-    for etapa in op.etapas:
-        db.session.delete(etapa)
-    db.session.commit()
+    # Sem modelo_id: última versão do produto
+    modelo_id = request.form.get("modelo_id")
+    modelo = ModeloOP.query.get_or_404(int(modelo_id)) if modelo_id else modelos_op.ultima_versao(op.produto)
+    if modelo is None:
+        abort(404)
     
-    etapas_criadas = {}
-    
-    for etapa_data in modelo.dados.get('etapas', []):
-        etapa = Etapa(
-            op_id=op.id,
-            nome=etapa_data['nome'],
-            percentual=0.0,
-            status="PLANEJADO"
-        )
-        db.session.add(etapa)
-        db.session.flush()
-        etapas_criadas[etapa_data['nome']] = etapa
-        
-        for tarefa_data in etapa_data.get('tarefas', []):
-            data_inicio = None
-            data_fim = None
-            if tarefa_data.get('data_inicio_prev'):
-                try:
-                    data_inicio = datetime.strptime(tarefa_data['data_inicio_prev'], '%Y-%m-%d').date()
-                except:
-                    pass
-            if tarefa_data.get('data_fim_prev'):
-                try:
-                    data_fim = datetime.strptime(tarefa_data['data_fim_prev'], '%Y-%m-%d').date()
-                except:
-                    pass
-            
-            tarefa = Tarefa(
-                etapa_id=etapa.id,
-                numero=None,
-                titulo=tarefa_data['titulo'],
-                descricao=tarefa_data.get('descricao', ''),
-                horas_previstas=tarefa_data.get('horas_previstas', 0.0),
-                responsavel_id=tarefa_data.get('responsavel_id'),
-                data_inicio_prev=data_inicio,
-                data_fim_prev=data_fim,
-                status="PLANEJADO"
-            )
-            db.session.add(tarefa)
-    
-    db.session.flush()
-    
-    # Calcular datas de inicio automaticamente usando data da OP
-    from datetime import timedelta
-    data_op = op.prev_inicio if op.prev_inicio else date.today()
+    try:
+        plano = modelos_op.compilar(modelo)
+    except modelos_op.ModeloInvalido as e:
+        return render_template("carregar_modelo.html", op=op, modelos=modelos_op.versoes(op.produto), erro=str(e)), 400
     
-    for etapa in op.etapas:
-        if not etapa.tarefas:
-            continue
-        
-        data_inicio_etapa = None
-        
-        if etapa.nome in ["CORTE", "DOBRA", "PINTURA", "CALDEIRARIA"]:
-            # Data de inicio = Data da OP
-            data_inicio_etapa = data_op
-        
-        elif etapa.nome == "MONTAGEM":
-            # Data de inicio = Data da OP
-            data_inicio_etapa = data_op
-        
-        elif etapa.nome == "START UP":
-            # Data de inicio = Data da OP + 1 dia
-            data_inicio_etapa = data_op + timedelta(days=1)
-        
-        if data_inicio_etapa:
-            for tarefa in etapa.tarefas:
-                tarefa.data_inicio_prev = data_inicio_etapa
-                if tarefa.horas_previstas > 0:
-                    tarefa.data_fim_prev = calcular_data_fim(data_inicio_etapa, tarefa.horas_previstas, 9)
+    modelos_op.instanciar(plano, [op])
+    db.session.commit()
+    return redirect(url_for("detalhe_op", op_id=op_id))
+
+
+@app.route("/obras/<int:obra_id>/carregar-modelo", methods=["POST"])
+@requer_permissao("editar_op")
+def carregar_modelo_obra(obra_id):
+    """Carrega um modelo em várias OPs da obra de uma vez (uma transação)
+
+    Sem op_ids, usa todas as OPs da obra do mesmo produto do modelo.
+    """
+    obra = Obra.query.get_or_404(obra_id)
+    modelo = ModeloOP.query.get_or_404(int(request.form.get("modelo_id")))
     
-    db.session.flush()
+    op_ids = [int(i) for i in request.form.getlist("op_ids") if i.isdigit()]
+    consulta = OP.query.filter(OP.obra_id == obra.id)
+    if op_ids:
+        consulta = consulta.filter(OP.id.in_(op_ids))
+    else:
+        consulta = consulta.filter(OP.produto == modelo.produto)
+    ops_alvo = consulta.order_by(OP.id).all()
     
-    op_num = str(int(op.numero)) if op.numero else '1'
-    tarefa_idx = 1
-    for etapa in op.etapas:
-        for tarefa in etapa.tarefas:
-            tarefa.numero = f"{op_num}.{tarefa_idx}"
-            tarefa_idx += 1
+    try:
+        plano = modelos_op.compilar(modelo)
+    except modelos_op.ModeloInvalido as e:
+        return f"Modelo inválido: {escape(str(e))}", 400
     
+    modelos_op.instanciar(plano, ops_alvo)
     db.session.commit()
-    return redirect(url_for("detalhe_op", op_id=op_id))
+    return redirect(url_for("detalhe_obra", obra_id=obra_id))
+
+
+@app.route("/api/modelos")
+def api_modelos():
+    """Versões dos modelos de um produto (mais recente primeiro)"""
+    produto = request.args.get("produto", "")
+    return jsonify([
+        {
+            "id": modelo.id,
+            "produto": modelo.produto,
+            "versao": modelo.versao,
+            "nome": modelo.nome,
+            "hash": modelo.hash,
+            "data_criacao": modelo.data_criacao.isoformat() if modelo.data_criacao else None,
+        }
+        for modelo in modelos_op.versoes(produto)
+    ])
+
+
+@app.route("/api/modelos/<int:modelo_id>/diff")
+def api_modelo_diff(modelo_id):
+    """Diferenças para outra versão (?com=<id>; padrão: versão anterior)"""
+    modelo = ModeloOP.query.get_or_404(modelo_id)
+    com = request.args.get("com", type=int)
+    if com:
+        anterior = ModeloOP.query.get_or_404(com)
+    else:
+        anterior = (ModeloOP.query.filter(ModeloOP.produto == modelo.produto, ModeloOP.versao < modelo.versao)
+                    .order_by(ModeloOP.versao.desc()).first())
+        if anterior is None:
+            return jsonify({"erro": "Não há versão anterior"}), 404
+    return jsonify(modelos_op.diferencas(anterior, modelo))
+
 
 @app.route("/ops/<int:op_id>/sincronizar-etapas", methods=["POST"])
 @requer_permissao("editar_op")
@@ -1240,7 +1509,7 @@ def tarefa_nova():
     
     # Verificar se usuario ESPECIALISTA tem permissao para esta etapa
     if session.get('usuario_tipo') == 'ESPECIALISTA':
-        usuario = Usuario.query.get(session.get('usuario_id'))
+        usuario = usuario_atual()
         if usuario and not usuario.tem_permissao("criar_tarefa", etapa.nome):
             return render_template('erro_permissao.html', mensagem=f"Você não tem permissão para criar tarefas na etapa {etapa.nome}"), 403
     
@@ -1311,9 +1580,7 @@ def tarefa_nova():
     if titulo:
         # Gerar numero automatico de Tarefa (ex: 1.1, 1.2, 1.3...)
         op = etapa.op
-        todas_tarefas_op = Tarefa.query.join(Etapa).filter(Etapa.op_id == op.id).all()
-        proximo_subtarefa = len(todas_tarefas_op) + 1
-        numero_tarefa = f"{op.numero}.{proximo_subtarefa}"
+        numero_tarefa = f"{op.numero}.{reservar_numeros_tarefa(op)}"
         
         tarefa = Tarefa(
             etapa_id=etapa_id,
@@ -1339,7 +1606,7 @@ def atualizar_data_tarefa(tarefa_id):
     
     # Verificar se usuario ESPECIALISTA tem permissao para esta etapa
     if session.get('usuario_tipo') == 'ESPECIALISTA':
-        usuario = Usuario.query.get(session.get('usuario_id'))
+        usuario = usuario_atual()
         if usuario and not usuario.tem_permissao("editar_tarefa", tarefa.etapa.nome):
             return render_template('erro_permissao.html', mensagem=f"Você não tem permissão para alterar datas de tarefas na etapa {tarefa.etapa.nome}"), 403
     
@@ -1368,7 +1635,7 @@ def tarefa_atualizar(tarefa_id):
     
     # Verificar se usuario ESPECIALISTA tem permissao para esta etapa
     if session.get('usuario_tipo') == 'ESPECIALISTA':
-        usuario = Usuario.query.get(session.get('usuario_id'))
+        usuario = usuario_atual()
         if usuario and not usuario.tem_permissao("editar_tarefa", tarefa.etapa.nome):
             return render_template('erro_permissao.html', mensagem=f"Você não tem permissão para atualizar tarefas na etapa {tarefa.etapa.nome}"), 403
     
@@ -1403,22 +1670,44 @@ def tarefa_atualizar(tarefa_id):
         db.session.flush()
         
         op = tarefa.etapa.op
-        total_tarefas = Tarefa.query.join(Etapa).filter(Etapa.op_id == op.id).count()
-        tarefas_concluidas = Tarefa.query.join(Etapa).filter(
-            Etapa.op_id == op.id,
-            Tarefa.status == "CONCLUIDO"
-        ).count()
+        eventos.publicar(db.session, eventos.TarefaConcluida(
+            tarefa_id=tarefa.id, op_id=op.id, etapa_id=tarefa.etapa_id, usuario_id=session.get("usuario_id")))
+        total_tarefas = op.tarefas_total
+        tarefas_concluidas = op.tarefas_concluidas
         
         if total_tarefas > 0:
             op.percentual = (tarefas_concluidas / total_tarefas) * 100
         
         if tarefas_concluidas == total_tarefas and total_tarefas > 0:
-            op.status = "CONCLUIDA"
+            _marcar_op_concluida(op, concluir_obra=False)
     
     db.session.commit()
     return redirect(url_for("detalhe_op", op_id=tarefa.etapa.op_id))
 
 
+def _marcar_op_concluida(op, concluir_obra=True):
+    """Conclui a OP (e a obra, se for a última OP) publicando os eventos
+
+    Roda na transação de quem chamou; OPConcluida e ObraConcluida só são
+    entregues depois do commit. Só a conclusão pela tela da tarefa
+    (tarefa_concluir) conclui a obra; as demais rotas passam
+    concluir_obra=False e mexem só na OP.
+    """
+    if op.status == "CONCLUIDA":
+        return
+    op.status = "CONCLUIDA"
+    eventos.publicar(db.session, eventos.OPConcluida(op_id=op.id, obra_id=op.obra_id))
+    if not concluir_obra:
+        return
+    db.session.flush()
+
+    # Atualizar status da Obra se todas as OPs estão concluídas
+    obra = op.obra
+    if 0 < obra.ops_total <= obra.ops_concluidas and obra.status != "CONCLUIDA":
+        obra.status = "CONCLUIDA"
+        eventos.publicar(db.session, eventos.ObraConcluida(obra_id=obra.id))
+
+
 @app.route("/tarefas/<int:tarefa_id>/pausar", methods=["POST"])
 @requer_permissao("editar_tarefa")
 def tarefa_pausar(tarefa_id):
@@ -1426,13 +1715,15 @@ def tarefa_pausar(tarefa_id):
     
     # Verificar se usuario ESPECIALISTA tem permissao para esta etapa
     if session.get('usuario_tipo') == 'ESPECIALISTA':
-        usuario = Usuario.query.get(session.get('usuario_id'))
+        usuario = usuario_atual()
         if usuario and not usuario.tem_permissao("editar_tarefa", tarefa.etapa.nome):
             return render_template('erro_permissao.html', mensagem=f"Você não tem permissão para pausar tarefas na etapa {tarefa.etapa.nome}"), 403
     
     justificativa = request.form.get("justificativa", "")
     tarefa.status = "PAUSADO"
     tarefa.justificativa_pausa = justificativa
+    eventos.publicar(db.session, eventos.TarefaPausada(
+        tarefa_id=tarefa.id, op_id=tarefa.etapa.op_id, justificativa=justificativa))
     
     db.session.commit()
     return redirect(url_for("detalhe_op", op_id=tarefa.etapa.op_id))
@@ -1445,33 +1736,26 @@ def tarefa_concluir(tarefa_id):
     
     # Verificar se usuario ESPECIALISTA tem permissao para esta etapa
     if session.get('usuario_tipo') == 'ESPECIALISTA':
-        usuario = Usuario.query.get(session.get('usuario_id'))
+        usuario = usuario_atual()
         if usuario and not usuario.tem_permissao("editar_tarefa", tarefa.etapa.nome):
             return render_template('erro_permissao.html', mensagem=f"Você não tem permissão para concluir tarefas na etapa {tarefa.etapa.nome}"), 403
     
     tarefa.data_fim_real = datetime.now()
     tarefa.status = "CONCLUIDO"
     
-    db.session.commit()
+    op = tarefa.etapa.op
+    eventos.publicar(db.session, eventos.TarefaConcluida(
+        tarefa_id=tarefa.id, op_id=op.id, etapa_id=tarefa.etapa_id, usuario_id=session.get("usuario_id")))
     
     # Atualizar status da OP se todas as tarefas estão concluídas
-    op = tarefa.etapa.op
-    todas_tarefas = Tarefa.query.join(Etapa).filter(Etapa.op_id == op.id).all()
-    todas_concluidas = all(t.status == "CONCLUIDO" for t in todas_tarefas)
+    # (o flush atualiza os contadores da OP; conferir é ler uma linha)
+    db.session.flush()
     
-    if todas_concluidas:
-        op.status = "CONCLUIDA"
+    if op.tarefas_total > 0 and op.tarefas_concluidas >= op.tarefas_total:
         op.percentual = 100.0
-        db.session.commit()
-        
-        # Atualizar status da Obra se todas as OPs estão concluídas
-        obra = op.obra
-        todas_ops = OP.query.filter_by(obra_id=obra.id).all()
-        todas_ops_concluidas = all(o.status == "CONCLUIDA" for o in todas_ops)
-        
-        if todas_ops_concluidas:
-            obra.status = "CONCLUIDA"
-            db.session.commit()
+        _marcar_op_concluida(op)
+    
+    db.session.commit()
     
     return redirect(url_for("detalhe_op", op_id=tarefa.etapa.op_id))
 
@@ -1483,7 +1767,7 @@ def tarefa_excluir(tarefa_id):
     
     # Verificar se usuario ESPECIALISTA tem permissao para esta etapa
     if session.get('usuario_tipo') == 'ESPECIALISTA':
-        usuario = Usuario.query.get(session.get('usuario_id'))
+        usuario = usuario_atual()
         if usuario and not usuario.tem_permissao("deletar_tarefa", tarefa.etapa.nome):
             return render_template('erro_permissao.html', mensagem=f"Você não tem permissão para deletar tarefas na etapa {tarefa.etapa.nome}"), 403
     op_id = tarefa.etapa.op_id
@@ -1496,22 +1780,56 @@ def tarefa_excluir(tarefa_id):
 
 @app.route("/apontamentos")
 def apontamentos():
-    obras = Obra.query.order_by(Obra.codigo.asc()).all()
-    ops = OP.query.order_by(OP.id.desc()).all()
-    operadores = Operador.query.filter_by(ativo=True).order_by(Operador.nome.asc()).all()
-    maquinas = Maquina.query.filter_by(ativo=True).order_by(Maquina.nome.asc()).all()
-    aponts = Apontamento.query.order_by(Apontamento.id.desc()).limit(50).all()
+    # Obras, operadores e máquinas vêm do cache de cadastros; as OPs e etapas
+    # o formulário busca em /api/opcoes conforme a obra/OP escolhida
+    obras = cache_cadastros.opcoes("obras", limite=None)
+    operadores = cache_cadastros.opcoes("operadores", limite=None)
+    maquinas = cache_cadastros.opcoes("maquinas", limite=None)
+    aponts = (Apontamento.query
+              .options(joinedload(Apontamento.obra), joinedload(Apontamento.op),
+                       joinedload(Apontamento.etapa), joinedload(Apontamento.operador))
+              .order_by(Apontamento.id.desc()).limit(50).all())
 
     return render_template(
         "apontamentos.html",
         obras=obras,
-        ops=ops,
         operadores=operadores,
         maquinas=maquinas,
         aponts=aponts,
+        erro=request.args.get("erro"),
     )
 
 
+def apontamento_sobreposto(operador_id, inicio, fim=None):
+    """Apontamento do operador que bate com [inicio, fim) ou None
+
+    Com os apontamentos do operador sem sobreposição (é o que esta checagem
+    garante) basta olhar o último que começou até `inicio` e o primeiro que
+    começa depois dele: duas buscas no índice (operador_id, inicio).
+    Apontamentos ainda em andamento também contam (fim em aberto).
+    """
+    base = Apontamento.query.filter(Apontamento.operador_id == operador_id)
+    anterior = base.filter(Apontamento.inicio <= inicio).order_by(Apontamento.inicio.desc()).first()
+    if anterior and (anterior.fim is None or anterior.fim > inicio):
+        return anterior
+    posterior = base.filter(Apontamento.inicio > inicio)
+    if fim is not None:
+        posterior = posterior.filter(Apontamento.inicio < fim)
+    posterior = posterior.order_by(Apontamento.inicio.asc()).first()
+    if posterior:
+        return posterior
+    # Dados antigos podem ter um apontamento aberto mais para trás
+    return base.filter(Apontamento.status == "EM_ANDAMENTO", Apontamento.inicio <= inicio).first()
+
+
+def horas_apontadas(apontamentos, uniao=False):
+    """Horas dos apontamentos finalizados; `uniao` conta sobreposições uma vez só"""
+    spans = [(ap.inicio, ap.fim) for ap in apontamentos if ap.inicio and ap.fim]
+    if uniao:
+        return round(intervalos.segundos_unidos(spans) / 3600, 2)
+    return round(intervalos.segundos(spans) / 3600, 2)
+
+
 @app.route("/apontamentos/novo", methods=["POST"])
 def apontamento_novo():
     obra_id = int(request.form["obra_id"])
@@ -1539,6 +1857,14 @@ def apontamento_novo():
         status="EM_ANDAMENTO",
     )
 
+    # Checagem e INSERT na mesma transação, com o operador travado: duas
+    # inclusões simultâneas não passam as duas pela checagem
+    travar(db.session, Operador.id, [operador_id])
+    conflito = apontamento_sobreposto(operador_id, ap.inicio)
+    if conflito:
+        erro = f"Operador já tem o apontamento #{conflito.id} ({conflito.op.numero} / {conflito.etapa.nome}) nesse horário"
+        return redirect(url_for("apontamentos", erro=erro))
+
     db.session.add(ap)
     db.session.commit()
     return redirect(url_for("apontamentos"))
@@ -1547,8 +1873,27 @@ def apontamento_novo():
 @app.route("/apontamentos/<int:ap_id>/finalizar", methods=["POST"])
 def apontamento_finalizar(ap_id):
     ap = Apontamento.query.get_or_404(ap_id)
-    ap.fim = datetime.now()
-    ap.status = "FINALIZADO"
+    agora = datetime.now()
+    # UPDATE condicional: com dois cliques (ou duas abas) só quem mudou a
+    # linha soma as horas. Refinalizar tira as horas antigas antes de somar
+    # as novas, desde que o fim gravado ainda seja o que foi lido.
+    refinalizar = ap.status == "FINALIZADO"
+    condicao = Apontamento.status == ap.status
+    if refinalizar:
+        condicao = condicao & (Apontamento.fim == ap.fim)
+        agregado_horas.registrar(ap, -1)
+    resultado = db.session.execute(
+        db.update(Apontamento)
+        .where(Apontamento.id == ap.id, condicao)
+        .values(fim=agora, status="FINALIZADO")
+    )
+    if resultado.rowcount != 1:
+        db.session.rollback()
+        return redirect(url_for("apontamentos"))
+    agregado_horas.registrar(ap)
+    eventos.publicar(db.session, eventos.ApontamentoFinalizado(
+        apontamento_id=ap.id, op_id=ap.op_id, etapa_id=ap.etapa_id,
+        operador_id=ap.operador_id, maquina_id=ap.maquina_id))
     db.session.commit()
     return redirect(url_for("apontamentos"))
 
@@ -1613,16 +1958,22 @@ def relatorios():
 @app.route("/relatorios/tempo")
 def rel_tempo():
     """Relatório de gestão de tempo por etapa"""
-    etapas = Etapa.query.all()
+    # Uma consulta: etapas (com a OP) + horas somadas da tabela agregada
+    horas = agregado_horas.subconsulta_por_etapa()
+    linhas = (db.session.query(Etapa, db.func.coalesce(horas.c.segundos, 0.0))
+              .outerjoin(horas, horas.c.etapa_id == Etapa.id)
+              .options(joinedload(Etapa.op)).all())
     
     relatorio = []
-    for etapa in etapas:
+    for etapa, segundos in linhas:
+        horas_planejadas = etapa.horas_planejadas or 0.0
+        horas_realizadas = round(segundos / 3600, 2)
         relatorio.append({
             "etapa": etapa,
-            "horas_planejadas": etapa.horas_planejadas,
-            "horas_realizadas": etapa.horas_realizadas,
-            "diferenca": etapa.horas_planejadas - etapa.horas_realizadas,
-            "percentual_utilizacao": (etapa.horas_realizadas / etapa.horas_planejadas * 100) if etapa.horas_planejadas > 0 else 0
+            "horas_planejadas": horas_planejadas,
+            "horas_realizadas": horas_realizadas,
+            "diferenca": horas_planejadas - horas_realizadas,
+            "percentual_utilizacao": (horas_realizadas / horas_planejadas * 100) if horas_planejadas > 0 else 0
         })
     
     return render_template("rel_tempo.html", relatorio=relatorio)
@@ -1632,10 +1983,15 @@ def rel_tempo():
 def rel_operador():
     """Relatório de horas por operador e etapa"""
     operadores = Operador.query.filter_by(ativo=True).order_by(Operador.nome.asc()).all()
+    # horas=uniao: apontamentos sobrepostos do mesmo operador contam uma vez só
+    uniao = request.args.get("horas") == "uniao"
     
     relatorio = []
+    totais = []
     for operador in operadores:
         aponts = Apontamento.query.filter_by(operador_id=operador.id).filter_by(status="FINALIZADO").all()
+        if aponts:
+            totais.append({"operador": operador.nome, "horas": horas_apontadas(aponts, uniao=uniao)})
         
         for apont in aponts:
             relatorio.append({
@@ -1646,7 +2002,7 @@ def rel_operador():
                 "data": apont.fim.strftime("%d/%m/%Y") if apont.fim else "-"
             })
     
-    return render_template("rel_operador.html", relatorio=relatorio)
+    return render_template("rel_operador.html", relatorio=relatorio, totais=totais, uniao=uniao)
 
 
 @app.route("/relatorios/tarefas")
@@ -1673,6 +2029,8 @@ def rel_semanal():
     responsavel_id = request.args.get("responsavel_id", type=int)
     data_inicio = request.args.get("data_inicio")
     data_fim = request.args.get("data_fim")
+    # horas=uniao: apontamentos sobrepostos do mesmo operador contam uma vez só
+    uniao = request.args.get("horas") == "uniao"
     
     # Se não especificar datas, usar últimas 8 semanas
     if not data_fim:
@@ -1714,6 +2072,11 @@ def rel_semanal():
         total_planejado = 0
         total_realizado = 0
         
+        apontos = Apontamento.query.filter_by(
+            operador_id=operador.id,
+            status="FINALIZADO"
+        ).all()
+        
         for inicio_semana, fim_semana in semanas:
             # Etapas alocadas nesta semana
             etapas = Etapa.query.filter_by(responsavel_id=operador.id).all()
@@ -1731,14 +2094,10 @@ def rel_semanal():
                         horas_real_semana += etapa.horas_realizadas
             
             # Apontamentos nesta semana
-            apontos = Apontamento.query.filter_by(
-                operador_id=operador.id,
-                status="FINALIZADO"
-            ).all()
-            
-            for apont in apontos:
-                if apont.fim and inicio_semana <= apont.fim.date() <= fim_semana:
-                    horas_real_semana += apont.horas_gastas
+            horas_real_semana += horas_apontadas(
+                [apont for apont in apontos if apont.fim and inicio_semana <= apont.fim.date() <= fim_semana],
+                uniao=uniao,
+            )
             
             dados_semanas.append({
                 "semana_inicio": inicio_semana,
@@ -1769,6 +2128,7 @@ def rel_semanal():
         semanas=semanas,
         operadores=operadores,
         responsavel_id=responsavel_id,
+        uniao=uniao,
         data_inicio=data_inicio.strftime("%Y-%m-%d"),
         data_fim=data_fim.strftime("%Y-%m-%d"),
         todos_operadores=Operador.query.filter_by(ativo=True).order_by(Operador.nome.asc()).all()
@@ -1960,6 +2320,22 @@ def api_obra_ops(obra_id):
     }
 
 
+@app.route("/api/opcoes/<tipo>")
+def api_opcoes(tipo):
+    """Pares [id, rótulo] para selects: ?q=prefixo&limite=20&obra_id=&op_id="""
+    try:
+        itens = cache_cadastros.opcoes(
+            tipo,
+            request.args.get("q", ""),
+            request.args.get("limite", cache_cadastros.LIMITE_PADRAO, type=int),
+            obra_id=request.args.get("obra_id", type=int),
+            op_id=request.args.get("op_id", type=int),
+        )
+    except ValueError as e:
+        return {"erro": str(e)}, 400
+    return {"itens": itens}
+
+
 @app.route("/api/op/<int:op_id>/etapas")
 def api_op_etapas(op_id):
     """API para buscar etapas de uma OP"""
@@ -2561,6 +2937,30 @@ def imprimir_tarefa(tarefa_id):
 
 # ------------ START ----------------
 
+def autenticar(email, senha):
+    """Login com limite de tentativas e hash no pool; devolve (usuario, erro, status)"""
+    espera = seguranca_login.limitar_tentativa(email)
+    if espera:
+        return None, f"Muitas tentativas de login. Aguarde {espera} segundos.", 429
+
+    usuario = Usuario.query.filter_by(email=email).first()
+    if not usuario or not usuario.ativo:
+        return None, "Email ou senha incorretos", 401
+
+    try:
+        ok, novo_hash = seguranca_login.verificar_senha(usuario.senha_hash, senha)
+    except (seguranca_login.Sobrecarga, TimeoutError):
+        return None, "Servidor ocupado, tente novamente em alguns segundos", 503
+    if not ok:
+        return None, "Email ou senha incorretos", 401
+
+    if novo_hash:
+        # Senha gravada com outro custo de hash: atualiza agora
+        usuario.senha_hash = novo_hash
+        db.session.commit()
+    return usuario, None, 200
+
+
 @app.route("/login", methods=["GET", "POST"])
 def login():
     """Página de login"""
@@ -2568,15 +2968,15 @@ def login():
         email = request.form.get("email", "").strip()
         senha = request.form.get("senha", "").strip()
         
-        usuario = Usuario.query.filter_by(email=email).first()
+        usuario, erro, status = autenticar(email, senha)
         
-        if usuario and usuario.verificar_senha(senha) and usuario.ativo:
+        if usuario:
             session['usuario_id'] = usuario.id
             session['usuario_nome'] = usuario.nome
             session['usuario_tipo'] = usuario.tipo
             return redirect(url_for("dashboard"))
         else:
-            return render_template("login.html", erro="Email ou senha incorretos")
+            return render_template("login.html", erro=erro), status
     
     return render_template("login.html")
 
@@ -2614,7 +3014,7 @@ def materiais():
             db.session.add(pendencia)
             db.session.commit()
             
-            print(f"✅ Pendência de material criada: {descricao}")
+            log_materiais.info("Pendência de material criada", extra={"pendencia_id": pendencia.id, "descricao": descricao})
     
     # Buscar todas as pendências
     pendencias = PendenciaMaterial.query.order_by(PendenciaMaterial.data_criacao.desc()).all()
@@ -2638,11 +3038,16 @@ def atualizar_status_pendencia(pendencia_id):
     novo_status = request.form.get("status")
     
     if novo_status in ["PENDENTE", "RECEBIDO", "CANCELADO"]:
+        status_anterior = pendencia.status
         pendencia.status = novo_status
         pendencia.data_atualizacao = datetime.now()
+        eventos.publicar(db.session, eventos.PendenciaAtualizada(
+            pendencia_id=pendencia.id, obra_id=pendencia.obra_id, status=novo_status))
+        if novo_status == "RECEBIDO" and status_anterior != "RECEBIDO":
+            eventos.publicar(db.session, eventos.PendenciaRecebida(pendencia_id=pendencia.id, obra_id=pendencia.obra_id))
         db.session.commit()
         
-        print(f"✅ Status da pendência atualizado para: {novo_status}")
+        log_materiais.info("Status da pendência atualizado", extra={"pendencia_id": pendencia_id, "status": novo_status})
         return redirect(url_for("materiais"))
     
     return jsonify({"erro": "Status inválido"}), 400
@@ -2659,7 +3064,7 @@ def deletar_pendencia(pendencia_id):
     db.session.delete(pendencia)
     db.session.commit()
     
-    print(f"✅ Pendência deletada")
+    log_materiais.info("Pendência deletada", extra={"pendencia_id": pendencia_id})
     return redirect(url_for("materiais"))
 
 
@@ -2807,6 +3212,14 @@ def criar_usuarios_padrao():
             usuario.definir_senha(dados["senha"])
             db.session.add(usuario)
             print(f"✅ Usuario criado: {dados['email']} ({dados['tipo']})")
+
+            # Etapas liberadas dos especialistas: só ao criar o usuário (depois
+            # quem manda é o admin, mesmo que ele revogue todas)
+            etapas = permissoes.ETAPAS_ESPECIALISTAS_PADRAO.get(dados["email"], [])
+            for etapa_nome in etapas:
+                usuario.etapas_liberadas.append(UsuarioEtapa(etapa_nome=etapa_nome))
+            if etapas:
+                print(f"✅ Etapas liberadas para {dados['email']}: {', '.join(etapas)}")
         else:
             print(f"⚠️ Usuario ja existe: {dados['email']}")
     
@@ -3096,9 +3509,7 @@ def api_apresentacao():
         })
     
     except Exception as e:
-        print(f"[ERRO] {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log_api.exception("Erro na API da apresentação")
         return jsonify({'error': str(e)}), 500
 
 
@@ -3148,7 +3559,7 @@ def api_dashboard():
             }
         })
     except Exception as e:
-        print(f"[ERRO API DASHBOARD] {str(e)}")
+        log_api.exception("Erro na API do dashboard")
         return jsonify({"error": str(e)}), 500
 
 
@@ -3191,7 +3602,7 @@ def api_obras():
         
         return jsonify(resultado)
     except Exception as e:
-        print(f"[ERRO API OBRAS] {str(e)}")
+        log_api.exception("Erro na API de obras")
         return jsonify({"error": str(e)}), 500
 
 
@@ -3221,7 +3632,7 @@ def api_ops():
         
         return jsonify(resultado)
     except Exception as e:
-        print(f"[ERRO API OPS] {str(e)}")
+        log_api.exception("Erro na API de OPs")
         return jsonify({"error": str(e)}), 500
 
 
@@ -3287,9 +3698,7 @@ def api_op_detalhes(op_id):
         
         return jsonify(resultado)
     except Exception as e:
-        print(f"[ERRO API OP DETALHES] {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log_api.exception("Erro na API de detalhes da OP")
         return jsonify({"success": False, "message": "Erro ao buscar detalhes da OP"}), 500
 
 
@@ -3316,7 +3725,7 @@ def api_op_atualizar(op_id):
         
         return jsonify({"success": True, "message": "OP atualizada com sucesso"})
     except Exception as e:
-        print(f"[ERRO API ATUALIZAR OP] {str(e)}")
+        log_api.exception("Erro na API ao atualizar OP")
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
@@ -3344,13 +3753,14 @@ def api_etapa_atualizar(etapa_id):
         
         return jsonify({"success": True, "message": "Etapa atualizada com sucesso"})
     except Exception as e:
-        print(f"[ERRO API ATUALIZAR ETAPA] {str(e)}")
+        log_api.exception("Erro na API ao atualizar etapa")
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
 
 # ============ API LOGIN (MOBILE) ============
 @app.route("/api/login", methods=["POST"])
+@tokens_api.requer_segredo
 def api_login():
     """API de login para app mobile - retorna JSON"""
     try:
@@ -3364,9 +3774,10 @@ def api_login():
                 "message": "Email e senha são obrigatórios"
             }), 400
         
-        usuario = Usuario.query.filter_by(email=email).first()
+        usuario, erro, status = autenticar(email, senha)
         
-        if usuario and usuario.verificar_senha(senha) and usuario.ativo:
+        if usuario:
+            perfil = permissoes.cache.obter(usuario.id, _carregar_perfil_acesso)
             return jsonify({
                 "success": True,
                 "message": "Login realizado com sucesso",
@@ -3375,38 +3786,71 @@ def api_login():
                     "nome": usuario.nome,
                     "email": usuario.email,
                     "tipo": usuario.tipo
-                }
+                },
+                **tokens_api.emitir_par(perfil)
             }), 200
         else:
             return jsonify({
                 "success": False,
-                "message": "Email ou senha incorretos"
-            }), 401
+                "message": erro
+            }), status
             
     except Exception as e:
-        print(f"[API LOGIN] Erro: {str(e)}")
+        log_api.exception("Erro no login da API")
         return jsonify({
             "success": False,
             "message": "Erro ao processar login"
         }), 500
 
 
+# ============ API TOKENS (MOBILE) ============
+@app.route("/api/token/refresh", methods=["POST"])
+@tokens_api.requer_segredo
+def api_token_refresh():
+    """Troca um refresh token válido por um novo par de tokens"""
+    data = request.get_json(silent=True) or {}
+    try:
+        claims = tokens_api.ler_token(data.get("refresh_token", ""), "refresh")
+    except tokens_api.TokenInvalido as e:
+        return jsonify({"success": False, "message": str(e)}), 401
+
+    # Relê o usuário: mudanças de tipo/etapas e desativação valem aqui
+    permissoes.cache.invalidar(claims["sub"])
+    perfil = permissoes.cache.obter(claims["sub"], _carregar_perfil_acesso)
+    if not perfil or not perfil.ativo:
+        return jsonify({"success": False, "message": "Usuário não encontrado ou inativo"}), 401
+
+    # Refresh token de uso único: só um refresh consegue revogá-lo
+    if not revogar_token(claims):
+        return jsonify({"success": False, "message": "Token revogado"}), 401
+    return jsonify({"success": True, **tokens_api.emitir_par(perfil)}), 200
+
+
+@app.route("/api/logout", methods=["POST"])
+@tokens_api.requer_token
+def api_logout():
+    """Revoga o access token e, se enviado, o refresh token"""
+    revogar_token(g.token_claims)
+    data = request.get_json(silent=True) or {}
+    if data.get("refresh_token"):
+        try:
+            revogar_token(tokens_api.ler_token(data["refresh_token"], "refresh"))
+        except tokens_api.TokenInvalido:
+            pass
+    return jsonify({"success": True, "message": "Logout realizado"}), 200
+
+
 # ============ API ATUALIZAR TAREFA (MOBILE) ============
 @app.route("/api/tarefas/<int:tarefa_id>/atualizar", methods=["POST"])
+@tokens_api.requer_token
 def api_tarefa_atualizar(tarefa_id):
     """API para atualizar status e percentual de uma tarefa"""
     try:
         data = request.get_json()
-        usuario_id = data.get("usuario_id")
         status = data.get("status")
         percentual = data.get("percentual")
         
-        if not usuario_id:
-            return jsonify({"success": False, "message": "Usuário não informado"}), 400
-        
-        usuario = Usuario.query.get(usuario_id)
-        if not usuario or not usuario.ativo:
-            return jsonify({"success": False, "message": "Usuário não encontrado ou inativo"}), 404
+        usuario = g.usuario_token
         
         tarefa = Tarefa.query.get(tarefa_id)
         if not tarefa:
@@ -3419,6 +3863,7 @@ def api_tarefa_atualizar(tarefa_id):
         if not usuario.tem_permissao("editar_tarefa", etapa.nome):
             return jsonify({"success": False, "message": f"Você não tem permissão para editar tarefas da etapa {etapa.nome}"}), 403
         
+        concluiu = status == "CONCLUIDO" and tarefa.status != "CONCLUIDO"
         if status is not None:
             tarefa.status = status
         
@@ -3428,7 +3873,13 @@ def api_tarefa_atualizar(tarefa_id):
             perc = float(percentual)
             tarefa.horas_realizadas = (perc / 100.0) * tarefa.horas_previstas
         
-        db.session.commit()
+        if concluiu:
+            eventos.publicar(db.session, eventos.TarefaConcluida(
+                tarefa_id=tarefa.id, op_id=etapa.op_id, etapa_id=etapa.id, usuario_id=usuario.id))
+        else:
+            eventos.publicar(db.session, eventos.TarefaAtualizada(
+                tarefa_id=tarefa.id, op_id=etapa.op_id, status=tarefa.status))
+        db.session.flush()
         
         todas_tarefas_etapa = Tarefa.query.filter_by(etapa_id=etapa.id).all()
         if todas_tarefas_etapa:
@@ -3445,7 +3896,10 @@ def api_tarefa_atualizar(tarefa_id):
         op = OP.query.get(etapa.op_id)
         if op:
             op.percentual = op.percentual_calc
-            op.status = op.status_calc
+            if op.status_calc == "CONCLUIDA":
+                _marcar_op_concluida(op, concluir_obra=False)
+            else:
+                op.status = op.status_calc
         
         db.session.commit()
         
@@ -3457,9 +3911,7 @@ def api_tarefa_atualizar(tarefa_id):
         
     except Exception as e:
         db.session.rollback()
-        print(f"[API ATUALIZAR TAREFA] Erro: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log_api.exception("Erro na API ao atualizar tarefa")
         return jsonify({"success": False, "message": "Erro ao atualizar tarefa"}), 500
 
 
@@ -3467,10 +3919,366 @@ def api_tarefa_atualizar(tarefa_id):
 # FIM DAS ROTAS API
 # ============================================
 
+
+# ============ ADMIN: DESEMPENHO ============
+
+@app.route("/admin/perf")
+@requer_permissao("administrar")
+def admin_perf():
+    """Percentis de tempo e quantidade de queries por rota (deste worker)"""
+    return render_template(
+        "admin_perf.html",
+        rotas=perfil_requisicoes.estatisticas.resumo(),
+        pid=os.getpid(),
+        n1_min=perfil_requisicoes.N1_MIN,
+    )
+
+
+@app.route("/admin/perf/limpar", methods=["POST"])
+@requer_permissao("administrar")
+def admin_perf_limpar():
+    """Descarta as amostras deste worker"""
+    perfil_requisicoes.estatisticas.limpar()
+    return redirect(url_for("admin_perf"))
+
+
+# ============ UTILIZAÇÃO DE MÁQUINAS ============
+
+class MaquinaDia(db.Model):
+    """Apontamentos finalizados por máquina e dia (ver utilizacao_maquinas.py)"""
+    __tablename__ = 'maquina_dia'
+
+    maquina_id = db.Column(db.Integer, db.ForeignKey("maquina.id"), primary_key=True)
+    dia = db.Column(db.Date, primary_key=True, index=True)
+    segundos_ocupados = db.Column(db.Float, nullable=False, default=0.0)  # união dos intervalos do dia
+    qtd_boa = db.Column(db.Integer, nullable=False, default=0)
+    qtd_refugo = db.Column(db.Integer, nullable=False, default=0)
+    apontamentos = db.Column(db.Integer, nullable=False, default=0)
+
+
+utilizacao_maquinas.init_app(db, Apontamento, Maquina, MaquinaDia)
+
+
+def _periodo_relatorio(dias_padrao=30):
+    """data_inicio / data_fim da query string (padrão: últimos `dias_padrao` dias)"""
+    data_fim = parse_date(request.args.get("data_fim")) or date.today()
+    data_inicio = parse_date(request.args.get("data_inicio")) or data_fim - timedelta(days=dias_padrao - 1)
+    return data_inicio, data_fim
+
+
+@app.route("/relatorios/maquinas")
+def rel_maquinas():
+    """Utilização, qualidade e OEE por máquina e por setor"""
+    data_inicio, data_fim = _periodo_relatorio()
+    resumo = utilizacao_maquinas.resumo(data_inicio, data_fim)
+    return render_template("rel_maquinas.html", resumo=resumo, data_inicio=data_inicio, data_fim=data_fim)
+
+
+@app.route("/api/relatorios/maquinas")
+def api_rel_maquinas():
+    data_inicio, data_fim = _periodo_relatorio()
+    return jsonify(utilizacao_maquinas.resumo(data_inicio, data_fim))
+
+
+def conflitos_apontamentos(data_inicio, data_fim):
+    """Apontamentos sobrepostos do mesmo operador no período, com horas somadas x unidas"""
+    de = datetime.combine(data_inicio, datetime.min.time())
+    ate = datetime.combine(data_fim + timedelta(days=1), datetime.min.time())
+    aponts = (Apontamento.query.options(joinedload(Apontamento.operador))
+              .filter(Apontamento.inicio < ate, db.or_(Apontamento.fim.is_(None), Apontamento.fim > de))
+              .order_by(Apontamento.operador_id, Apontamento.inicio).all())
+
+    por_operador = {}
+    for ap in aponts:
+        por_operador.setdefault(ap.operador_id, []).append(ap)
+
+    relatorio = []
+    for lista in por_operador.values():
+        pares = intervalos.conflitos([(ap.inicio, ap.fim, ap) for ap in lista if ap.inicio])
+        if not pares:
+            continue
+        relatorio.append({
+            "operador_id": lista[0].operador_id,
+            "operador": lista[0].operador.nome,
+            "horas_somadas": horas_apontadas(lista),
+            "horas_unidas": horas_apontadas(lista, uniao=True),
+            "conflitos": [{
+                "apontamento_a": a.id,
+                "apontamento_b": b.id,
+                "inicio_a": a.inicio.isoformat(),
+                "fim_a": a.fim.isoformat() if a.fim else None,
+                "inicio_b": b.inicio.isoformat(),
+                "fim_b": b.fim.isoformat() if b.fim else None,
+            } for a, b in pares],
+        })
+    return relatorio
+
+
+@app.route("/relatorios/conflitos-apontamentos")
+def rel_conflitos_apontamentos():
+    """Apontamentos do mesmo operador que se sobrepõem no tempo"""
+    data_inicio, data_fim = _periodo_relatorio()
+    return render_template(
+        "rel_conflitos.html",
+        relatorio=conflitos_apontamentos(data_inicio, data_fim),
+        data_inicio=data_inicio,
+        data_fim=data_fim,
+    )
+
+
+@app.route("/api/relatorios/conflitos-apontamentos")
+def api_rel_conflitos_apontamentos():
+    data_inicio, data_fim = _periodo_relatorio()
+    return jsonify(conflitos_apontamentos(data_inicio, data_fim))
+
+
+# ============ APONTAMENTOS EM LOTE ============
+
+LOTE_MAX = int(os.environ.get("PCP_LOTE_MAX", "5000"))
+
+
+@app.route("/api/apontamentos/lote", methods=["POST"])
+@tokens_api.requer_token
+def api_apontamentos_lote():
+    """Recebe eventos de início/fim de apontamento em lote (ver lote_apontamentos.py)
+
+    Corpo em JSON (lista ou {"eventos": [...]}) ou NDJSON
+    (Content-Type: application/x-ndjson, um evento por linha).
+    """
+    if request.mimetype == "application/x-ndjson":
+        lista = []
+        for numero, linha in enumerate(request.get_data(as_text=True).splitlines(), 1):
+            if not linha.strip():
+                continue
+            try:
+                lista.append(json.loads(linha))
+            except ValueError:
+                return jsonify({"success": False, "message": f"Linha {numero} não é JSON válido"}), 400
+    else:
+        data = request.get_json(silent=True)
+        lista = data.get("eventos") if isinstance(data, dict) else data
+        if not isinstance(lista, list):
+            return jsonify({"success": False, "message": "Envie uma lista de eventos"}), 400
+    if not lista:
+        return jsonify({"success": False, "message": "Nenhum evento enviado"}), 400
+    if len(lista) > LOTE_MAX:
+        return jsonify({"success": False, "message": f"Máximo de {LOTE_MAX} eventos por lote"}), 413
+
+    try:
+        resultados = lote_apontamentos.processar(lista)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    aceitos = sum(1 for r in resultados if r["ok"])
+    return jsonify({
+        "success": aceitos == len(resultados),
+        "message": f"{aceitos} de {len(resultados)} eventos aceitos",
+        "aceitos": aceitos,
+        "rejeitados": len(resultados) - aceitos,
+        "resultados": resultados,
+    }), 200
+
+
+# ============ BUSCA ============
+
+def _resultados_busca(achados):
+    """Dados de exibição dos (tipo, id, rank) da busca, na mesma ordem"""
+    ids = {}
+    for tipo, id_, _ in achados:
+        ids.setdefault(tipo, []).append(id_)
+    itens = {}
+    if "obra" in ids:
+        for o in Obra.query.filter(Obra.id.in_(ids["obra"])):
+            itens["obra", o.id] = {"titulo": f"{o.codigo} - {o.nome}", "detalhe": o.cliente,
+                                   "url": url_for("detalhe_obra", obra_id=o.id)}
+    if "op" in ids:
+        for op in OP.query.options(joinedload(OP.obra)).filter(OP.id.in_(ids["op"])):
+            itens["op", op.id] = {"titulo": f"OP {op.numero}", "detalhe": f"{op.produto or ''} · {op.obra.codigo}",
+                                  "url": url_for("detalhe_op", op_id=op.id)}
+    if "tarefa" in ids:
+        consulta = (db.session.query(Tarefa, Etapa.nome, Etapa.op_id, OP.numero)
+                    .join(Etapa, Tarefa.etapa_id == Etapa.id).join(OP, Etapa.op_id == OP.id)
+                    .filter(Tarefa.id.in_(ids["tarefa"])))
+        for t, etapa, op_id, numero in consulta:
+            itens["tarefa", t.id] = {"titulo": f"{t.numero or ''} {t.titulo}".strip(), "detalhe": f"OP {numero} · {etapa}",
+                                     "url": url_for("detalhe_op", op_id=op_id)}
+    if "pendencia" in ids:
+        for p in PendenciaMaterial.query.options(joinedload(PendenciaMaterial.obra)).filter(PendenciaMaterial.id.in_(ids["pendencia"])):
+            itens["pendencia", p.id] = {"titulo": p.descricao, "detalhe": f"{p.obra.codigo} · {p.status}",
+                                        "url": url_for("materiais")}
+    if "projeto" in ids:
+        for p in ProjetoProduto.query.options(joinedload(ProjetoProduto.obra)).filter(ProjetoProduto.id.in_(ids["projeto"])):
+            itens["projeto", p.id] = {"titulo": p.descricao or p.link, "detalhe": p.obra.codigo, "url": p.link}
+    return [
+        {"tipo": tipo, "id": id_, "rank": round(rank, 4), **itens[tipo, id_]}
+        for tipo, id_, rank in achados if (tipo, id_) in itens
+    ]
+
+
+@app.route("/api/busca")
+def api_busca():
+    """Busca em obras, OPs, tarefas, pendências e projetos: ?q=texto&tipos=obra,op&limite=20"""
+    consulta = request.args.get("q", "").strip()
+    tipos = [t for t in request.args.get("tipos", "").split(",") if t] or None
+    limite = request.args.get("limite", busca.LIMITE_PADRAO, type=int)
+    if not consulta:
+        return {"consulta": consulta, "resultados": []}
+    return {"consulta": consulta, "resultados": _resultados_busca(busca.buscar(consulta, tipos, limite))}
+
+
+# ============ MÉTRICAS (PROMETHEUS) ============
+
+metricas.registrar_gauge(
+    "pcp_apontamentos_ativos",
+    "Apontamentos em andamento",
+    lambda: Apontamento.query.filter_by(status="EM_ANDAMENTO").count(),
+)
+metricas.registrar_gauge(
+    "pcp_tarefas_atrasadas",
+    "Tarefas com data de fim prevista vencida e não concluídas",
+    lambda: Tarefa.query.filter(Tarefa.data_fim_prev < date.today(), Tarefa.status != "CONCLUIDO").count(),
+)
+
+
+# ============ ASSINANTES DE EVENTOS ============
+
+# Avisos no Telegram de OP/obra concluída e material recebido: desligados por
+# padrão (o sistema não mandava essas mensagens); PCP_AVISOS_TELEGRAM=1 liga
+AVISOS_TELEGRAM = os.environ.get("PCP_AVISOS_TELEGRAM") == "1"
+
+
+def avisar_op_concluida(evento):
+    op = OP.query.get(evento.op_id)
+    if not op:
+        return
+    notificacoes.enfileirar("telegram", f"✅ <b>OP {escape(op.numero)} concluída</b>\n🏗️ {escape(op.obra.codigo or '')} {escape(op.obra.nome or '')}")
+    db.session.commit()
+
+
+def avisar_obra_concluida(evento):
+    obra = Obra.query.get(evento.obra_id)
+    if not obra:
+        return
+    notificacoes.enfileirar("telegram", f"🏁 <b>Obra concluída</b>\n🏗️ {escape(obra.codigo or '')} {escape(obra.nome or '')}")
+    db.session.commit()
+
+
+def avisar_material_recebido(evento):
+    pendencia = PendenciaMaterial.query.get(evento.pendencia_id)
+    if not pendencia:
+        return
+    notificacoes.enfileirar("telegram", f"📦 <b>Material recebido</b>\n{escape(pendencia.descricao)}\n🏗️ {escape(pendencia.obra.nome or '')}")
+    db.session.commit()
+
+
+if AVISOS_TELEGRAM:
+    eventos.assinar(eventos.OPConcluida, assincrono=True)(avisar_op_concluida)
+    eventos.assinar(eventos.ObraConcluida, assincrono=True)(avisar_obra_concluida)
+    eventos.assinar(eventos.PendenciaRecebida, assincrono=True)(avisar_material_recebido)
+
+
+@eventos.assinar(eventos.ApontamentoFinalizado, assincrono=True)
+def atualizar_utilizacao_maquina(evento):
+    if not evento.maquina_id:
+        return
+    ap = Apontamento.query.get(evento.apontamento_id)
+    if ap:
+        utilizacao_maquinas.atualizar_apontamento(ap)
+        db.session.commit()
+
+
+# ============ AGENDADOR ============
+
+class ExecucaoJob(db.Model):
+    """Histórico das execuções dos jobs agendados (ver agendador.py)"""
+    __tablename__ = 'execucao_job'
+    __table_args__ = (db.Index("ix_execucao_job_job_inicio", "job_id", "inicio"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(60), nullable=False)
+    inicio = db.Column(db.DateTime, nullable=False)
+    duracao_ms = db.Column(db.Float)
+    sucesso = db.Column(db.Boolean, default=True)
+    resultado = db.Column(db.String(200))
+    erro = db.Column(db.String(500))
+
+
+scheduler = agendador.Agendador()
+scheduler.init_app(app, db, ExecucaoJob)
+
+
+@scheduler.job("*/5 * * * *", id="tarefas_atrasadas", name="Resumo de tarefas atrasadas")
+def job_tarefas_atrasadas():
+    return verificar_tarefas_atrasadas()
+
+
+@scheduler.job("15 3 * * *", id="limpeza", name="Limpeza de tokens, notificações e histórico antigos")
+def job_limpeza():
+    agora = datetime.now()
+    tokens = TokenRevogado.query.filter(TokenRevogado.expira_em < agora).delete(synchronize_session=False)
+    notificacoes_antigas = NotificacaoOutbox.query.filter(
+        NotificacaoOutbox.status == "ENVIADA",
+        NotificacaoOutbox.enviado_em < agora - timedelta(days=30),
+    ).delete(synchronize_session=False)
+    execucoes = ExecucaoJob.query.filter(ExecucaoJob.inicio < agora - timedelta(days=30)).delete(synchronize_session=False)
+    db.session.commit()
+    return {"tokens": tokens, "notificacoes": notificacoes_antigas, "execucoes": execucoes}
+
+
+@app.route("/admin/jobs")
+@requer_permissao("administrar")
+def admin_jobs():
+    """Jobs agendados e as últimas execuções de cada um"""
+    jobs = []
+    for job in scheduler.get_jobs():
+        ultimas = (ExecucaoJob.query.filter_by(job_id=job.id)
+                   .order_by(ExecucaoJob.inicio.desc()).limit(10).all())
+        jobs.append({
+            "id": job.id,
+            "nome": job.name,
+            "gatilho": job.gatilho.expressao,
+            "proxima_execucao": job.next_run_time.isoformat() if job.next_run_time else None,
+            "execucoes": [{
+                "inicio": e.inicio.isoformat(),
+                "duracao_ms": e.duracao_ms,
+                "sucesso": e.sucesso,
+                "resultado": e.resultado,
+                "erro": e.erro,
+            } for e in ultimas],
+        })
+    return jsonify({"lider": scheduler.lider, "rodando": scheduler.running, "jobs": jobs})
+
+
+@app.route("/metrics")
+def metrics():
+    """Métricas de todos os workers no formato texto do Prometheus"""
+    status = metricas.autorizar(request.headers.get("Authorization"))
+    if status:
+        abort(status)
+    return Response(metricas.registro.expor(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+def preparar_banco_servidor():
+    """Confere a migração e liga o modo SQLite de produção (WAL etc.)
+
+    Só na subida do servidor, não ao importar o app.
+    """
+    import migrar_banco
+    faltando = migrar_banco.colunas_faltando()
+    if faltando:
+        raise RuntimeError(f"Banco desatualizado (faltam {', '.join(faltando)}): rode python migrar_banco.py")
+    configurar_sqlite(app, db, sem_fila={"login", "api_login"})
+
+
 if __name__ == "__main__":
+    preparar_banco_servidor()
     with app.app_context():
         db.create_all()
+        busca.instalar()
         criar_usuarios_padrao()
+    notificacoes.iniciar_despachante()
+    scheduler.start()
     app.run(host="0.0.0.0", port=5000, debug=True)
 
 
@@ -3498,30 +4306,25 @@ def admin_sincronizar_todas_etapas():
 
 # ============ API CRIAR TAREFA (MOBILE) ============
 @app.route("/api/tarefas/criar", methods=["POST"])
+@tokens_api.requer_token
 def api_tarefa_criar():
     """API para criar uma nova tarefa em uma etapa"""
     try:
         data = request.get_json()
-        usuario_id = data.get("usuario_id")
         etapa_id = data.get("etapa_id")
         titulo = data.get("titulo", "").strip()
         descricao = data.get("descricao", "").strip()
         horas_previstas = data.get("horas_previstas", 0)
         responsavel_id = data.get("responsavel_id")
         
-        if not usuario_id:
-            return jsonify({"success": False, "message": "Usuário não informado"}), 400
-        
         if not etapa_id:
             return jsonify({"success": False, "message": "Etapa não informada"}), 400
         
         if not titulo:
             return jsonify({"success": False, "message": "Título da tarefa é obrigatório"}), 400
         
-        # Verificar se usuário existe e está ativo
-        usuario = Usuario.query.get(usuario_id)
-        if not usuario or not usuario.ativo:
-            return jsonify({"success": False, "message": "Usuário não encontrado ou inativo"}), 404
+        # Usuário do token de acesso
+        usuario = g.usuario_token
         
         # Buscar etapa
         etapa = Etapa.query.get(etapa_id)
@@ -3538,6 +4341,7 @@ def api_tarefa_criar():
         # Criar nova tarefa
         nova_tarefa = Tarefa(
             etapa_id=etapa_id,
+            numero=f"{etapa.op.numero}.{reservar_numeros_tarefa(etapa.op)}",
             titulo=titulo,
             descricao=descricao,
             horas_previstas=float(horas_previstas) if horas_previstas else 0.0,
@@ -3563,27 +4367,18 @@ def api_tarefa_criar():
         
     except Exception as e:
         db.session.rollback()
-        print(f"[API CRIAR TAREFA] Erro: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log_api.exception("Erro na API ao criar tarefa")
         return jsonify({"success": False, "message": "Erro ao criar tarefa"}), 500
 
 
 # ============ API DELETAR TAREFA (MOBILE) ============
 @app.route("/api/tarefas/<int:tarefa_id>/deletar", methods=["DELETE", "POST"])
+@tokens_api.requer_token
 def api_tarefa_deletar(tarefa_id):
     """API para deletar uma tarefa"""
     try:
-        data = request.get_json()
-        usuario_id = data.get("usuario_id")
-        
-        if not usuario_id:
-            return jsonify({"success": False, "message": "Usuário não informado"}), 400
-        
-        # Verificar se usuário existe e está ativo
-        usuario = Usuario.query.get(usuario_id)
-        if not usuario or not usuario.ativo:
-            return jsonify({"success": False, "message": "Usuário não encontrado ou inativo"}), 404
+        # Usuário do token de acesso
+        usuario = g.usuario_token
         
         # Buscar tarefa
         tarefa = Tarefa.query.get(tarefa_id)
@@ -3626,7 +4421,10 @@ def api_tarefa_deletar(tarefa_id):
         op = OP.query.get(etapa.op_id)
         if op:
             op.percentual = op.percentual_calc
-            op.status = op.status_calc
+            if op.status_calc == "CONCLUIDA":
+                _marcar_op_concluida(op, concluir_obra=False)
+            else:
+                op.status = op.status_calc
         
         db.session.commit()
         
@@ -3637,7 +4435,5 @@ def api_tarefa_deletar(tarefa_id):
         
     except Exception as e:
         db.session.rollback()
-        print(f"[API DELETAR TAREFA] Erro: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log_api.exception("Erro na API ao deletar tarefa")
         return jsonify({"success": False, "message": "Erro ao deletar tarefa"}), 500
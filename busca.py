@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Busca textual - obras, OPs, tarefas, pendências de material e projetos
+
+Cada fonte tem um índice de texto no próprio banco:
+
+    SQLite      tabela FTS5 de conteúdo externo (busca_<tipo>) apontando para
+                a tabela original, sincronizada por triggers de
+                INSERT/UPDATE/DELETE (valem também para INSERT em lote feito
+                direto no Core, como o de modelos_op.instanciar)
+    PostgreSQL  índice GIN sobre to_tsvector('simple', colunas), mantido pelo
+                próprio banco
+    outros      ILIKE nas colunas (sem índice, só para não quebrar)
+
+    busca.buscar("caldeira bomba", limite=20)
+    -> [("tarefa", 812, -7.3), ("op", 40, -5.1), ...]   (melhores primeiro)
+
+Cada palavra digitada vale como prefixo e todas precisam aparecer (E).
+Maiúsculas e acentos não importam no SQLite; no PostgreSQL, acentos contam.
+
+Linha de comando (cria índices/triggers e reindexa tudo):
+    python busca.py --reindexar
+"""
+
+import re
+import sys
+
+from sqlalchemy import inspect, or_, text
+
+import log_estruturado
+
+LIMITE_PADRAO = 20
+LIMITE_MAX = 100
+
+log = log_estruturado.obter("busca")
+
+_db = None
+_fontes = {}  # tipo -> (tabela, [colunas])
+_instalado = None
+
+
+def _dialeto():
+    return _db.engine.dialect.name
+
+
+def _termos(consulta):
+    return [t for t in re.findall(r"\w+", consulta or "") if t][:10]
+
+
+def _vetor(colunas):
+    partes = " || ' ' || ".join(f"coalesce({c}, '')" for c in colunas)
+    return f"to_tsvector('simple', {partes})"
+
+
+# ============ INSTALAÇÃO ============
+
+def _ddl_sqlite(tipo, tabela, colunas):
+    fts = f"busca_{tipo}"
+    lista = ", ".join(colunas)
+    novos = ", ".join(f"new.{c}" for c in colunas)
+    antigos = ", ".join(f"old.{c}" for c in colunas)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({lista}, content='{tabela}', "
+        f"content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {tabela} BEGIN "
+        f"INSERT INTO {fts}(rowid, {lista}) VALUES (new.id, {novos}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {tabela} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {lista}) VALUES ('delete', old.id, {antigos}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {lista} ON {tabela} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {lista}) VALUES ('delete', old.id, {antigos}); "
+        f"INSERT INTO {fts}(rowid, {lista}) VALUES (new.id, {novos}); END",
+    ]
+
+
+def instalar(reindexar=False):
+    """Cria os índices de busca que faltam (e os preenche); devolve os tipos criados"""
+    global _instalado
+    criados = []
+    dialeto = _dialeto()
+    with _db.engine.begin() as conexao:
+        inspetor = inspect(conexao)
+        for tipo, (tabela, colunas) in _fontes.items():
+            if dialeto == "sqlite":
+                novo = not inspetor.has_table(f"busca_{tipo}")
+                for comando in _ddl_sqlite(tipo, tabela, colunas):
+                    conexao.exec_driver_sql(comando)
+                if novo or reindexar:
+                    conexao.exec_driver_sql(f"INSERT INTO busca_{tipo}(busca_{tipo}) VALUES ('rebuild')")
+            elif dialeto == "postgresql":
+                nome = f"ix_busca_{tipo}"
+                novo = nome not in {i["name"] for i in inspetor.get_indexes(tabela)}
+                conexao.exec_driver_sql(
+                    f"CREATE INDEX IF NOT EXISTS {nome} ON {tabela} USING gin ({_vetor(colunas)})")
+                if reindexar and not novo:
+                    conexao.exec_driver_sql(f"REINDEX INDEX {nome}")
+            else:
+                continue
+            if novo:
+                criados.append(tipo)
+    _instalado = dialeto in ("sqlite", "postgresql")
+    return criados
+
+
+def _verificar_instalacao():
+    global _instalado
+    if _instalado is None:
+        dialeto = _dialeto()
+        if dialeto == "sqlite":
+            tabelas = set(inspect(_db.engine).get_table_names())
+            _instalado = all(f"busca_{tipo}" in tabelas for tipo in _fontes)
+        elif dialeto == "postgresql":
+            _instalado = all(
+                f"ix_busca_{tipo}" in {i["name"] for i in inspect(_db.engine).get_indexes(tabela)}
+                for tipo, (tabela, _) in _fontes.items()
+            )
+        else:
+            _instalado = False
+        if not _instalado:
+            log.warning("Índices de busca não instalados, usando ILIKE (rode python busca.py --reindexar)",
+                        extra={"dialeto": dialeto})
+    return _instalado
+
+
+# ============ CONSULTA ============
+
+def _buscar_sqlite(termos, tipos, limite):
+    consulta = " ".join('"' + t.replace('"', '""') + '"*' for t in termos)
+    partes = [
+        f"SELECT '{tipo}' AS tipo, rowid AS id, bm25(busca_{tipo}) AS rank "
+        f"FROM busca_{tipo} WHERE busca_{tipo} MATCH :consulta"
+        for tipo in tipos
+    ]
+    sql = " UNION ALL ".join(partes) + " ORDER BY rank LIMIT :limite"
+    return _db.session.execute(text(sql), {"consulta": consulta, "limite": limite}).all()
+
+
+def _buscar_postgres(termos, tipos, limite):
+    consulta = " & ".join(f"{t}:*" for t in termos)
+    partes = []
+    for tipo in tipos:
+        tabela, colunas = _fontes[tipo]
+        vetor = _vetor(colunas)
+        partes.append(
+            f"SELECT '{tipo}' AS tipo, id, -ts_rank({vetor}, to_tsquery('simple', :consulta)) AS rank "
+            f"FROM {tabela} WHERE {vetor} @@ to_tsquery('simple', :consulta)"
+        )
+    sql = " UNION ALL ".join(partes) + " ORDER BY rank LIMIT :limite"
+    return _db.session.execute(text(sql), {"consulta": consulta, "limite": limite}).all()
+
+
+def _buscar_ilike(termos, tipos, limite):
+    achados = []
+    for tipo in tipos:
+        tabela, colunas = _fontes[tipo]
+        t = _db.metadata.tables[tabela]
+        filtros = [or_(*(t.c[c].ilike(f"%{termo}%") for c in colunas)) for termo in termos]
+        consulta = t.select().with_only_columns(t.c.id).where(*filtros).order_by(t.c.id.desc()).limit(limite)
+        achados.extend((tipo, i, 0.0) for i in _db.session.execute(consulta).scalars())
+    return achados[:limite]
+
+
+def buscar(consulta, tipos=None, limite=LIMITE_PADRAO):
+    """[(tipo, id, rank)] do mais relevante para o menos (rank menor = melhor)"""
+    termos = _termos(consulta)
+    tipos = [t for t in (tipos or _fontes) if t in _fontes]
+    if not termos or not tipos:
+        return []
+    limite = max(1, min(int(limite), LIMITE_MAX))
+    if _verificar_instalacao():
+        if _dialeto() == "sqlite":
+            linhas = _buscar_sqlite(termos, tipos, limite)
+        else:
+            linhas = _buscar_postgres(termos, tipos, limite)
+    else:
+        linhas = _buscar_ilike(termos, tipos, limite)
+    return [(tipo, id_, rank) for tipo, id_, rank in linhas]
+
+
+def init_app(db, obra, op, tarefa, pendencia, projeto):
+    """Liga a busca aos modelos e define as colunas indexadas de cada um"""
+    global _db, _fontes
+    _db = db
+    _fontes = {
+        "obra": (obra.__table__.name, ["codigo", "nome", "cliente"]),
+        "op": (op.__table__.name, ["numero", "produto"]),
+        "tarefa": (tarefa.__table__.name, ["titulo", "descricao"]),
+        "pendencia": (pendencia.__table__.name, ["descricao"]),
+        "projeto": (projeto.__table__.name, ["descricao"]),
+    }
+
+
+def main():
+    from app import app
+
+    if len(sys.argv) < 2 or sys.argv[1] != "--reindexar":
+        print("Uso: python busca.py --reindexar")
+        return
+    with app.app_context():
+        print("⚙️ Criando índices de busca e reindexando...")
+        criados = instalar(reindexar=True)
+    print(f"✅ Busca pronta ({', '.join(criados) or 'índices já existiam'})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""
+Cadastros em memória - obras, OPs, etapas, operadores e máquinas
+
+Validar um lote de apontamentos ou montar os selects dos formulários só
+precisa de id, rótulo e alguns campos de cada cadastro. Esses dados são
+carregados numa consulta por tabela e guardados no processo:
+
+    dados = cache_cadastros.cache.obter()
+    dados.ops[12]           -> ItemOP(id, numero, obra_id, produto, status)
+    cache_cadastros.cache.etapas([5, 6])   -> {5: ItemEtapa(...), ...}
+
+Qualquer escrita nessas tabelas (flush do ORM ou INSERT/UPDATE/DELETE pela
+sessão) invalida o cache no commit. Em outros workers do gunicorn a
+alteração vale quando o TTL expira; um id que não está no cache força uma
+recarga (no máximo uma por RECARGA_MIN segundos), então OPs recém-criadas
+em outro worker já valem na requisição seguinte.
+
+As etapas são muitas (várias por OP) e ficam num cache à parte, preenchido
+sob demanda por id ou por OP, com o mesmo TTL: instanciar um modelo em outro
+worker apaga e recria as etapas da OP, e as antigas não podem continuar
+valendo aqui depois que o TTL vence.
+
+Para os selects e buscas dos formulários, `opcoes` devolve pares
+(id, rótulo) filtrados por prefixo (do rótulo ou de qualquer palavra dele,
+sem diferenciar maiúsculas nem acentos) e limitados, com busca binária num
+índice montado junto com os cadastros. Vêm na ordem do rótulo, menos as
+OPs, que vêm das mais novas para as mais antigas (como nas telas):
+
+    cache_cadastros.opcoes("ops", "2024", limite=20, obra_id=3)
+    -> [(813, "2024-002"), (812, "2024-001"), ...]
+
+Variáveis de ambiente:
+    PCP_CADASTROS_TTL    segundos que os cadastros ficam no cache (padrão: 60)
+"""
+
+import os
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from dataclasses import dataclass, field
+
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import object_session
+
+import metricas
+
+TTL = float(os.environ.get("PCP_CADASTROS_TTL", "60"))
+RECARGA_MIN = 2.0
+ETAPAS_MAX = 50000
+LIMITE_PADRAO = 20
+LIMITE_MAX = 500
+TIPOS = ("obras", "ops", "operadores", "maquinas", "etapas")
+
+
+@dataclass(frozen=True)
+class ItemObra:
+    id: int
+    codigo: str
+    nome: str
+
+
+@dataclass(frozen=True)
+class ItemOP:
+    id: int
+    numero: str
+    obra_id: int
+    produto: str
+    status: str
+
+
+@dataclass(frozen=True)
+class ItemEtapa:
+    id: int
+    op_id: int
+    nome: str
+
+
+def _normalizar(texto):
+    texto = unicodedata.normalize("NFKD", str(texto or ""))
+    return "".join(c for c in texto if not unicodedata.combining(c)).casefold().strip()
+
+
+class IndiceRotulos:
+    """(id, rótulo) ordenados pelo rótulo, com busca por prefixo do rótulo ou de uma palavra dele
+
+    `ordenar_por` troca a ordem das respostas (ex.: OPs mais novas primeiro).
+    """
+
+    def __init__(self, itens, ordenar_por=None):
+        itens = sorted(itens, key=ordenar_por or (lambda i: (_normalizar(i[1]), i[0])))
+        self._itens = itens
+        self._chaves = []
+        for ordem, (_, rotulo) in enumerate(itens):
+            normal = _normalizar(rotulo)
+            palavras = {p for p in re.split(r"[^\w]+", normal) if p}
+            for chave in {normal} | palavras:
+                self._chaves.append((chave, ordem))
+        self._chaves.sort()
+
+    def __len__(self):
+        return len(self._itens)
+
+    def buscar(self, prefixo="", limite=LIMITE_PADRAO):
+        prefixo = _normalizar(prefixo)
+        if not prefixo:
+            return self._itens[:limite]
+        achados = set()
+        i = bisect_left(self._chaves, (prefixo,))
+        while i < len(self._chaves) and self._chaves[i][0].startswith(prefixo):
+            achados.add(self._chaves[i][1])
+            i += 1
+        # Na ordem do índice; o limite vale depois de juntar as palavras
+        return [self._itens[o] for o in sorted(achados)[:limite]]
+
+
+def _mais_nova(item):
+    """OPs como nas telas: mais novas (maior id) primeiro; "10" não vem antes de "2" """
+    return -item[0]
+
+
+@dataclass(frozen=True)
+class Cadastros:
+    """Foto dos cadastros num instante (não muda depois de montada)"""
+    carregado_em: float
+    obras: dict
+    ops: dict
+    operadores: dict  # id -> nome (só ativos)
+    maquinas: dict  # id -> nome (só ativas)
+    indices: dict = field(default_factory=dict)  # (tipo, obra_id ou None) -> IndiceRotulos
+
+
+_db = None
+_Obra = _OP = _Etapa = _Operador = _Maquina = None
+_tabelas = frozenset()
+
+
+class CacheCadastros:
+    def __init__(self, ttl=TTL):
+        self.ttl = ttl
+        self.trava = threading.Lock()
+        self._dados = None
+        self._etapas = {}
+        self._etapas_por_op = {}
+        self._etapas_desde = time.monotonic()
+
+    def _carregar(self):
+        sessao = _db.session
+        obra, op, operador, maquina = _Obra.__table__, _OP.__table__, _Operador.__table__, _Maquina.__table__
+        dados = Cadastros(
+            carregado_em=time.monotonic(),
+            obras={
+                r.id: ItemObra(r.id, r.codigo, r.nome)
+                for r in sessao.execute(select(obra.c.id, obra.c.codigo, obra.c.nome))
+            },
+            ops={
+                r.id: ItemOP(r.id, r.numero, r.obra_id, r.produto, r.status)
+                for r in sessao.execute(select(op.c.id, op.c.numero, op.c.obra_id, op.c.produto, op.c.status))
+            },
+            operadores=dict(sessao.execute(
+                select(operador.c.id, operador.c.nome).where(operador.c.ativo.is_(True))).all()),
+            maquinas=dict(sessao.execute(
+                select(maquina.c.id, maquina.c.nome).where(maquina.c.ativo.is_(True))).all()),
+        )
+        ops_por_obra = {}
+        for item in dados.ops.values():
+            ops_por_obra.setdefault(item.obra_id, []).append((item.id, item.numero))
+        dados.indices.update({
+            ("obras", None): IndiceRotulos((o.id, f"{o.codigo} - {o.nome}") for o in dados.obras.values()),
+            ("ops", None): IndiceRotulos(((o.id, o.numero) for o in dados.ops.values()), ordenar_por=_mais_nova),
+            ("operadores", None): IndiceRotulos(dados.operadores.items()),
+            ("maquinas", None): IndiceRotulos(dados.maquinas.items()),
+            **{("ops", obra_id): IndiceRotulos(itens, ordenar_por=_mais_nova) for obra_id, itens in ops_por_obra.items()},
+        })
+        return dados
+
+    def obter(self):
+        agora = time.monotonic()
+        with self.trava:
+            dados = self._dados
+        if dados is not None and dados.carregado_em + self.ttl > agora:
+            metricas.cache("cadastros", True)
+            return dados
+        metricas.cache("cadastros", False)
+        dados = self._carregar()
+        with self.trava:
+            self._dados = dados
+            self._limpar_etapas()
+        return dados
+
+    def obter_com(self, campo, ids):
+        """Como obter(), mas recarrega se algum dos ids não estiver em `campo`"""
+        dados = self.obter()
+        mapa = getattr(dados, campo)
+        if all(i in mapa for i in ids) or time.monotonic() - dados.carregado_em < RECARGA_MIN:
+            return dados
+        self.invalidar()
+        return self.obter()
+
+    def _limpar_etapas(self):
+        # Chamado com a trava
+        self._etapas.clear()
+        self._etapas_por_op.clear()
+        self._etapas_desde = time.monotonic()
+
+    def _expirar_etapas(self):
+        # Chamado com a trava
+        if time.monotonic() - self._etapas_desde > self.ttl:
+            self._limpar_etapas()
+
+    def etapas(self, ids):
+        """{id: ItemEtapa} das etapas que existem entre `ids`"""
+        ids = set(ids)
+        with self.trava:
+            self._expirar_etapas()
+            achadas = {i: self._etapas[i] for i in ids if i in self._etapas}
+        faltando = ids - achadas.keys()
+        if faltando:
+            metricas.cache("etapas", False)
+            etapa = _Etapa.__table__
+            linhas = _db.session.execute(
+                select(etapa.c.id, etapa.c.op_id, etapa.c.nome).where(etapa.c.id.in_(faltando)))
+            novas = {r.id: ItemEtapa(r.id, r.op_id, r.nome) for r in linhas}
+            self._guardar_etapas(novas)
+            achadas.update(novas)
+        else:
+            metricas.cache("etapas", True)
+        return achadas
+
+    def etapas_da_op(self, op_id):
+        with self.trava:
+            self._expirar_etapas()
+            ids = self._etapas_por_op.get(op_id)
+            if ids is not None:
+                return [self._etapas[i] for i in ids if i in self._etapas]
+        etapa = _Etapa.__table__
+        linhas = _db.session.execute(
+            select(etapa.c.id, etapa.c.op_id, etapa.c.nome).where(etapa.c.op_id == op_id).order_by(etapa.c.id))
+        itens = [ItemEtapa(r.id, r.op_id, r.nome) for r in linhas]
+        self._guardar_etapas({item.id: item for item in itens})
+        with self.trava:
+            self._etapas_por_op[op_id] = [item.id for item in itens]
+        return itens
+
+    def _guardar_etapas(self, novas):
+        with self.trava:
+            if len(self._etapas) + len(novas) > ETAPAS_MAX:
+                self._limpar_etapas()
+            self._etapas.update(novas)
+
+    def invalidar(self):
+        with self.trava:
+            self._dados = None
+            self._limpar_etapas()
+
+
+cache = CacheCadastros()
+
+
+def opcoes(tipo, prefixo="", limite=LIMITE_PADRAO, obra_id=None, op_id=None):
+    """[(id, rótulo)] de um cadastro, filtrados por prefixo e limitados
+
+    `obra_id` restringe as OPs a uma obra; etapas exigem `op_id`. Com
+    limite=None vêm todos (só para uso interno; a API sempre limita).
+    """
+    if tipo not in TIPOS:
+        raise ValueError(f"tipo desconhecido: {tipo}")
+    if limite is not None:
+        limite = max(1, min(int(limite), LIMITE_MAX))
+    if tipo == "etapas":
+        if op_id is None:
+            raise ValueError("etapas precisam de op_id")
+        normal = _normalizar(prefixo)
+        itens = [(e.id, e.nome) for e in cache.etapas_da_op(op_id) if _normalizar(e.nome).startswith(normal)]
+        return itens[:limite]
+    dados = cache.obter()
+    indice = dados.indices.get((tipo, obra_id if tipo == "ops" else None))
+    if indice is None:
+        return []
+    return indice.buscar(prefixo, limite)
+
+
+# ============ INVALIDAÇÃO ============
+
+def _marcar(sessao):
+    sessao.info["cadastros_alterados"] = True
+
+
+def _observar_modelo(modelo, campos):
+    def _alterado(mapper, connection, alvo):
+        sessao = object_session(alvo)
+        if sessao is not None:
+            _marcar(sessao)
+
+    def _atualizado(mapper, connection, alvo):
+        # OPs mudam de status/percentual o tempo todo: só invalida se mudou um campo guardado aqui
+        estado = inspect(alvo)
+        if any(estado.attrs[campo].history.has_changes() for campo in campos):
+            _alterado(mapper, connection, alvo)
+
+    event.listen(modelo, "after_insert", _alterado)
+    event.listen(modelo, "after_delete", _alterado)
+    event.listen(modelo, "after_update", _atualizado)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _comando_em_massa(estado):
+    # INSERT/UPDATE/DELETE executados direto pela sessão (sem flush)
+    if not (estado.is_insert or estado.is_update or estado.is_delete):
+        return
+    tabela = getattr(estado.statement, "table", None)
+    if tabela is not None and tabela.name in _tabelas:
+        _marcar(estado.session)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidar_no_commit(sessao):
+    if sessao.info.pop("cadastros_alterados", False):
+        cache.invalidar()
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_no_rollback(sessao):
+    sessao.info.pop("cadastros_alterados", None)
+
+
+def init_app(db, obra, op, etapa, operador, maquina):
+    """Liga o cache aos modelos e passa a observar as escritas neles"""
+    global _db, _Obra, _OP, _Etapa, _Operador, _Maquina, _tabelas
+    _db, _Obra, _OP, _Etapa, _Operador, _Maquina = db, obra, op, etapa, operador, maquina
+    _tabelas = frozenset(m.__table__.name for m in (obra, op, etapa, operador, maquina))
+    _observar_modelo(obra, ("codigo", "nome"))
+    _observar_modelo(op, ("numero", "obra_id", "produto", "status"))
+    _observar_modelo(etapa, ("op_id", "nome"))
+    _observar_modelo(operador, ("nome", "ativo"))
+    _observar_modelo(maquina, ("nome", "ativo"))
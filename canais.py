@@ -0,0 +1,353 @@
+"""
+Canais de notificação - Telegram, WhatsApp Business, WhatsApp Web e fakes
+
+Todos os canais têm a mesma interface:
+
+    canal = canais.obter("telegram")
+    canal.enviar("texto", destino=None)          # levanta FalhaTemporaria / FalhaDefinitiva
+    canal.enviar_varios(["a", "b"])              # lista de erros (None = enviada)
+    canal.renderizar("tarefa_atrasada", titulo=..., ...)
+
+Os canais HTTP usam uma única requests.Session com pool de conexões
+(keep-alive), então mandar várias mensagens não abre uma conexão TLS nova
+a cada envio.
+
+Para testes e benchmarks de carga:
+    - "memoria": guarda as mensagens numa lista (canais.obter("memoria").enviadas)
+    - "http_local": manda para o sink_notificacoes.py
+
+Variáveis de ambiente:
+    TELEGRAM_BOT_TOKEN, TELEGRAM_USER_ID            (.env.telegram)
+    WHATSAPP_API_TOKEN, WHATSAPP_PHONE_NUMBER_ID,
+    WHATSAPP_BUSINESS_ACCOUNT_ID, WHATSAPP_RECIPIENT_PHONE   (.env.whatsapp)
+    PCP_WHATSAPP_CHROMEDRIVER, PCP_WHATSAPP_GRUPO   WhatsApp Web
+    PCP_WHATSAPP_TRAVA      trava do perfil do Chrome (padrão: ~/.wpp_profile.lock)
+    PCP_NOTIF_SINK_URL      URL do sink HTTP local (padrão: http://127.0.0.1:8025/)
+    PCP_CANAIS_POOL         conexões mantidas abertas por host (padrão: 10)
+"""
+
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from html import escape
+from string import Template
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+from travas import TravaArquivo
+
+load_dotenv(".env.telegram")
+load_dotenv(".env.whatsapp")
+
+POOL = int(os.environ.get("PCP_CANAIS_POOL", "10"))
+TIMEOUT = 10
+
+
+class FalhaTemporaria(Exception):
+    """Vale tentar de novo mais tarde"""
+
+
+class FalhaDefinitiva(Exception):
+    """Não adianta tentar de novo (dead-letter)"""
+
+
+# ============ MODELOS DE MENSAGEM ============
+
+MODELOS = {
+    "tarefa_atrasada": (
+        "🚨 TAREFA ATRASADA!\n"
+        "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
+        "📋 Tarefa: $titulo\n"
+        "👤 Responsável: $responsavel\n"
+        "📅 Data Fim: $data_fim\n"
+        "⏰ Dias Atrasada: $dias\n"
+        "📊 Status: $status\n"
+        "🔧 OP: $op\n"
+        "🏗️ Etapa: $etapa\n"
+        "⏱️ Horas Previstas: $horas h\n\n"
+        "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+        "⚠️ Ação Necessária!"
+    ),
+    "tarefa_atrasada_resumo": (
+        "<b>OP:</b> $op\n"
+        "<b>Etapa:</b> $etapa\n"
+        "<b>Data Fim:</b> $data_fim\n"
+        "<b>Dias Atrasado:</b> $dias\n"
+    ),
+}
+
+
+# ============ TRANSPORTE HTTP ============
+
+def _criar_sessao():
+    sessao = requests.Session()
+    adaptador = HTTPAdapter(pool_connections=POOL, pool_maxsize=POOL)
+    sessao.mount("https://", adaptador)
+    sessao.mount("http://", adaptador)
+    return sessao
+
+
+# Compartilhada por todos os canais HTTP e threads (o pool do urllib3 é thread-safe)
+http = _criar_sessao()
+
+
+def _checar_resposta(resposta):
+    if resposta.status_code == 429 or resposta.status_code >= 500:
+        raise FalhaTemporaria(f"HTTP {resposta.status_code}: {resposta.text[:200]}")
+    if resposta.status_code >= 400:
+        raise FalhaDefinitiva(f"HTTP {resposta.status_code}: {resposta.text[:200]}")
+
+
+def post(url, **kwargs):
+    """POST pela sessão compartilhada; erros viram FalhaTemporaria/FalhaDefinitiva"""
+    try:
+        resposta = http.post(url, timeout=TIMEOUT, **kwargs)
+    except requests.RequestException as e:
+        raise FalhaTemporaria(str(e)) from e
+    _checar_resposta(resposta)
+    return resposta
+
+
+# ============ CANAIS ============
+
+class Canal:
+    """Interface comum dos canais"""
+
+    nome = None
+    # Mensagens por minuto (limite da API com folga), usado pela fila
+    por_minuto = 60
+    # Envios simultâneos em enviar_varios
+    paralelo = 1
+
+    def configurado(self):
+        return True
+
+    def disponivel(self):
+        """Este processo pode enviar por este canal (a fila pula os que não podem)"""
+        return True
+
+    def enviar(self, mensagem, destino=None):
+        raise NotImplementedError
+
+    def enviar_varios(self, mensagens, destino=None):
+        """Envia uma lista de mensagens; devolve a lista de erros (None = enviada)"""
+        def um(mensagem):
+            try:
+                self.enviar(mensagem, destino)
+                return None
+            except Exception as e:
+                return e
+
+        if self.paralelo <= 1 or len(mensagens) <= 1:
+            return [um(m) for m in mensagens]
+        with ThreadPoolExecutor(max_workers=min(self.paralelo, len(mensagens))) as pool:
+            return list(pool.map(um, mensagens))
+
+    def escapar(self, valor):
+        return str(valor)
+
+    def renderizar(self, modelo, **dados):
+        """Preenche um modelo de MODELOS (ou um texto com $campos) para este canal"""
+        texto = MODELOS.get(modelo, modelo)
+        return Template(texto).safe_substitute({k: self.escapar(v) for k, v in dados.items()})
+
+
+class CanalTelegram(Canal):
+    nome = "telegram"
+    por_minuto = 20
+    paralelo = 4
+
+    @property
+    def token(self):
+        return os.getenv("TELEGRAM_BOT_TOKEN")
+
+    @property
+    def chat_padrao(self):
+        return os.getenv("TELEGRAM_USER_ID")
+
+    def configurado(self):
+        return bool(self.token and self.chat_padrao)
+
+    def escapar(self, valor):
+        return escape(str(valor))
+
+    def enviar(self, mensagem, destino=None):
+        if not self.token or not (destino or self.chat_padrao):
+            raise FalhaDefinitiva("Credenciais do Telegram não configuradas")
+        post(
+            f"https://api.telegram.org/bot{self.token}/sendMessage",
+            json={"chat_id": destino or self.chat_padrao, "text": mensagem, "parse_mode": "HTML"},
+        )
+
+
+class CanalWhatsAppAPI(Canal):
+    nome = "whatsapp_api"
+    por_minuto = 60
+    paralelo = 4
+
+    def __init__(self):
+        self.api_token = os.getenv("WHATSAPP_API_TOKEN")
+        self.phone_number_id = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
+        self.business_account_id = os.getenv("WHATSAPP_BUSINESS_ACCOUNT_ID")
+        self.recipient_phone = os.getenv("WHATSAPP_RECIPIENT_PHONE", "+55 11 99999-9999")
+        self.api_url = f"https://graph.instagram.com/v18.0/{self.phone_number_id}/messages"
+
+    def configurado(self):
+        return all([self.api_token, self.phone_number_id, self.business_account_id])
+
+    @staticmethod
+    def limpar_telefone(telefone):
+        return telefone.replace(" ", "").replace("-", "").replace("+", "")
+
+    def _enviar_payload(self, payload):
+        if not self.api_token:
+            raise FalhaDefinitiva("Credenciais do WhatsApp Business não configuradas")
+        post(self.api_url, json=payload, headers={"Authorization": f"Bearer {self.api_token}"})
+
+    def enviar(self, mensagem, destino=None):
+        self._enviar_payload({
+            "messaging_product": "whatsapp",
+            "to": self.limpar_telefone(destino or self.recipient_phone),
+            "type": "text",
+            "text": {"body": mensagem},
+        })
+
+    def enviar_template(self, nome, idioma="pt_BR", parametros=None, destino=None):
+        """Modelo aprovado no WhatsApp Business (diferente de renderizar)"""
+        payload = {
+            "messaging_product": "whatsapp",
+            "to": self.limpar_telefone(destino or self.recipient_phone),
+            "type": "template",
+            "template": {"name": nome, "language": {"code": idioma}},
+        }
+        if parametros:
+            payload["template"]["components"] = [
+                {"type": "body", "parameters": [{"type": "text", "text": str(p)} for p in parametros]}
+            ]
+        self._enviar_payload(payload)
+
+
+class CanalWhatsAppWeb(Canal):
+    """WhatsApp Web pela sessão persistente de whatsapp_notifier (selenium)
+
+    O Chrome não abre um perfil (~/.wpp_profile) que já está em uso, então
+    só um processo da máquina fica com o canal: o que pegar a trava de
+    arquivo do perfil (travas.py, a mesma da eleição do agendador). Nos
+    outros workers do gunicorn o canal fica indisponível e a fila deixa as
+    mensagens dele para o dono da trava; se ele morrer, outro assume.
+    """
+
+    nome = "whatsapp_web"
+    por_minuto = 30
+    ESPERA_SEG = 120
+
+    def __init__(self):
+        self._servico = None
+        self._trava = threading.Lock()
+        self._perfil = None
+
+    def configurado(self):
+        return bool(os.getenv("PCP_WHATSAPP_CHROMEDRIVER") and os.getenv("PCP_WHATSAPP_GRUPO"))
+
+    def disponivel(self):
+        if not self.configurado():
+            return True  # o envio falha como definitiva, sem ficar parado na fila
+        with self._trava:
+            if self._perfil is None:
+                caminho = os.environ.get("PCP_WHATSAPP_TRAVA") or os.path.expanduser("~/.wpp_profile.lock")
+                self._perfil = TravaArquivo(caminho)
+            return self._perfil.tentar()
+
+    def servico(self):
+        if not self.disponivel():
+            raise FalhaTemporaria("WhatsApp Web aberto por outro processo")
+        with self._trava:
+            if self._servico is None:
+                if not self.configurado():
+                    raise FalhaDefinitiva("PCP_WHATSAPP_CHROMEDRIVER / PCP_WHATSAPP_GRUPO não configurados")
+                from whatsapp_notifier import ServicoWhatsApp
+                self._servico = ServicoWhatsApp(os.environ["PCP_WHATSAPP_CHROMEDRIVER"], os.environ["PCP_WHATSAPP_GRUPO"])
+                self._servico.iniciar()
+            return self._servico
+
+    def enviar(self, mensagem, destino=None):
+        if not self.servico().enviar(mensagem).result(timeout=self.ESPERA_SEG):
+            raise FalhaTemporaria("WhatsApp Web não confirmou o envio")
+
+    def enviar_varios(self, mensagens, destino=None):
+        # Tudo na fila de uma vez: a thread do WhatsApp Web envia em lote
+        futuros = [self.servico().enviar(m) for m in mensagens]
+        erros = []
+        for futuro in futuros:
+            try:
+                ok = futuro.result(timeout=self.ESPERA_SEG)
+                erros.append(None if ok else FalhaTemporaria("WhatsApp Web não confirmou o envio"))
+            except Exception as e:
+                erros.append(e)
+        return erros
+
+
+class CanalHTTPLocal(Canal):
+    """Sink HTTP local (sink_notificacoes.py) - testes sem internet"""
+
+    nome = "http_local"
+    por_minuto = 6000
+    paralelo = 8
+
+    def enviar(self, mensagem, destino=None):
+        url = os.environ.get("PCP_NOTIF_SINK_URL", "http://127.0.0.1:8025/")
+        post(url, json={"destino": destino, "mensagem": mensagem})
+
+
+class CanalMemoria(Canal):
+    """Guarda as mensagens em memória - testes e benchmarks
+
+    `falhar` é a fração de envios que levanta FalhaTemporaria.
+    """
+
+    nome = "memoria"
+    por_minuto = 60000
+
+    def __init__(self, falhar=0.0):
+        self.falhar = falhar
+        self.enviadas = []
+        self._trava = threading.Lock()
+
+    def enviar(self, mensagem, destino=None):
+        if self.falhar and random.random() < self.falhar:
+            raise FalhaTemporaria("Falha simulada")
+        with self._trava:
+            self.enviadas.append((destino, mensagem))
+
+    def limpar(self):
+        with self._trava:
+            self.enviadas.clear()
+
+
+# ============ REGISTRO ============
+
+CANAIS = {}
+
+
+def registrar(canal):
+    CANAIS[canal.nome] = canal
+    return canal
+
+
+def obter(nome):
+    try:
+        return CANAIS[nome]
+    except KeyError:
+        raise ValueError(f"Canal desconhecido: {nome}") from None
+
+
+def indisponiveis():
+    """Nomes dos canais que este processo não pode usar agora"""
+    return [nome for nome, canal in CANAIS.items() if not canal.disponivel()]
+
+
+for _canal in (CanalTelegram(), CanalWhatsAppAPI(), CanalWhatsAppWeb(), CanalHTTPLocal(), CanalMemoria()):
+    registrar(_canal)
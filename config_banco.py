@@ -0,0 +1,331 @@
+"""
+Configuração do banco de dados e perfis de deploy (gunicorn + PostgreSQL)
+
+Cada worker do gunicorn tem o seu próprio pool de conexões. Os valores abaixo
+são calculados a partir do perfil escolhido para que a soma de todos os
+workers nunca ultrapasse o limite de conexões do PostgreSQL.
+
+Variáveis de ambiente:
+    PCP_PERFIL             sync | gthread | gevent (padrão: gthread)
+    WEB_CONCURRENCY        número de workers do gunicorn
+    GUNICORN_THREADS       threads por worker (perfil gthread)
+    GUNICORN_CONEXOES      conexões simultâneas por worker (perfil gevent)
+    PCP_DB_MAX_CONEXOES    limite total de conexões disponível para o app
+    PCP_DB_POOL_SIZE       força o tamanho do pool por worker
+    PCP_DB_MAX_OVERFLOW    conexões extras por worker além do pool
+    PCP_DB_POOL_TIMEOUT    segundos esperando uma conexão livre
+    PCP_DB_POOL_RECYCLE    segundos até reciclar uma conexão
+    PCP_DB_STATEMENT_TIMEOUT   timeout de cada comando SQL (ms)
+
+Modo SQLite de produção (servidor local da fábrica), ligado na subida do
+servidor (python app.py / gunicorn), nunca só por importar o app:
+    PCP_SQLITE_MODO        producao | simples (padrão: producao)
+    PCP_SQLITE_BUSY_MS     espera máxima por um lock de escrita (ms)
+    PCP_SQLITE_MMAP_MB     tamanho do mmap do arquivo do banco
+    PCP_SQLITE_CACHE_MB    cache de páginas por conexão
+"""
+
+import os
+import threading
+
+from flask import request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import scoped_session
+
+
+# Perfis de worker do gunicorn
+PERFIS = {
+    "sync": {
+        "worker_class": "sync",
+        "workers": 3,
+        "threads": 1,
+        "worker_connections": 1,
+    },
+    "gthread": {
+        "worker_class": "gthread",
+        "workers": 2,
+        "threads": 4,
+        "worker_connections": 4,
+    },
+    "gevent": {
+        "worker_class": "gevent",
+        "workers": 2,
+        "threads": 1,
+        "worker_connections": 50,
+    },
+}
+
+PERFIL_PADRAO = "gthread"
+
+
+def _env_int(nome, padrao):
+    valor = os.environ.get(nome, "").strip()
+    if not valor:
+        return padrao
+    try:
+        return int(valor)
+    except ValueError:
+        print(f"⚠️ Valor inválido para {nome}: {valor!r}, usando {padrao}")
+        return padrao
+
+
+def perfil_atual():
+    """Retorna o perfil de deploy com os overrides das variáveis de ambiente"""
+    nome = os.environ.get("PCP_PERFIL", PERFIL_PADRAO).strip().lower()
+    if nome not in PERFIS:
+        print(f"⚠️ Perfil desconhecido: {nome}, usando {PERFIL_PADRAO}")
+        nome = PERFIL_PADRAO
+
+    perfil = dict(PERFIS[nome])
+    perfil["nome"] = nome
+    perfil["workers"] = _env_int("WEB_CONCURRENCY", perfil["workers"])
+    perfil["threads"] = _env_int("GUNICORN_THREADS", perfil["threads"])
+    perfil["worker_connections"] = _env_int("GUNICORN_CONEXOES", perfil["worker_connections"])
+
+    # SQLite aceita um único escritor: um worker só, com a fila de escrita interna
+    if not os.environ.get("DATABASE_URL") and modo_sqlite_producao() and not os.environ.get("WEB_CONCURRENCY"):
+        perfil["workers"] = 1
+    return perfil
+
+
+def concorrencia_por_worker(perfil):
+    """Quantas requisições um worker atende ao mesmo tempo"""
+    if perfil["worker_class"] == "gevent":
+        return perfil["worker_connections"]
+    if perfil["worker_class"] == "gthread":
+        return perfil["threads"]
+    return 1
+
+
+def opcoes_pool_postgres(perfil):
+    """Calcula pool_size / max_overflow por worker respeitando o limite total"""
+    max_conexoes = _env_int("PCP_DB_MAX_CONEXOES", 20)
+    workers = max(perfil["workers"], 1)
+
+    # Nunca mais conexões por worker do que requisições simultâneas
+    pool_size = _env_int("PCP_DB_POOL_SIZE", concorrencia_por_worker(perfil))
+    max_overflow = _env_int("PCP_DB_MAX_OVERFLOW", 2)
+
+    por_worker = max(max_conexoes // workers, 1)
+    if pool_size + max_overflow > por_worker:
+        pool_size = min(pool_size, por_worker)
+        max_overflow = max(por_worker - pool_size, 0)
+
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": _env_int("PCP_DB_POOL_TIMEOUT", 10),
+        "pool_recycle": _env_int("PCP_DB_POOL_RECYCLE", 1800),
+        "pool_pre_ping": True,
+    }
+
+
+def opcoes_engine(database_url):
+    """Retorna o dicionário SQLALCHEMY_ENGINE_OPTIONS para a URL do banco"""
+    if database_url.startswith("sqlite"):
+        return opcoes_sqlite(database_url)
+    if not database_url.startswith("postgresql"):
+        return {}
+
+    opcoes = opcoes_pool_postgres(perfil_atual())
+
+    statement_timeout = _env_int("PCP_DB_STATEMENT_TIMEOUT", 15000)
+    opcoes["connect_args"] = {
+        "connect_timeout": 5,
+        "application_name": "pcp-web",
+        "options": (
+            f"-c statement_timeout={statement_timeout} "
+            f"-c idle_in_transaction_session_timeout={statement_timeout * 4}"
+        ),
+    }
+    return opcoes
+
+
+# ============ SQLITE EM PRODUÇÃO ============
+
+def modo_sqlite_producao():
+    return os.environ.get("PCP_SQLITE_MODO", "producao").strip().lower() == "producao"
+
+
+def _sqlite_em_arquivo(database_url):
+    return database_url.startswith("sqlite") and ":memory:" not in database_url and database_url.rstrip("/") != "sqlite:"
+
+
+def opcoes_sqlite(database_url):
+    """Opções do engine de escrita do SQLite"""
+    if not _sqlite_em_arquivo(database_url) or not modo_sqlite_producao():
+        return {}
+    busy_ms = _env_int("PCP_SQLITE_BUSY_MS", 5000)
+    return {
+        # Só um escritor por vez: o pool de escrita fica pequeno
+        "pool_size": 1,
+        "max_overflow": 2,
+        "pool_timeout": busy_ms / 1000,
+        "connect_args": {"timeout": busy_ms / 1000, "check_same_thread": False},
+    }
+
+
+def _aplicar_pragmas(dbapi_conn, escrita):
+    busy_ms = _env_int("PCP_SQLITE_BUSY_MS", 5000)
+    mmap = _env_int("PCP_SQLITE_MMAP_MB", 256) * 1024 * 1024
+    cache_kb = _env_int("PCP_SQLITE_CACHE_MB", 64) * 1024
+
+    cursor = dbapi_conn.cursor()
+    if escrita:
+        cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={busy_ms}")
+    cursor.execute(f"PRAGMA mmap_size={mmap}")
+    # Valor negativo = tamanho em KiB
+    cursor.execute(f"PRAGMA cache_size=-{cache_kb}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+# Fila de escrita: uma transação de escrita por vez neste processo
+FILA_ESCRITA = threading.Lock()
+
+# engine de escrita -> engine somente leitura
+_ENGINES_LEITURA = {}
+
+_COMANDOS_LEITURA = ("SELECT", "WITH", "PRAGMA", "EXPLAIN")
+
+
+def _clausula_escreve(clause):
+    if clause is None:
+        return False
+    if getattr(clause, "is_dml", False) or getattr(clause, "is_ddl", False):
+        return True
+    texto = getattr(clause, "text", None)
+    if isinstance(texto, str):
+        return not texto.lstrip().upper().startswith(_COMANDOS_LEITURA)
+    return False
+
+
+class SessaoRoteada(Session):
+    """Sessão que lê pelo engine somente leitura e escreve pelo engine de escrita
+
+    Assim que a transação escreve (flush ou comando DML), ela entra na fila de
+    escrita e passa a usar só a conexão de escrita até o commit/rollback, para
+    enxergar as próprias alterações.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        leitura = _ENGINES_LEITURA.get(engine)
+        if leitura is None:
+            return engine
+
+        if self.info.get("escrita") or self._flushing or _clausula_escreve(clause):
+            self.entrar_fila_escrita()
+            return engine
+        return leitura
+
+    def entrar_fila_escrita(self):
+        """Garante que esta sessão detém a fila de escrita até o fim da transação"""
+        if self.info.get("escrita"):
+            return
+        busy_ms = _env_int("PCP_SQLITE_BUSY_MS", 5000)
+        if not FILA_ESCRITA.acquire(timeout=busy_ms / 1000):
+            raise TimeoutError("Fila de escrita do SQLite ocupada")
+        self.info["escrita"] = True
+
+
+@event.listens_for(SessaoRoteada, "before_flush")
+def _marcar_escrita(session, flush_context, instances):
+    if _ENGINES_LEITURA:
+        session.entrar_fila_escrita()
+
+
+@event.listens_for(SessaoRoteada, "after_transaction_end")
+def _liberar_fila_escrita(session, transaction):
+    if transaction.parent is None and session.info.pop("escrita", False):
+        FILA_ESCRITA.release()
+
+
+def travar(sessao, coluna, ids):
+    """Prende as linhas com `coluna` em `ids` até o fim da transação
+
+    SELECT ... FOR UPDATE (em ordem, para não dar deadlock). O SQLite ignora
+    o FOR UPDATE: lá a sessão entra na fila de escrita, cujo BEGIN IMMEDIATE
+    trava o banco também para os outros processos.
+    """
+    ids = sorted(set(ids))
+    if not ids:
+        return
+    if isinstance(sessao, scoped_session):
+        sessao = sessao()
+    consulta = select(coluna).where(coluna.in_(ids)).order_by(coluna).with_for_update()
+    if isinstance(sessao, SessaoRoteada) and sessao.get_bind(clause=consulta).dialect.name == "sqlite":
+        sessao.entrar_fila_escrita()
+    sessao.execute(consulta)
+
+
+# Requisições que costumam gravar: a transação já começa na fila de escrita
+METODOS_ESCRITA = ("POST", "PUT", "PATCH", "DELETE")
+
+
+def configurar_sqlite(app, db, sem_fila=()):
+    """Ativa WAL, pragmas e separação leitura/escrita para bancos SQLite
+
+    Chamado na subida do servidor, antes da primeira requisição. Requisições
+    POST/PUT/PATCH/DELETE entram na fila de escrita logo no início e leem
+    pela conexão de escrita: um ler-alterar-gravar não parte de um snapshot
+    velho. `sem_fila` lista endpoints que não precisam disso (ex.: o login,
+    que passa a maior parte do tempo no hash da senha).
+    """
+    with app.app_context():
+        engine = db.engine
+    url = engine.url
+    if url.get_backend_name() != "sqlite" or not _sqlite_em_arquivo(str(url)):
+        return
+    if not modo_sqlite_producao():
+        return
+    # Conexões abertas antes daqui não têm os pragmas nem o BEGIN manual
+    engine.dispose()
+
+    @event.listens_for(engine, "connect")
+    def _conectar_escrita(dbapi_conn, connection_record):
+        _aplicar_pragmas(dbapi_conn, escrita=True)
+        # Controlar o BEGIN manualmente (ver evento "begin" abaixo)
+        dbapi_conn.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _begin_escrita(conn):
+        # Pega o lock de escrita já no início: evita "database is locked"
+        # ao promover uma transação de leitura para escrita
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    # Cria o arquivo e o WAL antes de abrir conexões somente leitura
+    with engine.connect():
+        pass
+
+    busy_ms = _env_int("PCP_SQLITE_BUSY_MS", 5000)
+    leitura = create_engine(
+        f"sqlite:///file:{url.database}?mode=ro&uri=true",
+        pool_size=_env_int("GUNICORN_THREADS", 4) + 2,
+        max_overflow=4,
+        connect_args={"timeout": busy_ms / 1000, "check_same_thread": False},
+    )
+
+    @event.listens_for(leitura, "connect")
+    def _conectar_leitura(dbapi_conn, connection_record):
+        _aplicar_pragmas(dbapi_conn, escrita=False)
+
+    _ENGINES_LEITURA[engine] = leitura
+
+    @app.before_request
+    def _escrita_desde_o_inicio():
+        if request.method not in METODOS_ESCRITA or request.endpoint in sem_fila:
+            return
+        sessao = db.session()
+        sessao.entrar_fila_escrita()
+        try:
+            # Abre a transação (BEGIN IMMEDIATE): o fim dela libera a fila
+            sessao.connection()
+        except Exception:
+            if not sessao.in_transaction() and sessao.info.pop("escrita", False):
+                FILA_ESCRITA.release()
+            raise
+    print(f"✅ SQLite em modo produção (WAL, leitura/escrita separadas): {url.database}")
@@ -0,0 +1,154 @@
+"""
+Contadores de conclusão - tarefas por OP e OPs por obra
+
+op.tarefas_total / op.tarefas_concluidas e obra.ops_total / obra.ops_concluidas
+são mantidos na mesma transação das mudanças, com UPDATE atômico
+(coluna = coluna + delta), então saber se a última tarefa da OP foi
+concluída é ler uma linha em vez de carregar todas as tarefas.
+
+Funciona por eventos do SQLAlchemy: depois de cada flush as tarefas/OPs
+inseridas, removidas ou com status alterado viram deltas por OP/obra.
+Alterações em massa (query.update / query.delete) não passam pelos eventos;
+nesses casos rode recalcular() (ou `python migrar_banco.py`).
+"""
+
+from collections import defaultdict
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session, attributes
+
+TAREFA_CONCLUIDA = "CONCLUIDO"
+OP_CONCLUIDA = "CONCLUIDA"
+
+_OP = _Obra = _Etapa = _Tarefa = None
+
+
+def _anterior(obj, campo):
+    """Valor gravado no banco antes deste flush"""
+    historico = attributes.get_history(obj, campo)
+    if historico.deleted:
+        return historico.deleted[0]
+    if historico.unchanged:
+        return historico.unchanged[0]
+    return None
+
+
+def _atual(obj, campo):
+    historico = attributes.get_history(obj, campo)
+    if historico.added:
+        return historico.added[0]
+    if historico.unchanged:
+        return historico.unchanged[0]
+    return getattr(obj, campo)
+
+
+def _mudancas(sessao, modelo, campo_pai, campo_status, concluido):
+    """Lista de (pai_antes, concluido_antes, pai_depois, concluido_depois)"""
+    mudancas = []
+    for obj in sessao.new:
+        if isinstance(obj, modelo):
+            mudancas.append((None, False, getattr(obj, campo_pai), getattr(obj, campo_status) == concluido))
+    for obj in sessao.dirty:
+        if isinstance(obj, modelo):
+            antes = (_anterior(obj, campo_pai), _anterior(obj, campo_status) == concluido)
+            depois = (_atual(obj, campo_pai), _atual(obj, campo_status) == concluido)
+            if antes != depois:
+                mudancas.append(antes + depois)
+    for obj in sessao.deleted:
+        if isinstance(obj, modelo):
+            mudancas.append((_anterior(obj, campo_pai), _anterior(obj, campo_status) == concluido, None, False))
+    return mudancas
+
+
+def _deltas(mudancas, pai_de=lambda chave: chave):
+    deltas = defaultdict(lambda: [0, 0])  # id do pai -> [total, concluidas]
+    for pai_antes, concl_antes, pai_depois, concl_depois in mudancas:
+        pai_antes, pai_depois = pai_de(pai_antes), pai_de(pai_depois)
+        if pai_antes is not None:
+            deltas[pai_antes][0] -= 1
+            deltas[pai_antes][1] -= concl_antes
+        if pai_depois is not None:
+            deltas[pai_depois][0] += 1
+            deltas[pai_depois][1] += concl_depois
+    return {pai: d for pai, d in deltas.items() if d[0] or d[1]}
+
+
+def _ops_das_etapas(sessao, etapa_ids):
+    """etapa_id -> op_id (identity map primeiro, o resto numa consulta)"""
+    mapa = {}
+    faltando = set()
+    for etapa_id in etapa_ids:
+        etapa = sessao.identity_map.get(sessao.identity_key(_Etapa, etapa_id))
+        if etapa is not None and etapa.op_id is not None:
+            mapa[etapa_id] = etapa.op_id
+        else:
+            faltando.add(etapa_id)
+    if faltando:
+        tabela = _Etapa.__table__
+        linhas = sessao.connection().execute(select(tabela.c.id, tabela.c.op_id).where(tabela.c.id.in_(faltando)))
+        mapa.update(dict(linhas.all()))
+    return mapa
+
+
+def _aplicar(sessao, modelo, deltas, campo_total, campo_concluidas):
+    tabela = modelo.__table__
+    conexao = sessao.connection()
+    for pai_id, (d_total, d_concluidas) in deltas.items():
+        conexao.execute(
+            tabela.update().where(tabela.c.id == pai_id).values({
+                campo_total: tabela.c[campo_total] + d_total,
+                campo_concluidas: tabela.c[campo_concluidas] + d_concluidas,
+            })
+        )
+    sessao.info.setdefault("contadores_expirar", set()).update(
+        (modelo, pai_id, campo_total, campo_concluidas) for pai_id in deltas
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _atualizar_contadores(sessao, contexto):
+    if _Tarefa is None:
+        return
+
+    mudancas_tarefas = _mudancas(sessao, _Tarefa, "etapa_id", "status", TAREFA_CONCLUIDA)
+    if mudancas_tarefas:
+        etapas = {e for m in mudancas_tarefas for e in (m[0], m[2]) if e is not None}
+        op_da_etapa = _ops_das_etapas(sessao, etapas)
+        deltas = _deltas(mudancas_tarefas, lambda etapa_id: op_da_etapa.get(etapa_id))
+        _aplicar(sessao, _OP, deltas, "tarefas_total", "tarefas_concluidas")
+
+    mudancas_ops = _mudancas(sessao, _OP, "obra_id", "status", OP_CONCLUIDA)
+    if mudancas_ops:
+        _aplicar(sessao, _Obra, _deltas(mudancas_ops), "ops_total", "ops_concluidas")
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _expirar_contadores(sessao, contexto):
+    # Os objetos carregados ainda têm o valor antigo: relê na próxima leitura
+    for modelo, pai_id, *campos in sessao.info.pop("contadores_expirar", ()):
+        obj = sessao.identity_map.get(sessao.identity_key(modelo, pai_id))
+        if obj is not None:
+            sessao.expire(obj, campos)
+
+
+def recalcular(sessao):
+    """Recalcula todos os contadores a partir das tarefas e OPs (backfill)"""
+    op, obra, etapa, tarefa = _OP.__table__, _Obra.__table__, _Etapa.__table__, _Tarefa.__table__
+
+    total_tarefas = (select(func.count()).select_from(tarefa.join(etapa, tarefa.c.etapa_id == etapa.c.id))
+                     .where(etapa.c.op_id == op.c.id).scalar_subquery())
+    tarefas_concluidas = (select(func.count()).select_from(tarefa.join(etapa, tarefa.c.etapa_id == etapa.c.id))
+                          .where(etapa.c.op_id == op.c.id, tarefa.c.status == TAREFA_CONCLUIDA).scalar_subquery())
+    sessao.execute(op.update().values(tarefas_total=total_tarefas, tarefas_concluidas=tarefas_concluidas))
+
+    total_ops = select(func.count()).select_from(op).where(op.c.obra_id == obra.c.id).scalar_subquery()
+    ops_concluidas = (select(func.count()).select_from(op)
+                      .where(op.c.obra_id == obra.c.id, op.c.status == OP_CONCLUIDA).scalar_subquery())
+    sessao.execute(obra.update().values(ops_total=total_ops, ops_concluidas=ops_concluidas))
+    sessao.expire_all()
+
+
+def init_app(op, obra, etapa, tarefa):
+    """Liga os contadores aos modelos OP, Obra, Etapa e Tarefa"""
+    global _OP, _Obra, _Etapa, _Tarefa
+    _OP, _Obra, _Etapa, _Tarefa = op, obra, etapa, tarefa
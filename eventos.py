@@ -0,0 +1,205 @@
+"""
+Eventos de domínio - publicados na transação, entregues depois do commit
+
+As rotas só publicam o que aconteceu:
+
+    eventos.publicar(db.session, eventos.TarefaConcluida(tarefa_id=..., op_id=...))
+    db.session.commit()
+
+e quem precisa reagir (notificações, caches, agregados...) assina uma vez:
+
+    @eventos.assinar(eventos.OPConcluida)                   # síncrono
+    @eventos.assinar(eventos.OPConcluida, assincrono=True)  # pool de threads
+
+Os eventos só são entregues se o commit der certo; num rollback eles são
+descartados. Assinantes síncronos rodam logo depois do commit, na thread da
+requisição, e não devem usar a sessão do banco (a transação já terminou):
+servem para caches em memória, métricas e avisos. Assinantes assíncronos
+rodam num pool de threads com app_context próprio (sessão nova), então
+podem ler e gravar no banco sem atrasar a resposta.
+
+Erro em assinante é logado e não afeta a rota nem os outros assinantes.
+
+Variáveis de ambiente:
+    PCP_EVENTOS_THREADS    threads dos assinantes assíncronos (padrão: 2)
+    PCP_EVENTOS_SINCRONO   1 = roda os assíncronos na hora (scripts e testes)
+"""
+
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import log_estruturado
+import metricas
+
+THREADS = int(os.environ.get("PCP_EVENTOS_THREADS", "2"))
+
+log = log_estruturado.obter("eventos")
+
+metricas.registro.contador("pcp_eventos_total", "Eventos de domínio entregues por tipo")
+metricas.registro.contador("pcp_eventos_erros_total", "Erros em assinantes de eventos por tipo")
+
+
+# ============ EVENTOS ============
+
+@dataclass(frozen=True)
+class Evento:
+    em: datetime = field(default_factory=datetime.now, kw_only=True)
+
+    @property
+    def tipo(self):
+        return type(self).__name__
+
+
+@dataclass(frozen=True)
+class TarefaConcluida(Evento):
+    tarefa_id: int
+    op_id: int
+    etapa_id: int
+    usuario_id: int = None
+
+
+@dataclass(frozen=True)
+class TarefaPausada(Evento):
+    tarefa_id: int
+    op_id: int
+    justificativa: str = ""
+
+
+@dataclass(frozen=True)
+class TarefaAtualizada(Evento):
+    tarefa_id: int
+    op_id: int
+    status: str
+
+
+@dataclass(frozen=True)
+class OPConcluida(Evento):
+    op_id: int
+    obra_id: int
+
+
+@dataclass(frozen=True)
+class ObraConcluida(Evento):
+    obra_id: int
+
+
+@dataclass(frozen=True)
+class ApontamentoFinalizado(Evento):
+    apontamento_id: int
+    op_id: int
+    etapa_id: int
+    operador_id: int
+    maquina_id: int = None
+
+
+@dataclass(frozen=True)
+class PendenciaAtualizada(Evento):
+    pendencia_id: int
+    obra_id: int
+    status: str
+
+
+@dataclass(frozen=True)
+class PendenciaRecebida(Evento):
+    pendencia_id: int
+    obra_id: int
+
+
+# ============ BARRAMENTO ============
+
+_assinantes = defaultdict(list)  # tipo -> [(funcao, assincrono)]
+_app = None
+_pool = None
+_trava_pool = threading.Lock()
+
+
+def assinar(tipo, assincrono=False):
+    """Decorator: registra `funcao(evento)` para eventos do `tipo` (ou subclasses)"""
+    def decorador(funcao):
+        _assinantes[tipo].append((funcao, assincrono))
+        return funcao
+    return decorador
+
+
+def publicar(sessao, evento):
+    """Guarda o evento na sessão; só é entregue depois do commit"""
+    sessao.info.setdefault("eventos_pendentes", []).append(evento)
+
+
+def _assinantes_de(evento):
+    for tipo in type(evento).__mro__:
+        yield from _assinantes.get(tipo, ())
+
+
+def _chamar(funcao, evento):
+    try:
+        funcao(evento)
+    except Exception:
+        metricas.registro.inc("pcp_eventos_erros_total", tipo=evento.tipo)
+        log.exception("Erro no assinante de evento", extra={"evento": evento.tipo, "assinante": funcao.__name__})
+
+
+def _chamar_com_app(funcao, evento):
+    with _app.app_context():
+        _chamar(funcao, evento)
+
+
+def _pool_assincrono():
+    global _pool
+    with _trava_pool:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix="eventos")
+        return _pool
+
+
+def entregar(evento):
+    """Entrega um evento agora (normalmente chamado no fim da transação)"""
+    metricas.registro.inc("pcp_eventos_total", tipo=evento.tipo)
+    for funcao, assincrono in _assinantes_de(evento):
+        if not assincrono:
+            _chamar(funcao, evento)
+        elif os.environ.get("PCP_EVENTOS_SINCRONO") == "1":
+            _chamar_com_app(funcao, evento)
+        else:
+            _pool_assincrono().submit(_chamar_com_app, funcao, evento)
+
+
+@event.listens_for(Session, "after_commit")
+def _confirmar_no_commit(sessao):
+    confirmados = sessao.info.setdefault("eventos_confirmados", [])
+    confirmados.extend(sessao.info.pop("eventos_pendentes", ()))
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_no_rollback(sessao):
+    sessao.info.pop("eventos_pendentes", None)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _entregar_no_fim(sessao, transacao):
+    # Entrega só quando a transação raiz terminou de vez: a conexão e a fila
+    # de escrita do SQLite (config_banco) já foram liberadas
+    if transacao.parent is None:
+        for evento in sessao.info.pop("eventos_confirmados", ()):
+            entregar(evento)
+
+
+def aguardar():
+    """Espera os assinantes assíncronos terminarem (scripts e testes)"""
+    global _pool
+    with _trava_pool:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+def init_app(app):
+    global _app
+    _app = app
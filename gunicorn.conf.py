@@ -0,0 +1,85 @@
+"""
+Configuração do gunicorn - lê o perfil de deploy de config_banco.py
+
+Uso: gunicorn -c gunicorn.conf.py app:app
+"""
+
+import glob
+import os
+import tempfile
+
+from config_banco import perfil_atual
+
+_perfil = perfil_atual()
+
+# Métricas somadas entre os workers (ver metricas.py)
+os.environ.setdefault("PCP_METRICS_DIR", os.path.join(tempfile.gettempdir(), "pcp_metricas"))
+
+if _perfil["worker_class"] == "gevent":
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        print("⚠️ gevent não instalado, usando perfil gthread")
+        _perfil["worker_class"] = "gthread"
+        _perfil["threads"] = max(_perfil["threads"], 4)
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+worker_class = _perfil["worker_class"]
+workers = _perfil["workers"]
+threads = _perfil["threads"]
+worker_connections = _perfil["worker_connections"]
+
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = 20
+keepalive = 5
+
+# Reciclar workers periodicamente evita crescimento de memória
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = 200
+
+# Fila de conexões do socket durante picos (troca de turno)
+backlog = int(os.environ.get("GUNICORN_BACKLOG", "256"))
+
+accesslog = "-"
+
+
+def on_starting(server):
+    """Zera as métricas de execuções anteriores do servidor"""
+    diretorio = os.environ["PCP_METRICS_DIR"]
+    os.makedirs(diretorio, exist_ok=True)
+    for caminho in glob.glob(os.path.join(diretorio, "pcp_*.json")):
+        os.remove(caminho)
+
+
+def post_fork(server, worker):
+    """Prepara cada worker recém criado"""
+    if worker_class == "gevent":
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            server.log.warning("psycogreen não instalado: psycopg2 vai bloquear o loop do gevent")
+
+
+def post_worker_init(worker):
+    """Descarta conexões herdadas do processo mestre (preload_app)"""
+    from app import app, db, notificacoes, preparar_banco_servidor, scheduler
+    with app.app_context():
+        db.engine.dispose()
+    preparar_banco_servidor()
+    notificacoes.iniciar_despachante()
+    # Todos os workers sobem o agendador; só o líder executa os jobs
+    scheduler.start()
+    worker.log.info(
+        "Worker pronto: perfil=%s classe=%s threads=%s",
+        _perfil["nome"], worker_class, threads,
+    )
+
+
+def worker_exit(server, worker):
+    """Grava as últimas métricas do worker antes de ele sair"""
+    import metricas
+    try:
+        metricas.registro.gravar()
+    except OSError as e:
+        server.log.warning("Não foi possível gravar as métricas do worker: %s", e)
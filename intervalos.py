@@ -0,0 +1,125 @@
+"""
+Intervalos de tempo - união, recorte por dia e soma sem contar sobreposição
+
+Um intervalo é uma tupla (inicio, fim) de datetimes com inicio < fim.
+
+    unir([(8h, 10h), (9h, 11h), (13h, 14h)])   -> [(8h, 11h), (13h, 14h)]
+    segundos_unidos(intervalos)                 -> 4h em segundos
+    por_dia(intervalos)                         -> {dia: [(ini, fim), ...]} recortados à meia-noite
+    conflitos([(ini, fim, valor), ...])         -> pares de valores que se sobrepõem
+
+`fim` None é um intervalo em aberto (apontamento em andamento).
+
+IndiceIntervalos guarda intervalos sem sobreposição ordenados por início e
+responde "este intervalo novo bate com algum?" com duas buscas binárias.
+"""
+
+import heapq
+from bisect import bisect_left, bisect_right
+from datetime import datetime, time, timedelta
+
+ABERTO = datetime.max
+
+
+def unir(intervalos):
+    """União dos intervalos, ordenada e sem sobreposição (varredura por início)"""
+    unidos = []
+    for inicio, fim in sorted(i for i in intervalos if i[0] < i[1]):
+        if unidos and inicio <= unidos[-1][1]:
+            if fim > unidos[-1][1]:
+                unidos[-1] = (unidos[-1][0], fim)
+        else:
+            unidos.append((inicio, fim))
+    return unidos
+
+
+def segundos(intervalos):
+    return sum((fim - inicio).total_seconds() for inicio, fim in intervalos)
+
+
+def segundos_unidos(intervalos):
+    """Tempo coberto pelos intervalos, contando sobreposições uma vez só"""
+    return segundos(unir(intervalos))
+
+
+def recortar(intervalos, inicio, fim):
+    """Parte dos intervalos dentro de [inicio, fim)"""
+    recortados = []
+    for a, b in intervalos:
+        a, b = max(a, inicio), min(b, fim)
+        if a < b:
+            recortados.append((a, b))
+    return recortados
+
+
+def dias(inicio, fim):
+    """Dias (date) tocados pelo intervalo [inicio, fim)"""
+    dia = inicio.date()
+    ultimo = (fim - timedelta(microseconds=1)).date() if fim > inicio else dia
+    while dia <= ultimo:
+        yield dia
+        dia += timedelta(days=1)
+
+
+def por_dia(intervalos):
+    """Quebra os intervalos na meia-noite: {dia: [(inicio, fim), ...]}"""
+    resultado = {}
+    for inicio, fim in intervalos:
+        for dia in dias(inicio, fim):
+            meia_noite = datetime.combine(dia, time.min)
+            parte = recortar([(inicio, fim)], meia_noite, meia_noite + timedelta(days=1))
+            if parte:
+                resultado.setdefault(dia, []).extend(parte)
+    return resultado
+
+
+def conflitos(itens):
+    """Pares (valor_a, valor_b) de intervalos que se sobrepõem
+
+    `itens` é uma lista de (inicio, fim, valor). Varredura por início com um
+    heap dos intervalos ainda abertos: O(n log n + pares).
+    """
+    pares = []
+    ativos = []  # heap de (fim, ordem, valor)
+    ordenados = sorted(((ini, fim or ABERTO, valor) for ini, fim, valor in itens), key=lambda i: (i[0], i[1]))
+    for ordem, (inicio, fim, valor) in enumerate(ordenados):
+        while ativos and ativos[0][0] <= inicio:
+            heapq.heappop(ativos)
+        pares.extend((outro, valor) for _, _, outro in ativos)
+        heapq.heappush(ativos, (fim, ordem, valor))
+    return pares
+
+
+class IndiceIntervalos:
+    """Intervalos sem sobreposição ordenados por início (busca O(log n))
+
+    Quem adiciona garante que o intervalo novo não bate com nenhum (é para
+    isso que serve `sobreposicao`); assim só o vizinho anterior pode
+    avançar sobre o início do novo, e só o primeiro posterior pode começar
+    antes do fim dele.
+    """
+
+    def __init__(self, itens=()):
+        self._inicios = []
+        self._itens = []
+        for inicio, fim, valor in sorted(itens, key=lambda i: i[0]):
+            self._inicios.append(inicio)
+            self._itens.append((inicio, fim or ABERTO, valor))
+
+    def __len__(self):
+        return len(self._itens)
+
+    def sobreposicao(self, inicio, fim=None):
+        """Valor de um intervalo que bate com [inicio, fim) ou None"""
+        fim = fim or ABERTO
+        i = bisect_right(self._inicios, inicio)
+        if i > 0 and self._itens[i - 1][1] > inicio:
+            return self._itens[i - 1][2]
+        if i < len(self._itens) and self._itens[i][0] < fim:
+            return self._itens[i][2]
+        return None
+
+    def adicionar(self, inicio, fim=None, valor=None):
+        i = bisect_left(self._inicios, inicio)
+        self._inicios.insert(i, inicio)
+        self._itens.insert(i, (inicio, fim or ABERTO, valor))
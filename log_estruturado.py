@@ -0,0 +1,158 @@
+"""
+Log estruturado - registros em JSON com request ID, sem bloquear a requisição
+
+Os loggers "pcp.*" não escrevem direto no stdout: o registro vai para uma
+fila em memória e uma thread separada (QueueListener) formata e grava.
+Assim a escrita no stdout nunca segura a thread da requisição.
+
+Mensagens de alto volume (autenticação / permissão concedida) passam por
+amostragem: só uma fração dos registros INFO é gravada. WARNING e acima
+(ex.: acesso negado) são sempre gravados.
+
+Variáveis de ambiente:
+    PCP_LOG_NIVEL       DEBUG | INFO | WARNING... (padrão: INFO)
+    PCP_LOG_FORMATO     json | texto (padrão: json)
+    PCP_LOG_AMOSTRA     fração dos logs INFO de auth/permissão gravados (padrão: 0.05)
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import uuid
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+
+# Loggers com amostragem dos registros INFO
+LOGGERS_AMOSTRADOS = ("pcp.auth", "pcp.permissao")
+
+_RE_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+# Atributos padrão do LogRecord (o resto vem de extra= e vai para o JSON)
+_ATRIBUTOS_PADRAO = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+_listener = None
+
+
+def obter(nome):
+    """Logger do PCP: obter("api") -> logging.getLogger("pcp.api")"""
+    return logging.getLogger(f"pcp.{nome}")
+
+
+class FiltroRequestId(logging.Filter):
+    """Copia o request ID da requisição atual para o registro"""
+
+    def filter(self, record):
+        if not hasattr(record, "request_id"):
+            record.request_id = g.get("request_id") if has_request_context() else None
+        return True
+
+
+class FiltroAmostragem(logging.Filter):
+    """Deixa passar só uma fração dos registros abaixo de WARNING"""
+
+    def __init__(self, taxa):
+        super().__init__()
+        self.taxa = taxa
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.taxa
+
+
+class FormatadorJson(logging.Formatter):
+    def format(self, record):
+        dados = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            dados["request_id"] = record.request_id
+        for chave, valor in vars(record).items():
+            if chave not in _ATRIBUTOS_PADRAO:
+                dados[chave] = valor
+        if record.exc_text:
+            dados["exc"] = record.exc_text
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+class FormatadorTexto(logging.Formatter):
+    """Formato legível para desenvolvimento local"""
+
+    def format(self, record):
+        texto = f"{self.formatTime(record)} {record.levelname} [{record.name}] {record.getMessage()}"
+        extras = {k: v for k, v in vars(record).items() if k not in _ATRIBUTOS_PADRAO}
+        if getattr(record, "request_id", None):
+            extras["request_id"] = record.request_id
+        if extras:
+            texto += " " + " ".join(f"{k}={v}" for k, v in extras.items())
+        if record.exc_text:
+            texto += "\n" + record.exc_text
+        return texto
+
+
+class _HandlerFila(QueueHandler):
+    """Só resolve a mensagem na thread da requisição; o resto é no listener"""
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configurar():
+    """Liga a fila de log do logger "pcp" (idempotente)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    formato = os.environ.get("PCP_LOG_FORMATO", "json").strip().lower()
+    saida = logging.StreamHandler(sys.stdout)
+    saida.setFormatter(FormatadorTexto() if formato == "texto" else FormatadorJson())
+
+    fila = queue.SimpleQueue()
+    handler = _HandlerFila(fila)
+    handler.addFilter(FiltroRequestId())
+
+    raiz = logging.getLogger("pcp")
+    raiz.setLevel(os.environ.get("PCP_LOG_NIVEL", "INFO").strip().upper())
+    raiz.addHandler(handler)
+    raiz.propagate = False
+
+    taxa = float(os.environ.get("PCP_LOG_AMOSTRA", "0.05"))
+    for nome in LOGGERS_AMOSTRADOS:
+        logging.getLogger(nome).addFilter(FiltroAmostragem(taxa))
+
+    _listener = QueueListener(fila, saida)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+# ============ HOOKS DO FLASK ============
+
+def _definir_request_id():
+    recebido = request.headers.get("X-Request-ID", "")
+    g.request_id = recebido if _RE_REQUEST_ID.match(recebido) else uuid.uuid4().hex[:16]
+
+
+def _devolver_request_id(response):
+    if "request_id" in g:
+        response.headers["X-Request-ID"] = g.request_id
+    return response
+
+
+def init_app(app):
+    """Configura o log estruturado e o request ID no app Flask"""
+    configurar()
+    app.before_request(_definir_request_id)
+    app.after_request(_devolver_request_id)
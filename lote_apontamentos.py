@@ -0,0 +1,281 @@
+"""
+Lote de apontamentos - eventos de início/fim de um terminal num envio só
+
+Um terminal (coletor de código de barras, tablet na máquina) que ficou
+offline manda os eventos guardados de uma vez, em JSON (lista ou
+{"eventos": [...]}) ou NDJSON (um evento por linha):
+
+    {"tipo": "inicio", "ref": "serra-0815", "op_id": 12, "etapa_id": 70,
+     "operador_id": 3, "maquina_id": 1, "em": "2026-10-19T07:02:11"}
+    {"tipo": "fim", "ref": "serra-0815", "em": "2026-10-19T09:40:00",
+     "qtd_boa": 40, "qtd_refugo": 1}
+    {"tipo": "fim", "apontamento_id": 5512, "em": "2026-10-19T10:00:00"}
+
+`ref` liga o fim ao início do mesmo lote (vira um apontamento já
+finalizado); `apontamento_id` finaliza um apontamento que já está no banco.
+
+OP, etapa, operador e máquina são validados contra o cache de cadastros
+(cache_cadastros.py), sem uma consulta por evento. Apontamentos do mesmo
+operador não podem se sobrepor (nem com os do banco nem entre si), o que
+também torna o reenvio de um lote inofensivo: os repetidos voltam como
+sobreposição. Os válidos entram num INSERT em lote e os fins num UPDATE em
+lote (com os apontamentos a finalizar travados), tudo numa transação; o
+resultado vem por evento, na ordem recebida.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import insert, or_, update
+
+import eventos
+import intervalos
+from config_banco import travar
+
+_db = None
+_Apontamento = None
+_Operador = None
+_cache = None
+_agregado_horas = None
+
+
+class ErroEvento(ValueError):
+    pass
+
+
+def _data_hora(valor, campo):
+    if not valor:
+        raise ErroEvento(f"'{campo}' é obrigatório")
+    try:
+        data = datetime.fromisoformat(str(valor))
+    except ValueError:
+        raise ErroEvento(f"'{campo}' inválido: {valor!r}") from None
+    if data.tzinfo is not None:
+        data = data.astimezone().replace(tzinfo=None)
+    return data
+
+
+def _inteiro(evento, campo, obrigatorio=True, padrao=None):
+    valor = evento.get(campo)
+    if valor in (None, ""):
+        if obrigatorio:
+            raise ErroEvento(f"'{campo}' é obrigatório")
+        return padrao
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        raise ErroEvento(f"'{campo}' inválido: {valor!r}") from None
+
+
+def _ler(indice, evento):
+    if not isinstance(evento, dict):
+        raise ErroEvento("evento deve ser um objeto")
+    tipo = evento.get("tipo")
+    if tipo == "inicio":
+        return {
+            "indice": indice,
+            "tipo": tipo,
+            "ref": evento.get("ref"),
+            "op_id": _inteiro(evento, "op_id"),
+            "etapa_id": _inteiro(evento, "etapa_id"),
+            "operador_id": _inteiro(evento, "operador_id"),
+            "maquina_id": _inteiro(evento, "maquina_id", obrigatorio=False),
+            "inicio": _data_hora(evento.get("em"), "em"),
+            "obs": (str(evento.get("obs") or "").strip() or None),
+        }
+    if tipo == "fim":
+        if evento.get("ref") is None and evento.get("apontamento_id") is None:
+            raise ErroEvento("fim precisa de 'ref' ou 'apontamento_id'")
+        return {
+            "indice": indice,
+            "tipo": tipo,
+            "ref": evento.get("ref"),
+            "apontamento_id": _inteiro(evento, "apontamento_id", obrigatorio=False),
+            "fim": _data_hora(evento.get("em"), "em"),
+            "qtd_boa": _inteiro(evento, "qtd_boa", obrigatorio=False, padrao=0),
+            "qtd_refugo": _inteiro(evento, "qtd_refugo", obrigatorio=False, padrao=0),
+            "obs": (str(evento.get("obs") or "").strip() or None),
+        }
+    raise ErroEvento("'tipo' deve ser 'inicio' ou 'fim'")
+
+
+def _validar_inicio(item, dados, etapas):
+    op = dados.ops.get(item["op_id"])
+    if op is None:
+        raise ErroEvento(f"OP {item['op_id']} não encontrada")
+    if op.status == "CONCLUIDA":
+        raise ErroEvento(f"OP {op.numero} já está concluída")
+    etapa = etapas.get(item["etapa_id"])
+    if etapa is None or etapa.op_id != op.id:
+        raise ErroEvento(f"etapa {item['etapa_id']} não pertence à OP {op.numero}")
+    if item["operador_id"] not in dados.operadores:
+        raise ErroEvento(f"operador {item['operador_id']} não encontrado ou inativo")
+    if item["maquina_id"] is not None and item["maquina_id"] not in dados.maquinas:
+        raise ErroEvento(f"máquina {item['maquina_id']} não encontrada ou inativa")
+    item["obra_id"] = op.obra_id
+
+
+def processar(lista):
+    """Valida e grava os eventos (sem commit); devolve o resultado por evento"""
+    resultados = [None] * len(lista)
+
+    def erro(indice, mensagem):
+        resultados[indice] = {"indice": indice, "ok": False, "erro": mensagem}
+
+    # 1. Leitura
+    inicios, fins = [], []
+    for indice, evento in enumerate(lista):
+        try:
+            item = _ler(indice, evento)
+        except ErroEvento as e:
+            erro(indice, str(e))
+            continue
+        (inicios if item["tipo"] == "inicio" else fins).append(item)
+
+    # 2. Fins com ref fecham um início do próprio lote
+    por_ref = {}
+    for item in inicios:
+        if item["ref"] is not None:
+            if item["ref"] in por_ref:
+                erro(item["indice"], f"ref repetida: {item['ref']}")
+                continue
+            por_ref[item["ref"]] = item
+    inicios = [i for i in inicios if resultados[i["indice"]] is None]
+    fechar_existentes = []
+    for item in fins:
+        if item["apontamento_id"] is not None:
+            fechar_existentes.append(item)
+            continue
+        inicio = por_ref.get(item["ref"])
+        if inicio is None:
+            erro(item["indice"], f"nenhum início com ref {item['ref']} neste lote")
+        elif "fim" in inicio:
+            erro(item["indice"], f"ref {item['ref']} já foi finalizada neste lote")
+        elif item["fim"] <= inicio["inicio"]:
+            erro(item["indice"], "fim antes do início")
+        else:
+            inicio.update(fim=item["fim"], qtd_boa=item["qtd_boa"], qtd_refugo=item["qtd_refugo"],
+                          obs=item["obs"] or inicio["obs"], indice_fim=item["indice"])
+
+    # 3. Cadastros (cache em memória)
+    dados = _cache.cache.obter_com("ops", {i["op_id"] for i in inicios})
+    etapas = _cache.cache.etapas({i["etapa_id"] for i in inicios})
+    validos = []
+    for item in inicios:
+        try:
+            _validar_inicio(item, dados, etapas)
+            validos.append(item)
+        except ErroEvento as e:
+            erro(item["indice"], str(e))
+            if "indice_fim" in item:
+                erro(item["indice_fim"], f"início {item['indice']} rejeitado")
+
+    # 4. Apontamentos existentes a finalizar (travados antes da leitura: um
+    # apontamento_finalizar ou outro lote não fecha o mesmo no meio do caminho)
+    ap = _Apontamento
+    existentes = {}
+    ids = {i["apontamento_id"] for i in fechar_existentes}
+    if ids:
+        travar(_db.session, ap.id, ids)
+        existentes = {a.id: a for a in ap.query.filter(ap.id.in_(ids)).populate_existing()}
+    fechamentos = {}
+    for item in fechar_existentes:
+        atual = existentes.get(item["apontamento_id"])
+        if atual is None:
+            erro(item["indice"], f"apontamento {item['apontamento_id']} não encontrado")
+        elif atual.status != "EM_ANDAMENTO" or atual.id in fechamentos:
+            erro(item["indice"], f"apontamento {atual.id} já está finalizado")
+        elif item["fim"] <= atual.inicio:
+            erro(item["indice"], "fim antes do início")
+        else:
+            fechamentos[atual.id] = item
+
+    # 5. Sobreposição por operador: banco + lote, em ordem de início (com os
+    # operadores travados até o commit, como em apontamento_novo)
+    if validos:
+        operadores = {i["operador_id"] for i in validos}
+        travar(_db.session, _Operador.id, operadores)
+        menor = min(i["inicio"] for i in validos)
+        maior = max(i.get("fim") or intervalos.ABERTO for i in validos)
+        no_banco = ap.query.filter(
+            ap.operador_id.in_(operadores),
+            ap.inicio < maior,
+            or_(ap.fim.is_(None), ap.fim > menor),
+        ).all()
+        indices = {o: intervalos.IndiceIntervalos() for o in operadores}
+        for a in no_banco:
+            fim = fechamentos[a.id]["fim"] if a.id in fechamentos else a.fim
+            indices[a.operador_id].adicionar(a.inicio, fim, a.id)
+        aceitos = []
+        for item in sorted(validos, key=lambda i: i["inicio"]):
+            indice = indices[item["operador_id"]]
+            conflito = indice.sobreposicao(item["inicio"], item.get("fim"))
+            if conflito is not None:
+                outro = f"apontamento {conflito}" if isinstance(conflito, int) else f"evento {conflito[1]}"
+                erro(item["indice"], f"operador já tem o {outro} nesse horário")
+                if "indice_fim" in item:
+                    erro(item["indice_fim"], f"início {item['indice']} rejeitado")
+                continue
+            indice.adicionar(item["inicio"], item.get("fim"), ("lote", item["indice"]))
+            aceitos.append(item)
+        validos = sorted(aceitos, key=lambda i: i["indice"])
+
+    # 6. Gravação em lote
+    finalizados = []
+    if validos:
+        linhas = [{
+            "obra_id": i["obra_id"],
+            "op_id": i["op_id"],
+            "etapa_id": i["etapa_id"],
+            "operador_id": i["operador_id"],
+            "maquina_id": i["maquina_id"],
+            "inicio": i["inicio"],
+            "fim": i.get("fim"),
+            "qtd_boa": i.get("qtd_boa", 0),
+            "qtd_refugo": i.get("qtd_refugo", 0),
+            "obs": i["obs"],
+            "status": "FINALIZADO" if i.get("fim") else "EM_ANDAMENTO",
+        } for i in validos]
+        ids = _db.session.execute(
+            insert(ap.__table__).returning(ap.__table__.c.id, sort_by_parameter_order=True), linhas
+        ).scalars().all()
+        for item, novo_id, linha in zip(validos, ids, linhas):
+            resultados[item["indice"]] = {"indice": item["indice"], "ok": True, "apontamento_id": novo_id}
+            if "indice_fim" in item:
+                resultados[item["indice_fim"]] = {"indice": item["indice_fim"], "ok": True, "apontamento_id": novo_id}
+                finalizados.append({**linha, "id": novo_id})
+
+    if fechamentos:
+        linhas = []
+        for apontamento_id, item in fechamentos.items():
+            atual = existentes[apontamento_id]
+            linhas.append({
+                "id": apontamento_id,
+                "fim": item["fim"],
+                "status": "FINALIZADO",
+                "qtd_boa": item["qtd_boa"] or atual.qtd_boa or 0,
+                "qtd_refugo": item["qtd_refugo"] or atual.qtd_refugo or 0,
+                "obs": item["obs"] or atual.obs,
+            })
+            resultados[item["indice"]] = {"indice": item["indice"], "ok": True, "apontamento_id": apontamento_id}
+            finalizados.append({
+                "id": apontamento_id, "op_id": atual.op_id, "etapa_id": atual.etapa_id,
+                "operador_id": atual.operador_id, "maquina_id": atual.maquina_id,
+                "inicio": atual.inicio, "fim": item["fim"],
+            })
+        _db.session.execute(update(ap), linhas)
+
+    # 7. Agregados e eventos dos finalizados
+    for linha in finalizados:
+        registro = _Apontamento(**{k: linha[k] for k in ("id", "etapa_id", "operador_id", "inicio", "fim")})
+        _agregado_horas.registrar(registro)
+        eventos.publicar(_db.session, eventos.ApontamentoFinalizado(
+            apontamento_id=linha["id"], op_id=linha["op_id"], etapa_id=linha["etapa_id"],
+            operador_id=linha["operador_id"], maquina_id=linha["maquina_id"]))
+
+    return resultados
+
+
+def init_app(db, apontamento, operador, cache, agregado_horas):
+    """Liga o lote aos modelos Apontamento e Operador, ao cache de cadastros e ao agregado de horas"""
+    global _db, _Apontamento, _Operador, _cache, _agregado_horas
+    _db, _Apontamento, _Operador, _cache, _agregado_horas = db, apontamento, operador, cache, agregado_horas
@@ -0,0 +1,315 @@
+"""
+Métricas no formato do Prometheus - endpoint /metrics
+
+Registro simples em memória (contadores e histogramas) alimentado pelo
+perfil_requisicoes.py e por quem mais quiser contar algo (caches, filas...).
+Valores do momento (apontamentos ativos, tarefas atrasadas, fila de
+notificações) são calculados na hora da coleta por funções registradas com
+registrar_gauge().
+
+Com vários workers do gunicorn cada processo tem o seu registro. Quando
+PCP_METRICS_DIR está definido, cada worker grava periodicamente um arquivo
+pcp_<pid>.json nesse diretório e o /metrics soma os arquivos de todos os
+workers (inclusive dos que já foram reciclados pelo max_requests).
+
+Variáveis de ambiente:
+    PCP_METRICS_DIR         diretório compartilhado entre os workers
+    PCP_METRICS_INTERVALO   segundos entre gravações do arquivo (padrão: 5)
+    PCP_METRICS_TOKEN       exige "Authorization: Bearer <token>"; sem ele o
+                            /metrics responde 503
+    PCP_METRICS_PUBLICO     1 = /metrics sem token (rede interna, só para teste)
+"""
+
+import glob
+import hmac
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem compactação dos arquivos de workers mortos
+    fcntl = None
+
+# Limites dos histogramas de latência (segundos)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_ARQUIVO_MORTOS = "pcp_mortos.json"
+
+
+def _chave(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _formatar_labels(labels, extra=None):
+    itens = list(labels) + (list(extra) if extra else [])
+    if not itens:
+        return ""
+    partes = []
+    for nome, valor in itens:
+        valor = str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        partes.append(f'{nome}="{valor}"')
+    return "{" + ",".join(partes) + "}"
+
+
+def _formatar_numero(valor):
+    if valor == int(valor):
+        return str(int(valor))
+    return repr(float(valor))
+
+
+class Registro:
+    """Contadores e histogramas deste processo"""
+
+    def __init__(self):
+        self.trava = threading.Lock()
+        self.descricoes = {}   # nome -> (tipo, ajuda)
+        self.contadores = {}   # (nome, labels) -> valor
+        self.histogramas = {}  # (nome, labels) -> [contagens por bucket..., +Inf, soma]
+        self.gauges = {}       # nome -> (ajuda, funcao)
+        self.diretorio = None
+        self.intervalo = 5
+        self._gravador = None
+
+    # ----- declaração -----
+
+    def contador(self, nome, ajuda):
+        self.descricoes[nome] = ("counter", ajuda)
+
+    def histograma(self, nome, ajuda):
+        self.descricoes[nome] = ("histogram", ajuda)
+
+    def registrar_gauge(self, nome, ajuda, funcao):
+        """funcao() é chamada a cada coleta e devolve o valor atual"""
+        self.gauges[nome] = (ajuda, funcao)
+
+    # ----- atualização (caminho quente) -----
+
+    def inc(self, nome, valor=1, **labels):
+        chave = (nome, _chave(labels))
+        with self.trava:
+            self.contadores[chave] = self.contadores.get(chave, 0) + valor
+        self._iniciar_gravador()
+
+    def observar(self, nome, valor, **labels):
+        chave = (nome, _chave(labels))
+        indice = bisect_left(BUCKETS, valor)
+        with self.trava:
+            dados = self.histogramas.get(chave)
+            if dados is None:
+                dados = self.histogramas[chave] = [0] * (len(BUCKETS) + 2)
+            dados[indice] += 1
+            dados[-1] += valor
+        self._iniciar_gravador()
+
+    # ----- vários workers -----
+
+    def configurar(self, diretorio=None, intervalo=5):
+        self.diretorio = diretorio
+        self.intervalo = intervalo
+        if diretorio:
+            os.makedirs(diretorio, exist_ok=True)
+
+    def _iniciar_gravador(self):
+        if not self.diretorio or self._gravador is not None:
+            return
+        with self.trava:
+            if self._gravador is not None:
+                return
+            self._gravador = threading.Thread(target=self._loop_gravador, name="metricas", daemon=True)
+        self._gravador.start()
+
+    def _loop_gravador(self):
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                self.gravar()
+            except OSError as e:
+                print(f"⚠️ Erro ao gravar métricas: {e}")
+
+    def snapshot(self):
+        with self.trava:
+            return {
+                "contadores": [[n, list(l), v] for (n, l), v in self.contadores.items()],
+                "histogramas": [[n, list(l), list(d)] for (n, l), d in self.histogramas.items()],
+            }
+
+    def gravar(self):
+        """Grava o snapshot deste processo no diretório compartilhado"""
+        if not self.diretorio:
+            return
+        destino = os.path.join(self.diretorio, f"pcp_{os.getpid()}.json")
+        temporario = destino + ".tmp"
+        with open(temporario, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temporario, destino)
+
+    def _compactar_mortos(self):
+        """Junta os arquivos de workers que já terminaram num único arquivo"""
+        if fcntl is None:
+            return
+        with open(os.path.join(self.diretorio, ".trava"), "w") as trava:
+            fcntl.flock(trava, fcntl.LOCK_EX)
+            mortos = []
+            for caminho in glob.glob(os.path.join(self.diretorio, "pcp_[0-9]*.json")):
+                pid = int(os.path.basename(caminho)[4:-5])
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    mortos.append(caminho)
+                except PermissionError:
+                    pass
+            if not mortos:
+                return
+            arquivo_mortos = os.path.join(self.diretorio, _ARQUIVO_MORTOS)
+            snapshots = [_ler(c) for c in mortos + [arquivo_mortos]]
+            contadores, histogramas = _somar(s for s in snapshots if s)
+            temporario = arquivo_mortos + ".tmp"
+            with open(temporario, "w") as f:
+                json.dump({
+                    "contadores": [[n, list(l), v] for (n, l), v in contadores.items()],
+                    "histogramas": [[n, list(l), d] for (n, l), d in histogramas.items()],
+                }, f)
+            os.replace(temporario, arquivo_mortos)
+            for caminho in mortos:
+                os.remove(caminho)
+
+    def _coletar(self):
+        if not self.diretorio:
+            return _somar([self.snapshot()])
+        self.gravar()
+        self._compactar_mortos()
+        arquivos = glob.glob(os.path.join(self.diretorio, "pcp_*.json"))
+        return _somar(s for s in map(_ler, arquivos) if s)
+
+    # ----- exposição -----
+
+    def expor(self):
+        """Texto no formato de exposição do Prometheus (todos os workers)"""
+        contadores, histogramas = self._coletar()
+        linhas = []
+
+        por_nome = {}
+        for (nome, labels), valor in contadores.items():
+            por_nome.setdefault(nome, []).append((labels, valor))
+        for (nome, labels), dados in histogramas.items():
+            por_nome.setdefault(nome, []).append((labels, dados))
+
+        for nome in sorted(por_nome):
+            tipo, ajuda = self.descricoes.get(nome, ("untyped", nome))
+            linhas.append(f"# HELP {nome} {ajuda}")
+            linhas.append(f"# TYPE {nome} {tipo}")
+            for labels, valor in sorted(por_nome[nome]):
+                if tipo != "histogram":
+                    linhas.append(f"{nome}{_formatar_labels(labels)} {_formatar_numero(valor)}")
+                    continue
+                acumulado = 0
+                for limite, quantidade in zip(BUCKETS + ("+Inf",), valor[:-1]):
+                    acumulado += quantidade
+                    le = limite if limite == "+Inf" else _formatar_numero(limite)
+                    linhas.append(f"{nome}_bucket{_formatar_labels(labels, [('le', le)])} {acumulado}")
+                linhas.append(f"{nome}_sum{_formatar_labels(labels)} {_formatar_numero(valor[-1])}")
+                linhas.append(f"{nome}_count{_formatar_labels(labels)} {acumulado}")
+
+        taxas = _taxa_acerto_caches(contadores)
+        if taxas:
+            linhas.append("# HELP pcp_cache_taxa_acerto Fração de hits de cada cache em memória")
+            linhas.append("# TYPE pcp_cache_taxa_acerto gauge")
+            for nome_cache, taxa in sorted(taxas.items()):
+                linhas.append(f"pcp_cache_taxa_acerto{_formatar_labels([('cache', nome_cache)])} {taxa:.4f}")
+
+        for nome, (ajuda, funcao) in sorted(self.gauges.items()):
+            try:
+                valor = funcao()
+            except Exception as e:
+                print(f"⚠️ Erro ao coletar {nome}: {e}")
+                continue
+            if valor is None:
+                continue
+            linhas.append(f"# HELP {nome} {ajuda}")
+            linhas.append(f"# TYPE {nome} gauge")
+            itens = valor.items() if isinstance(valor, dict) else [((), valor)]
+            for labels, v in itens:
+                linhas.append(f"{nome}{_formatar_labels(labels)} {_formatar_numero(v)}")
+
+        return "\n".join(linhas) + "\n"
+
+
+def _ler(caminho):
+    try:
+        with open(caminho) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _taxa_acerto_caches(contadores):
+    totais = {}
+    for (nome, labels), valor in contadores.items():
+        if nome != "pcp_cache_consultas_total":
+            continue
+        dados = dict(labels)
+        hit, total = totais.get(dados["cache"], (0, 0))
+        totais[dados["cache"]] = (hit + (valor if dados["resultado"] == "hit" else 0), total + valor)
+    return {c: hit / total for c, (hit, total) in totais.items() if total}
+
+
+def _somar(snapshots):
+    contadores = {}
+    histogramas = {}
+    for s in snapshots:
+        for nome, labels, valor in s.get("contadores", []):
+            chave = (nome, tuple(tuple(par) for par in labels))
+            contadores[chave] = contadores.get(chave, 0) + valor
+        for nome, labels, dados in s.get("histogramas", []):
+            chave = (nome, tuple(tuple(par) for par in labels))
+            atual = histogramas.get(chave)
+            histogramas[chave] = list(dados) if atual is None else [a + b for a, b in zip(atual, dados)]
+    return contadores, histogramas
+
+
+registro = Registro()
+
+registro.contador("pcp_http_requisicoes_total", "Requisições atendidas por rota e status")
+registro.histograma("pcp_http_requisicao_segundos", "Latência das requisições por rota")
+registro.contador("pcp_db_queries_total", "Comandos SQL executados por rota")
+registro.contador("pcp_db_segundos_total", "Tempo gasto no banco por rota")
+registro.contador("pcp_cache_consultas_total", "Consultas aos caches em memória (resultado=hit|miss)")
+
+
+def registrar_requisicao(metodo, rota, status, segundos, db_segundos, queries):
+    """Chamado pelo perfil_requisicoes ao fim de cada requisição"""
+    registro.inc("pcp_http_requisicoes_total", metodo=metodo, rota=rota, status=status)
+    registro.observar("pcp_http_requisicao_segundos", segundos, metodo=metodo, rota=rota)
+    if queries:
+        registro.inc("pcp_db_queries_total", queries, metodo=metodo, rota=rota)
+        registro.inc("pcp_db_segundos_total", db_segundos, metodo=metodo, rota=rota)
+
+
+def cache(nome, acerto):
+    """Conta um acesso ao cache `nome` (acerto=True para hit)"""
+    registro.inc("pcp_cache_consultas_total", cache=nome, resultado="hit" if acerto else "miss")
+
+
+registrar_gauge = registro.registrar_gauge
+
+
+def init_app(app):
+    """Configura o modo de vários workers a partir das variáveis de ambiente"""
+    diretorio = os.environ.get("PCP_METRICS_DIR", "").strip() or None
+    intervalo = float(os.environ.get("PCP_METRICS_INTERVALO", "5"))
+    registro.configurar(diretorio, intervalo)
+    if not os.environ.get("PCP_METRICS_TOKEN") and os.environ.get("PCP_METRICS_PUBLICO") != "1":
+        print("⚠️ /metrics desativado: defina PCP_METRICS_TOKEN (ou PCP_METRICS_PUBLICO=1)")
+
+
+def autorizar(cabecalho):
+    """Status HTTP que barra a coleta (401 / 503), ou None se pode coletar"""
+    token = os.environ.get("PCP_METRICS_TOKEN")
+    if not token:
+        return None if os.environ.get("PCP_METRICS_PUBLICO") == "1" else 503
+    if not hmac.compare_digest((cabecalho or "").encode(), f"Bearer {token}".encode()):
+        return 401
+    return None
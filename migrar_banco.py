@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Migração do banco - cria as tabelas novas e os dados padrão
+
+Pode ser executado quantas vezes quiser: só cria o que ainda não existe.
+Rodar a cada deploy antes de subir o gunicorn (no Railway / Heroku é
+executado pela fase "release" do Procfile).
+
+Uso:
+    python migrar_banco.py
+"""
+
+from sqlalchemy import inspect, text
+
+import agregado_horas
+import busca
+import contadores
+import modelos_op
+import sequencias
+import utilizacao_maquinas
+from app import app, criar_usuarios_padrao, db
+
+# Colunas novas em tabelas que já existem (create_all não altera tabelas)
+COLUNAS_NOVAS = [
+    ("op", "tarefas_total", "INTEGER NOT NULL DEFAULT 0"),
+    ("op", "tarefas_concluidas", "INTEGER NOT NULL DEFAULT 0"),
+    ("obra", "ops_total", "INTEGER NOT NULL DEFAULT 0"),
+    ("obra", "ops_concluidas", "INTEGER NOT NULL DEFAULT 0"),
+    ("modelo_op", "hash", "VARCHAR(64)"),
+    ("modelo_op", "versao", "INTEGER"),
+]
+
+# Índices em tabelas que já existem (criados depois de migrar os dados)
+INDICES_NOVOS = [
+    ("modelo_op", "ix_modelo_op_produto_versao"),
+    ("apontamento", "ix_apontamento_operador_inicio"),
+]
+
+
+def _etapa_feita(nome):
+    """Etapas de migração que rodam uma vez só ficam marcadas na tabela sequencia"""
+    return sequencias.atual(f"migracao:{nome}") is not None
+
+
+def _marcar_etapa(nome):
+    sequencias.definir(f"migracao:{nome}", 1)
+
+
+def colunas_faltando():
+    """Colunas novas que ainda não existem (tabelas que nem existem ficam para o create_all)"""
+    with app.app_context(), db.engine.connect() as conexao:
+        inspetor = inspect(conexao)
+        tabelas = set(inspetor.get_table_names())
+        faltando = []
+        for tabela, coluna, _ in COLUNAS_NOVAS:
+            if tabela in tabelas and coluna not in {c["name"] for c in inspetor.get_columns(tabela)}:
+                faltando.append(f"{tabela}.{coluna}")
+    return faltando
+
+
+def adicionar_colunas():
+    """Adiciona as colunas que faltam; devolve as que foram criadas"""
+    criadas = []
+    with db.engine.begin() as conexao:
+        inspetor = inspect(conexao)
+        for tabela, coluna, tipo in COLUNAS_NOVAS:
+            existentes = {c["name"] for c in inspetor.get_columns(tabela)}
+            if coluna not in existentes:
+                conexao.execute(text(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {tipo}"))
+                criadas.append(f"{tabela}.{coluna}")
+    return criadas
+
+
+def criar_indices():
+    criados = []
+    with db.engine.begin() as conexao:
+        inspetor = inspect(conexao)
+        for tabela, nome in INDICES_NOVOS:
+            if nome not in {i["name"] for i in inspetor.get_indexes(tabela)}:
+                indice = next(i for i in db.metadata.tables[tabela].indexes if i.name == nome)
+                indice.create(conexao)
+                criados.append(nome)
+    return criados
+
+
+def migrar():
+    with app.app_context():
+        print("⚙️ Criando tabelas que ainda não existem...")
+        db.create_all()
+        criadas = adicionar_colunas()
+        for coluna in criadas:
+            print(f"   + coluna {coluna}")
+        print("⚙️ Recalculando contadores de tarefas/OPs...")
+        contadores.recalcular(db.session)
+        db.session.commit()
+        print("⚙️ Convertendo modelos de OP para versões/blocos...")
+        convertidos, removidos = modelos_op.migrar_legado()
+        db.session.commit()
+        print(f"   {convertidos} convertidos, {removidos} duplicados removidos")
+        # Marcador explícito, não "tabela vazia": o create_all do servidor
+        # cria a tabela e o primeiro apontamento finalizado já grava nela
+        if not _etapa_feita("horas_realizadas"):
+            print("⚙️ Agregando horas realizadas por etapa/operador/dia...")
+            print(f"   {agregado_horas.reconstruir()} linhas em horas_realizadas")
+            _marcar_etapa("horas_realizadas")
+            db.session.commit()
+        if not _etapa_feita("maquina_dia"):
+            print("⚙️ Pré-agregando utilização diária das máquinas...")
+            print(f"   {utilizacao_maquinas.reconstruir()} linhas em maquina_dia")
+            _marcar_etapa("maquina_dia")
+            db.session.commit()
+        for indice in criar_indices():
+            print(f"   + índice {indice}")
+        print("⚙️ Criando índices de busca textual...")
+        for tipo in busca.instalar():
+            print(f"   + busca {tipo}")
+        criar_usuarios_padrao()
+    print("✅ Migração concluída")
+
+
+if __name__ == "__main__":
+    migrar()
@@ -0,0 +1,491 @@
+"""
+Modelos de OP - compila ModeloOP.dados num plano e instancia em massa
+
+O JSON do modelo é validado e compilado uma vez num `Plano` imutável
+(datas já convertidas, etapas com o deslocamento de início já resolvido) e
+fica em cache pelo id do modelo + hash do conteúdo. Instanciar o plano em
+uma ou várias OPs é uma transação só, sem objetos ORM por tarefa:
+
+    plano = modelos_op.compilar(modelo)
+    modelos_op.instanciar(plano, [op1, op2, ...])
+    db.session.commit()
+
+Por OP: apaga etapas/tarefas antigas, insere as etapas (INSERT em lote com
+RETURNING dos ids), insere as tarefas já com datas e números, zera a
+sequência de numeração e grava os contadores (contadores.py não vê
+inserts em massa, então o total é gravado aqui).
+
+Biblioteca versionada: cada salvamento vira uma versão (produto, versao)
+cujo `dados` guarda só os hashes das etapas; etapas e tarefas ficam uma
+vez cada na tabela `bloco_modelo`, endereçadas pelo hash do conteúdo.
+Salvar de novo um modelo igual à última versão não cria nada, e etapas
+que não mudaram entre versões são compartilhadas:
+
+    modelo, criado = modelos_op.salvar("P1", "Modelo - 12", "...", conteudo)
+    modelos_op.ultima_versao("P1")
+    modelos_op.diferencas(v1, v2)
+
+As datas previstas seguem a regra de carregar_modelo_op: CORTE, DOBRA,
+PINTURA, CALDEIRARIA e MONTAGEM começam na data de início da OP, START UP
+um dia depois; as demais etapas mantêm as datas do modelo. A data de fim é
+calculada uma vez por (início, horas) e reaproveitada entre tarefas e OPs.
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select, update
+
+import sequencias
+
+# Dias somados à data de início da OP, por etapa
+INICIO_ETAPA = {
+    "CORTE": 0,
+    "DOBRA": 0,
+    "PINTURA": 0,
+    "CALDEIRARIA": 0,
+    "MONTAGEM": 0,
+    "START UP": 1,
+}
+HORAS_POR_DIA = 9
+CACHE_MAX = 64
+
+_db = None
+_OP = _Etapa = _Tarefa = None
+_ModeloOP = _Bloco = None
+_calcular_data_fim = None
+_chave_sequencia = None
+
+_cache = OrderedDict()
+_trava_cache = threading.Lock()
+
+# hash -> conteúdo do bloco (blocos nunca mudam, então o cache nunca fica velho)
+_blocos = OrderedDict()
+_trava_blocos = threading.Lock()
+BLOCOS_MAX = 20000
+
+
+class ModeloInvalido(ValueError):
+    """O JSON do modelo não tem a estrutura esperada"""
+
+
+@dataclass(frozen=True)
+class TarefaPlano:
+    titulo: str
+    descricao: str
+    horas_previstas: float
+    responsavel_id: int
+    data_inicio_prev: date
+    data_fim_prev: date
+
+
+@dataclass(frozen=True)
+class EtapaPlano:
+    nome: str
+    deslocamento: int  # dias após o início da OP; None = datas do modelo
+    tarefas: tuple
+
+
+@dataclass(frozen=True)
+class Plano:
+    modelo_id: int
+    hash: str
+    etapas: tuple
+
+    @property
+    def total_tarefas(self):
+        return sum(len(e.tarefas) for e in self.etapas)
+
+
+# ============ COMPILAÇÃO ============
+
+def hash_dados(dados):
+    texto = json.dumps(dados, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def _data(valor, onde):
+    if not valor:
+        return None
+    try:
+        return datetime.strptime(valor, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        raise ModeloInvalido(f"{onde}: data inválida {valor!r}") from None
+
+
+def _tarefa(dados, onde):
+    if not isinstance(dados, dict):
+        raise ModeloInvalido(f"{onde}: tarefa deve ser um objeto")
+    titulo = (dados.get("titulo") or "").strip()
+    if not titulo:
+        raise ModeloInvalido(f"{onde}: tarefa sem título")
+    try:
+        horas = float(dados.get("horas_previstas") or 0.0)
+    except (TypeError, ValueError):
+        raise ModeloInvalido(f"{onde}: horas_previstas inválido") from None
+    if horas < 0:
+        raise ModeloInvalido(f"{onde}: horas_previstas negativo")
+    responsavel_id = dados.get("responsavel_id")
+    if responsavel_id is not None and not isinstance(responsavel_id, int):
+        raise ModeloInvalido(f"{onde}: responsavel_id inválido")
+    return TarefaPlano(
+        titulo=titulo[:160],
+        descricao=dados.get("descricao", ""),
+        horas_previstas=horas,
+        responsavel_id=responsavel_id,
+        data_inicio_prev=_data(dados.get("data_inicio_prev"), onde),
+        data_fim_prev=_data(dados.get("data_fim_prev"), onde),
+    )
+
+
+def compilar_dados(dados, modelo_id=None):
+    """Valida o JSON de um modelo e devolve o Plano (sem cache)"""
+    if not isinstance(dados, dict) or not isinstance(dados.get("etapas", []), list):
+        raise ModeloInvalido("dados do modelo devem ter uma lista 'etapas'")
+    etapas = []
+    for i, etapa in enumerate(dados.get("etapas", []), 1):
+        if not isinstance(etapa, dict) or not (etapa.get("nome") or "").strip():
+            raise ModeloInvalido(f"etapa {i}: sem nome")
+        nome = etapa["nome"].strip()
+        tarefas = etapa.get("tarefas") or []
+        if not isinstance(tarefas, list):
+            raise ModeloInvalido(f"etapa {nome}: 'tarefas' deve ser uma lista")
+        etapas.append(EtapaPlano(
+            nome=nome,
+            deslocamento=INICIO_ETAPA.get(nome),
+            tarefas=tuple(_tarefa(t, f"etapa {nome}, tarefa {j}") for j, t in enumerate(tarefas, 1)),
+        ))
+    return Plano(modelo_id=modelo_id, hash=hash_dados(dados), etapas=tuple(etapas))
+
+
+def compilar(modelo):
+    """Plano do ModeloOP, do cache quando o conteúdo não mudou"""
+    chave = (modelo.id, hash_dados(modelo.dados))  # dados é só a lista de hashes das etapas
+    with _trava_cache:
+        plano = _cache.get(chave)
+        if plano is not None:
+            _cache.move_to_end(chave)
+            return plano
+    plano = compilar_dados(conteudo(modelo), modelo.id)
+    with _trava_cache:
+        _cache[chave] = plano
+        while len(_cache) > CACHE_MAX:
+            _cache.popitem(last=False)
+    return plano
+
+
+def limpar_cache():
+    with _trava_cache:
+        _cache.clear()
+
+
+# ============ INSTANCIAÇÃO ============
+
+def _datas_das_tarefas(plano, data_op, memo):
+    """Lista de (inicio, fim) por tarefa, na ordem do plano"""
+    datas = []
+    for etapa in plano.etapas:
+        # Regra antiga: etapa sem tarefas ou fora de INICIO_ETAPA mantém as datas do modelo
+        if etapa.deslocamento is None:
+            datas.extend((t.data_inicio_prev, t.data_fim_prev) for t in etapa.tarefas)
+            continue
+        inicio = data_op + timedelta(days=etapa.deslocamento)
+        for tarefa in etapa.tarefas:
+            fim = tarefa.data_fim_prev
+            if tarefa.horas_previstas > 0:
+                chave = (inicio, tarefa.horas_previstas)
+                if chave not in memo:
+                    memo[chave] = _calcular_data_fim(inicio, tarefa.horas_previstas, HORAS_POR_DIA)
+                fim = memo[chave]
+            datas.append((inicio, fim))
+    return datas
+
+
+def _prefixo_numero(op):
+    return str(int(op.numero)) if op.numero and op.numero.isdigit() else (op.numero or "1")
+
+
+def instanciar(plano, ops, hoje=None):
+    """Substitui etapas e tarefas das OPs pelas do plano (sem commit)
+
+    Devolve o número de tarefas criadas. Tudo roda na transação da sessão:
+    um rollback desfaz todas as OPs.
+    """
+    ops = list(ops)
+    if not ops:
+        return 0
+    sessao = _db.session
+    etapa_t, tarefa_t = _Etapa.__table__, _Tarefa.__table__
+    op_ids = [op.id for op in ops]
+    hoje = hoje or date.today()
+
+    # Objetos pendentes das OPs iriam para o banco no meio dos comandos em massa
+    sessao.flush()
+
+    etapas_antigas = select(etapa_t.c.id).where(etapa_t.c.op_id.in_(op_ids)).scalar_subquery()
+    sessao.execute(delete(tarefa_t).where(tarefa_t.c.etapa_id.in_(etapas_antigas)))
+    sessao.execute(delete(etapa_t).where(etapa_t.c.op_id.in_(op_ids)))
+
+    total = 0
+    if plano.etapas:
+        linhas_etapas = [
+            {"op_id": op.id, "nome": etapa.nome, "percentual": 0.0, "status": "PLANEJADO"}
+            for op in ops for etapa in plano.etapas
+        ]
+        etapa_ids = sessao.execute(
+            insert(etapa_t).returning(etapa_t.c.id, sort_by_parameter_order=True), linhas_etapas
+        ).scalars().all()
+
+        memo = {}
+        linhas_tarefas = []
+        por_op = len(plano.etapas)
+        for i, op in enumerate(ops):
+            datas = iter(_datas_das_tarefas(plano, op.prev_inicio or hoje, memo))
+            prefixo = _prefixo_numero(op)
+            numero = 1
+            for etapa, etapa_id in zip(plano.etapas, etapa_ids[i * por_op:(i + 1) * por_op]):
+                for tarefa in etapa.tarefas:
+                    inicio, fim = next(datas)
+                    linhas_tarefas.append({
+                        "etapa_id": etapa_id,
+                        "numero": f"{prefixo}.{numero}",
+                        "titulo": tarefa.titulo,
+                        "descricao": tarefa.descricao,
+                        "horas_previstas": tarefa.horas_previstas,
+                        "horas_realizadas": 0.0,
+                        "responsavel_id": tarefa.responsavel_id,
+                        "data_inicio_prev": inicio,
+                        "data_fim_prev": fim,
+                        "status": "PLANEJADO",
+                        "peso_percentual": 0.0,
+                    })
+                    numero += 1
+        if linhas_tarefas:
+            sessao.execute(insert(tarefa_t), linhas_tarefas)
+        total = len(linhas_tarefas)
+
+    # As tarefas antigas foram apagadas: numeração recomeça depois do bloco
+    por_op = plano.total_tarefas
+    for op_id in op_ids:
+        sequencias.definir(_chave_sequencia(op_id), por_op)
+    sessao.execute(update(_OP.__table__).where(_OP.__table__.c.id.in_(op_ids))
+                   .values(tarefas_total=por_op, tarefas_concluidas=0))
+
+    # Relacionamentos carregados (op.etapas, etapa.tarefas) estão desatualizados
+    sessao.expire_all()
+    return total
+
+
+# ============ BIBLIOTECA (versões e blocos) ============
+
+CAMPOS_TAREFA = ("titulo", "descricao", "horas_previstas", "responsavel_id", "data_inicio_prev", "data_fim_prev")
+
+
+def _legado(dados):
+    """Modelos antigos guardam as etapas inteiras em `dados`"""
+    return any(isinstance(e, dict) for e in (dados or {}).get("etapas", []))
+
+
+def decompor(dados):
+    """Conteúdo completo -> (raiz com hashes das etapas, {hash: (tipo, bloco)})"""
+    blocos = {}
+    raiz = []
+    for etapa in dados.get("etapas", []):
+        hashes_tarefas = []
+        for tarefa in etapa.get("tarefas") or []:
+            h = hash_dados(tarefa)
+            blocos[h] = ("tarefa", tarefa)
+            hashes_tarefas.append(h)
+        bloco = {"nome": etapa.get("nome"), "tarefas": hashes_tarefas}
+        h = hash_dados(bloco)
+        blocos[h] = ("etapa", bloco)
+        raiz.append(h)
+    return {"etapas": raiz}, blocos
+
+
+def _carregar_blocos(hashes):
+    # Monta a resposta numa cópia local: outra thread pode descartar
+    # blocos do cache entre a consulta e a leitura
+    achados = {}
+    with _trava_blocos:
+        for h in set(hashes):
+            if h in _blocos:
+                _blocos.move_to_end(h)
+                achados[h] = _blocos[h]
+    faltando = [h for h in set(hashes) if h not in achados]
+    if faltando:
+        tabela = _Bloco.__table__
+        linhas = dict(_db.session.execute(
+            select(tabela.c.hash, tabela.c.dados).where(tabela.c.hash.in_(faltando))).all())
+        achados.update(linhas)
+        with _trava_blocos:
+            _blocos.update(linhas)
+            while len(_blocos) > BLOCOS_MAX:
+                _blocos.popitem(last=False)
+    try:
+        return [achados[h] for h in hashes]
+    except KeyError as e:
+        raise ModeloInvalido(f"bloco {e.args[0]} não encontrado") from None
+
+
+def conteudo(modelo):
+    """JSON completo do modelo (etapas com tarefas), montado a partir dos blocos"""
+    if _legado(modelo.dados):
+        return modelo.dados
+    etapas = _carregar_blocos(modelo.dados.get("etapas", []))
+    tarefas = iter(_carregar_blocos([h for etapa in etapas for h in etapa["tarefas"]]))
+    return {"etapas": [
+        {"nome": etapa["nome"], "tarefas": [next(tarefas) for _ in etapa["tarefas"]]}
+        for etapa in etapas
+    ]}
+
+
+def _guardar_blocos(blocos):
+    """Insere só os blocos que ainda não existem"""
+    if not blocos:
+        return
+    tabela = _Bloco.__table__
+    existentes = set(_db.session.execute(
+        select(tabela.c.hash).where(tabela.c.hash.in_(list(blocos)))
+    ).scalars())
+    novos = [{"hash": h, "tipo": tipo, "dados": bloco} for h, (tipo, bloco) in blocos.items() if h not in existentes]
+    if not novos:
+        return
+    dialeto = _db.session.get_bind(clause=tabela.insert()).dialect.name
+    if dialeto == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as insert_dialeto
+    elif dialeto == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as insert_dialeto
+    else:
+        _db.session.execute(tabela.insert(), novos)
+        return
+    # Outra requisição pode ter gravado o mesmo bloco nesse meio tempo
+    _db.session.execute(insert_dialeto(tabela).on_conflict_do_nothing(index_elements=["hash"]), novos)
+
+
+def _chave_versao(produto):
+    return "modelo_op:" + hashlib.sha1(produto.encode("utf-8")).hexdigest()[:20]
+
+
+def _ultima_versao_gravada(produto):
+    return _db.session.query(func.max(_ModeloOP.versao)).filter(_ModeloOP.produto == produto).scalar() or 0
+
+
+def ultima_versao(produto):
+    """Versão mais recente do modelo do produto (índice produto, versao)"""
+    return (_ModeloOP.query.filter(_ModeloOP.produto == produto)
+            .order_by(_ModeloOP.versao.desc()).first())
+
+
+def versoes(produto):
+    return (_ModeloOP.query.filter(_ModeloOP.produto == produto)
+            .order_by(_ModeloOP.versao.desc()).all())
+
+
+def salvar(produto, nome, descricao, dados):
+    """Grava `dados` como nova versão do produto (sem commit)
+
+    Devolve (modelo, criado). Se o conteúdo for igual ao da última versão,
+    devolve a última versão e não grava nada.
+    """
+    compilar_dados(dados)  # valida antes de gravar
+    raiz, blocos = decompor(dados)
+    h = hash_dados(raiz)
+
+    atual = ultima_versao(produto)
+    if atual is not None and atual.hash == h:
+        return atual, False
+
+    _guardar_blocos(blocos)
+    versao = sequencias.proximo(_chave_versao(produto), inicial=lambda: _ultima_versao_gravada(produto))
+    modelo = _ModeloOP(produto=produto, nome=nome, descricao=descricao, dados=raiz, hash=h, versao=versao)
+    _db.session.add(modelo)
+    return modelo, True
+
+
+def _tarefas_por_titulo(etapa):
+    return {t.get("titulo"): t for t in etapa.get("tarefas") or []}
+
+
+def diferencas(antigo, novo):
+    """O que mudou de `antigo` para `novo` (etapas e tarefas, por nome/título)
+
+    Etapas com o mesmo hash nas duas versões são puladas sem comparar tarefas.
+    """
+    def etapas(modelo):
+        dados = conteudo(modelo)
+        raiz, _ = decompor(dados)
+        return {e["nome"]: (h, e) for h, e in zip(raiz["etapas"], dados["etapas"])}
+
+    etapas_a, etapas_n = etapas(antigo), etapas(novo)
+
+    resultado = {
+        "de": {"id": antigo.id, "versao": antigo.versao},
+        "para": {"id": novo.id, "versao": novo.versao},
+        "etapas_adicionadas": [n for n in etapas_n if n not in etapas_a],
+        "etapas_removidas": [n for n in etapas_a if n not in etapas_n],
+        "etapas_alteradas": {},
+    }
+    for nome, (h_novo, etapa_n) in etapas_n.items():
+        if nome not in etapas_a or etapas_a[nome][0] == h_novo:
+            continue
+        tarefas_a, tarefas_n = _tarefas_por_titulo(etapas_a[nome][1]), _tarefas_por_titulo(etapa_n)
+        alteradas = {}
+        for titulo in tarefas_n.keys() & tarefas_a.keys():
+            campos = {
+                c: [tarefas_a[titulo].get(c), tarefas_n[titulo].get(c)]
+                for c in CAMPOS_TAREFA if tarefas_a[titulo].get(c) != tarefas_n[titulo].get(c)
+            }
+            if campos:
+                alteradas[titulo] = campos
+        resultado["etapas_alteradas"][nome] = {
+            "tarefas_adicionadas": [t for t in tarefas_n if t not in tarefas_a],
+            "tarefas_removidas": [t for t in tarefas_a if t not in tarefas_n],
+            "tarefas_alteradas": alteradas,
+        }
+    return resultado
+
+
+def migrar_legado():
+    """Converte modelos antigos para blocos e numera as versões (sem commit)
+
+    Versões com conteúdo idêntico dentro do mesmo produto viram uma só (fica
+    a mais recente). Devolve (convertidos, removidos).
+    """
+    convertidos = removidos = 0
+    produtos = [p for (p,) in _db.session.query(_ModeloOP.produto).distinct()]
+    for produto in produtos:
+        vistos = set()
+        modelos = (_ModeloOP.query.filter(_ModeloOP.produto == produto)
+                   .order_by(_ModeloOP.data_criacao.desc(), _ModeloOP.id.desc()).all())
+        manter = []
+        for modelo in modelos:
+            if _legado(modelo.dados) or not modelo.hash:
+                raiz, blocos = decompor(conteudo(modelo))
+                _guardar_blocos(blocos)
+                modelo.dados, modelo.hash = raiz, hash_dados(raiz)
+                convertidos += 1
+            if modelo.hash in vistos:
+                _db.session.delete(modelo)
+                removidos += 1
+            else:
+                vistos.add(modelo.hash)
+                manter.append(modelo)
+        if any(m.versao is None for m in manter):
+            for versao, modelo in enumerate(reversed(manter), 1):
+                modelo.versao = versao
+            sequencias.definir(_chave_versao(produto), len(manter))
+    return convertidos, removidos
+
+
+def init_app(db, op, etapa, tarefa, modelo_op, bloco, calcular_data_fim, chave_sequencia):
+    """Liga o motor aos modelos, ao cálculo de datas e ao nome da sequência de tarefas da OP"""
+    global _db, _OP, _Etapa, _Tarefa, _ModeloOP, _Bloco, _calcular_data_fim, _chave_sequencia
+    _db, _OP, _Etapa, _Tarefa = db, op, etapa, tarefa
+    _ModeloOP, _Bloco = modelo_op, bloco
+    _calcular_data_fim = calcular_data_fim
+    _chave_sequencia = chave_sequencia
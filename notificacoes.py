@@ -0,0 +1,228 @@
+"""
+Fila de notificações (outbox) - envio em segundo plano com novas tentativas
+
+As rotas e scripts só gravam a notificação na tabela notificacao_outbox com
+enfileirar(); quem envia é o despachante, uma thread em segundo plano que
+pega as notificações vencidas e manda pelo canal (ver canais.py) num
+pool de threads.
+
+    - cada notificação é "reservada" com um UPDATE atômico, então vários
+      workers do gunicorn podem rodar o despachante sem enviar em dobro
+    - falha temporária (timeout, 5xx, 429): nova tentativa com espera
+      exponencial (PCP_NOTIF_ESPERA_BASE * 2^tentativas)
+    - falha definitiva (4xx) ou tentativas esgotadas: status MORTA
+      (dead-letter), fica na tabela para análise e reenvio manual
+    - cada canal tem o seu limite de mensagens por minuto
+    - canais presos a um processo (WhatsApp Web: um Chrome por perfil) só
+      são despachados pelo processo que detém a trava do canal
+
+Para testar sem internet: rode `python sink_notificacoes.py` e defina
+PCP_NOTIF_REDIRECIONAR=http_local para mandar tudo para o sink, ou
+PCP_NOTIF_REDIRECIONAR=memoria para guardar as mensagens em memória.
+
+Variáveis de ambiente:
+    PCP_NOTIF_DESPACHANTE     1 liga / 0 desliga o despachante (padrão: 1)
+    PCP_NOTIF_INTERVALO       segundos entre buscas na fila (padrão: 2)
+    PCP_NOTIF_THREADS         envios simultâneos (padrão: 4)
+    PCP_NOTIF_TENTATIVAS      tentativas antes do dead-letter (padrão: 6)
+    PCP_NOTIF_ESPERA_BASE     segundos da primeira espera entre tentativas (padrão: 5)
+    PCP_NOTIF_REDIRECIONAR    manda todas as notificações para este canal
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import canais
+import log_estruturado
+import metricas
+
+INTERVALO = float(os.environ.get("PCP_NOTIF_INTERVALO", "2"))
+THREADS = int(os.environ.get("PCP_NOTIF_THREADS", "4"))
+MAX_TENTATIVAS = int(os.environ.get("PCP_NOTIF_TENTATIVAS", "6"))
+ESPERA_BASE = float(os.environ.get("PCP_NOTIF_ESPERA_BASE", "5"))
+ESPERA_MAXIMA = 3600
+# Tempo que uma notificação fica reservada por um despachante
+RESERVA_SEG = 120
+LOTE = 50
+
+log = log_estruturado.obter("notificacoes")
+
+metricas.registro.contador("pcp_notificacoes_total", "Notificações processadas por canal e resultado")
+
+
+# Reexportadas: quem trata erros da fila importa daqui
+FalhaTemporaria = canais.FalhaTemporaria
+FalhaDefinitiva = canais.FalhaDefinitiva
+
+
+class LimiteCanal:
+    """Intervalo mínimo entre envios de um canal (compartilhado pelas threads)"""
+
+    def __init__(self, por_min):
+        self.intervalo = 60.0 / por_min
+        self.trava = threading.Lock()
+        self.proximo = 0.0
+
+    def aguardar(self):
+        with self.trava:
+            agora = time.monotonic()
+            espera = self.proximo - agora
+            self.proximo = max(agora, self.proximo) + self.intervalo
+        if espera > 0:
+            time.sleep(espera)
+
+
+_limites = {}
+_trava_limites = threading.Lock()
+
+
+def _limite(canal):
+    with _trava_limites:
+        if canal not in _limites:
+            _limites[canal] = LimiteCanal(canais.obter(canal).por_minuto)
+        return _limites[canal]
+
+
+# ============ FILA ============
+
+_app = None
+_db = None
+_modelo = None
+
+
+def enfileirar(canal, mensagem, destino=None):
+    """Grava uma notificação na fila (o commit é de quem chamou)"""
+    canais.obter(canal)
+    notificacao = _modelo(canal=canal, destino=destino, mensagem=mensagem)
+    _db.session.add(notificacao)
+    return notificacao
+
+
+def espera_para(tentativas):
+    return min(ESPERA_BASE * (2 ** (tentativas - 1)), ESPERA_MAXIMA)
+
+
+def _reservar(notificacao_id):
+    """UPDATE atômico: só um despachante fica com a notificação"""
+    agora = datetime.now()
+    reservadas = _modelo.query.filter(
+        _modelo.id == notificacao_id,
+        _modelo.status.in_(["PENDENTE", "ENVIANDO"]),
+        _modelo.proxima_tentativa <= agora,
+    ).update(
+        {"status": "ENVIANDO", "proxima_tentativa": agora + timedelta(seconds=RESERVA_SEG)},
+        synchronize_session=False,
+    )
+    _db.session.commit()
+    return reservadas == 1
+
+
+def _processar(notificacao_id):
+    """Envia uma notificação e grava o resultado"""
+    with _app.app_context():
+        if not _reservar(notificacao_id):
+            return
+        notificacao = _modelo.query.get(notificacao_id)
+        canal = os.environ.get("PCP_NOTIF_REDIRECIONAR") or notificacao.canal
+        notificacao.tentativas = (notificacao.tentativas or 0) + 1
+
+        try:
+            _limite(canal).aguardar()
+            canais.obter(canal).enviar(notificacao.mensagem, notificacao.destino)
+        except FalhaDefinitiva as e:
+            _finalizar_com_erro(notificacao, canal, str(e), definitiva=True)
+        except Exception as e:
+            _finalizar_com_erro(notificacao, canal, str(e), definitiva=False)
+        else:
+            notificacao.status = "ENVIADA"
+            notificacao.enviado_em = datetime.now()
+            notificacao.ultimo_erro = None
+            metricas.registro.inc("pcp_notificacoes_total", canal=canal, resultado="enviada")
+        _db.session.commit()
+
+
+def _finalizar_com_erro(notificacao, canal, erro, definitiva):
+    notificacao.ultimo_erro = erro[:500]
+    if definitiva or notificacao.tentativas >= MAX_TENTATIVAS:
+        notificacao.status = "MORTA"
+        metricas.registro.inc("pcp_notificacoes_total", canal=canal, resultado="morta")
+        log.error("Notificação descartada", extra={"notificacao_id": notificacao.id, "canal": canal,
+                                                    "tentativas": notificacao.tentativas, "erro": erro[:200]})
+        return
+    espera = espera_para(notificacao.tentativas)
+    notificacao.status = "PENDENTE"
+    notificacao.proxima_tentativa = datetime.now() + timedelta(seconds=espera)
+    metricas.registro.inc("pcp_notificacoes_total", canal=canal, resultado="nova_tentativa")
+    log.warning("Falha ao enviar notificação", extra={"notificacao_id": notificacao.id, "canal": canal,
+                                                       "tentativas": notificacao.tentativas,
+                                                       "espera_seg": espera, "erro": erro[:200]})
+
+
+def _vencidas():
+    fora = canais.indisponiveis()
+    if os.environ.get("PCP_NOTIF_REDIRECIONAR") in fora:
+        return []
+    with _app.app_context():
+        consulta = _modelo.query.filter(
+            _modelo.status.in_(["PENDENTE", "ENVIANDO"]),
+            _modelo.proxima_tentativa <= datetime.now(),
+        )
+        if fora:
+            consulta = consulta.filter(_modelo.canal.notin_(fora))
+        ids = [n.id for n in consulta.order_by(_modelo.proxima_tentativa).limit(LOTE)]
+        return ids
+
+
+def processar_fila():
+    """Uma passada síncrona pela fila (scripts e linha de comando)"""
+    ids = _vencidas()
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        list(pool.map(_processar, ids))
+    return len(ids)
+
+
+# ============ DESPACHANTE ============
+
+_despachante = None
+
+
+def _loop_despachante():
+    pool = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix="notificacoes")
+    while True:
+        try:
+            ids = _vencidas()
+            if ids:
+                list(pool.map(_processar, ids))
+                continue
+        except Exception:
+            log.exception("Erro no despachante de notificações")
+        time.sleep(INTERVALO)
+
+
+def iniciar_despachante():
+    """Sobe a thread do despachante neste processo (uma vez)"""
+    global _despachante
+    if _despachante is not None or os.environ.get("PCP_NOTIF_DESPACHANTE", "1") == "0":
+        return
+    _despachante = threading.Thread(target=_loop_despachante, name="despachante-notificacoes", daemon=True)
+    _despachante.start()
+    log.info("Despachante de notificações iniciado", extra={"threads": THREADS})
+
+
+def _profundidade_fila():
+    return _modelo.query.filter(_modelo.status.in_(["PENDENTE", "ENVIANDO"])).count()
+
+
+def _mortas():
+    return _modelo.query.filter_by(status="MORTA").count()
+
+
+def init_app(app, db, modelo):
+    """Liga a fila ao app e ao modelo NotificacaoOutbox"""
+    global _app, _db, _modelo
+    _app, _db, _modelo = app, db, modelo
+    metricas.registrar_gauge("pcp_notificacoes_fila", "Notificações aguardando envio", _profundidade_fila)
+    metricas.registrar_gauge("pcp_notificacoes_mortas", "Notificações no dead-letter", _mortas)
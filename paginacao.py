@@ -0,0 +1,145 @@
+"""
+Paginação por chave (keyset) para as listagens
+
+Em vez de OFFSET (que lê e descarta todas as linhas anteriores), cada página
+continua a partir da última linha da anterior: WHERE (coluna, id) > (v, id)
+ORDER BY coluna, id LIMIT n. O custo de uma página não depende de quantas
+vieram antes, e linhas inseridas no meio não fazem itens pularem ou
+repetirem. O cursor vai na URL (?apos=... / ?antes=...), junto com os
+filtros, então qualquer página pode ir para os favoritos.
+
+    pagina = paginacao.paginar(query, OP.prev_fim, OP.id, "desc",
+                               apos=request.args.get("apos"), antes=request.args.get("antes"))
+    pagina.itens, pagina.proximo, pagina.anterior, pagina.total, pagina.total_exato
+
+Valores nulos da coluna de ordenação ficam sempre no fim (nos dois
+sentidos), qualquer que seja o banco.
+
+O total é uma contagem limitada a TETO_CONTAGEM linhas: acima disso a
+página mostra "mais de N" em vez de contar o histórico inteiro.
+"""
+
+import base64
+import json
+from dataclasses import dataclass
+from datetime import date, datetime
+
+from sqlalchemy import and_, func, or_, select
+
+POR_PAGINA = 50
+POR_PAGINA_MAX = 200
+TETO_CONTAGEM = 1000
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+@dataclass
+class Pagina:
+    itens: list
+    proximo: str = None  # cursor para ?apos=
+    anterior: str = None  # cursor para ?antes=
+    total: int = 0
+    total_exato: bool = True
+
+
+def _codificar(valor, id_):
+    if isinstance(valor, (date, datetime)):
+        valor = valor.isoformat()
+    bruto = json.dumps([valor, id_], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(bruto).decode().rstrip("=")
+
+
+def _decodificar(cursor, coluna):
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        valor, id_ = json.loads(bruto)
+        if valor is not None:
+            tipo = coluna.type.python_type
+            if tipo is datetime:
+                valor = datetime.fromisoformat(valor)
+            elif tipo is date:
+                valor = date.fromisoformat(valor)
+            else:
+                valor = tipo(valor)
+        return valor, int(id_)
+    except (ValueError, TypeError, NotImplementedError):
+        raise CursorInvalido(f"cursor inválido: {cursor!r}") from None
+
+
+def _depois(coluna, id_col, valor, id_, descendente, anulavel):
+    """Condição "vem depois de (valor, id)" na ordem (nulos por último)"""
+    maior = (lambda a, b: a < b) if descendente else (lambda a, b: a > b)
+    if coluna is id_col:
+        return maior(id_col, id_)
+    if valor is None:
+        return and_(coluna.is_(None), maior(id_col, id_))
+    condicao = or_(maior(coluna, valor), and_(coluna == valor, maior(id_col, id_)))
+    return or_(coluna.is_(None), condicao) if anulavel else condicao
+
+
+def _ordem(coluna, id_col, descendente, anulavel, reverso=False):
+    """ORDER BY (coluna, id) com nulos por último; `reverso` inverte tudo (para voltar)"""
+    descendente = descendente != reverso
+    direcao = (lambda c: c.desc()) if descendente else (lambda c: c.asc())
+    ordem = []
+    if anulavel:
+        ordem.append(coluna.is_(None).desc() if reverso else coluna.is_(None).asc())
+    if coluna is not id_col:
+        ordem.append(direcao(coluna))
+    ordem.append(direcao(id_col))
+    return ordem
+
+
+def contar(query, id_col, teto=TETO_CONTAGEM):
+    """(total, exato): conta no máximo `teto` + 1 linhas da consulta"""
+    limitada = query.order_by(None).with_entities(id_col).limit(teto + 1).subquery()
+    total = query.session.execute(select(func.count()).select_from(limitada)).scalar()
+    return (total, True) if total <= teto else (teto, False)
+
+
+def por_pagina(valor):
+    try:
+        valor = int(valor)
+    except (TypeError, ValueError):
+        return POR_PAGINA
+    return max(1, min(valor, POR_PAGINA_MAX))
+
+
+def paginar(query, coluna, id_col, ordem="desc", apos=None, antes=None, limite=POR_PAGINA,
+            teto=TETO_CONTAGEM, valor=None):
+    """Uma página de `query` ordenada por (coluna, id_col); levanta CursorInvalido
+
+    `valor(item)` lê a coluna de ordenação de um item quando ela é de outra
+    tabela (ex.: OP ordenada por data da obra).
+    """
+    descendente = ordem != "asc"
+    anulavel = coluna is not id_col and getattr(coluna.expression, "nullable", True)
+    total, exato = contar(query, id_col, teto)
+
+    cursor = antes or apos
+    voltando = bool(antes)
+    if cursor:
+        referencia, id_ = _decodificar(cursor, coluna)
+        depois = _depois(coluna, id_col, referencia, id_, descendente, anulavel)
+        # Voltando: o que vem antes do cursor, buscado na ordem inversa
+        query = query.filter(and_(~depois, id_col != id_) if voltando else depois)
+
+    ordem_sql = _ordem(coluna, id_col, descendente, anulavel, reverso=voltando)
+    linhas = query.order_by(*ordem_sql).limit(limite + 1).all()
+    sobrou = len(linhas) > limite
+    linhas = linhas[:limite]
+    if voltando:
+        linhas.reverse()
+
+    def chave(item):
+        return _codificar(valor(item) if valor else getattr(item, coluna.key), getattr(item, id_col.key))
+
+    pagina = Pagina(itens=linhas, total=total, total_exato=exato)
+    if linhas:
+        tem_depois = voltando or sobrou
+        tem_antes = sobrou if voltando else bool(cursor)
+        pagina.proximo = chave(linhas[-1]) if tem_depois else None
+        pagina.anterior = chave(linhas[0]) if tem_antes else None
+    return pagina
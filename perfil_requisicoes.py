@@ -0,0 +1,193 @@
+"""
+Perfil de requisições - conta comandos SQL e tempo de banco por requisição
+
+Para cada requisição registra:
+    - quantidade de comandos SQL e tempo total no banco
+    - os comandos mais lentos
+    - padrões N+1 (o mesmo formato de comando repetido várias vezes)
+
+Os números saem no header Server-Timing / X-PCP-Queries, num registro do
+logger pcp.perf (log_estruturado.py), ficam acumulados por rota para a
+página /admin/perf e alimentam as métricas do /metrics (metricas.py).
+
+Variáveis de ambiente:
+    PCP_PERF               1 liga / 0 desliga (padrão: 1)
+    PCP_PERF_LENTA_MS      comandos acima deste tempo são logados (padrão: 200)
+    PCP_PERF_N1_MIN        repetições para considerar N+1 (padrão: 5)
+    PCP_PERF_AMOSTRAS      amostras guardadas por rota (padrão: 500)
+"""
+
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import log_estruturado
+import metricas
+
+ATIVO = os.environ.get("PCP_PERF", "1") != "0"
+LENTA_MS = float(os.environ.get("PCP_PERF_LENTA_MS", "200"))
+N1_MIN = int(os.environ.get("PCP_PERF_N1_MIN", "5"))
+AMOSTRAS = int(os.environ.get("PCP_PERF_AMOSTRAS", "500"))
+
+_RE_ESPACOS = re.compile(r"\s+")
+_RE_NUMEROS = re.compile(r"\b\d+\b")
+_RE_LISTA = re.compile(r"\((?:\s*(?:\?|%\(\w+\)s|N)\s*,)+\s*(?:\?|%\(\w+\)s|N)\s*\)")
+
+
+def formato_comando(statement):
+    """Normaliza o SQL para agrupar comandos iguais com parâmetros diferentes"""
+    sql = _RE_ESPACOS.sub(" ", statement).strip()
+    sql = _RE_NUMEROS.sub("N", sql)
+    return _RE_LISTA.sub("(...)", sql)
+
+
+class EstatisticasRotas:
+    """Amostras recentes por rota (apenas deste processo)"""
+
+    def __init__(self, maximo=AMOSTRAS):
+        self.maximo = maximo
+        self.trava = threading.Lock()
+        self.rotas = defaultdict(lambda: {
+            "total_ms": deque(maxlen=self.maximo),
+            "db_ms": deque(maxlen=self.maximo),
+            "queries": deque(maxlen=self.maximo),
+            "requisicoes": 0,
+            "n1": Counter(),
+        })
+
+    def registrar(self, rota, total_ms, db_ms, queries, padroes_n1):
+        with self.trava:
+            dados = self.rotas[rota]
+            dados["total_ms"].append(total_ms)
+            dados["db_ms"].append(db_ms)
+            dados["queries"].append(queries)
+            dados["requisicoes"] += 1
+            for formato, _ in padroes_n1:
+                dados["n1"][formato] += 1
+
+    def resumo(self):
+        """Percentis por rota, ordenado pela rota mais lenta (p95)"""
+        with self.trava:
+            copia = {
+                rota: (list(d["total_ms"]), list(d["db_ms"]), list(d["queries"]),
+                       d["requisicoes"], d["n1"].most_common(3))
+                for rota, d in self.rotas.items()
+            }
+
+        linhas = []
+        for rota, (total_ms, db_ms, queries, requisicoes, n1) in copia.items():
+            linhas.append({
+                "rota": rota,
+                "requisicoes": requisicoes,
+                "p50_ms": percentil(total_ms, 50),
+                "p95_ms": percentil(total_ms, 95),
+                "p99_ms": percentil(total_ms, 99),
+                "db_p95_ms": percentil(db_ms, 95),
+                "queries_media": round(sum(queries) / len(queries), 1) if queries else 0,
+                "queries_max": max(queries) if queries else 0,
+                "n1": n1,
+            })
+        linhas.sort(key=lambda l: l["p95_ms"], reverse=True)
+        return linhas
+
+    def limpar(self):
+        with self.trava:
+            self.rotas.clear()
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = min(int(round(p / 100.0 * (len(ordenados) - 1))), len(ordenados) - 1)
+    return round(ordenados[indice], 1)
+
+
+estatisticas = EstatisticasRotas()
+log = log_estruturado.obter("perf")
+
+
+# ============ EVENTOS DO SQLALCHEMY ============
+
+def _antes_execucao(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "_perf_inicio" in g:
+        conn.info.setdefault("_perf_t0", []).append(time.perf_counter())
+
+
+def _depois_execucao(conn, cursor, statement, parameters, context, executemany):
+    if not (has_request_context() and "_perf_inicio" in g):
+        return
+    pilha = conn.info.get("_perf_t0")
+    if not pilha:
+        return
+    duracao_ms = (time.perf_counter() - pilha.pop()) * 1000
+    g._perf_comandos.append((statement, duracao_ms))
+
+
+# ============ HOOKS DO FLASK ============
+
+def _inicio_requisicao():
+    g._perf_inicio = time.perf_counter()
+    g._perf_comandos = []
+
+
+def analisar_comandos(comandos):
+    """Retorna (total_db_ms, mais_lentos, padroes_n1) de uma lista (sql, ms)"""
+    total_db_ms = sum(ms for _, ms in comandos)
+    mais_lentos = sorted(comandos, key=lambda c: c[1], reverse=True)[:3]
+    formatos = Counter(formato_comando(sql) for sql, _ in comandos)
+    padroes_n1 = [(f, n) for f, n in formatos.most_common() if n >= N1_MIN]
+    return total_db_ms, mais_lentos, padroes_n1
+
+
+def _fim_requisicao(response):
+    if "_perf_inicio" not in g or request.endpoint in (None, "static"):
+        return response
+
+    total_ms = (time.perf_counter() - g._perf_inicio) * 1000
+    comandos = g._perf_comandos
+    total_db_ms, mais_lentos, padroes_n1 = analisar_comandos(comandos)
+    rota = request.url_rule.rule if request.url_rule else request.endpoint
+
+    estatisticas.registrar(f"{request.method} {rota}", total_ms, total_db_ms, len(comandos), padroes_n1)
+    metricas.registrar_requisicao(request.method, rota, response.status_code,
+                                  total_ms / 1000, total_db_ms / 1000, len(comandos))
+
+    response.headers["X-PCP-Queries"] = str(len(comandos))
+    response.headers["Server-Timing"] = (
+        f'db;dur={total_db_ms:.1f};desc="{len(comandos)} queries", app;dur={total_ms:.1f}'
+    )
+
+    registro = {
+        "metodo": request.method,
+        "rota": rota,
+        "status": response.status_code,
+        "total_ms": round(total_ms, 1),
+        "db_ms": round(total_db_ms, 1),
+        "queries": len(comandos),
+    }
+    if padroes_n1:
+        registro["n1"] = [{"sql": f[:200], "vezes": n} for f, n in padroes_n1[:3]]
+    lentos = [(sql, ms) for sql, ms in mais_lentos if ms >= LENTA_MS]
+    if lentos:
+        registro["lentos"] = [{"sql": _RE_ESPACOS.sub(" ", sql)[:200], "ms": round(ms, 1)} for sql, ms in lentos]
+    log.info("Requisição", extra=registro)
+
+    return response
+
+
+def init_app(app):
+    """Liga o perfil de requisições no app Flask"""
+    if not ATIVO:
+        return
+    if not event.contains(Engine, "before_cursor_execute", _antes_execucao):
+        event.listen(Engine, "before_cursor_execute", _antes_execucao)
+        event.listen(Engine, "after_cursor_execute", _depois_execucao)
+    app.before_request(_inicio_requisicao)
+    app.after_request(_fim_requisicao)
@@ -0,0 +1,138 @@
+"""
+Permissões - perfil de acesso dos usuários com cache em memória
+
+O perfil de acesso (tipo, ações permitidas e etapas liberadas) é montado a
+partir do banco uma vez e guardado num cache do processo por alguns
+segundos. Dentro de uma requisição ele fica em `g`, então as verificações
+seguintes não consultam o banco.
+
+Qualquer alteração de Usuario ou UsuarioEtapa invalida o perfil no commit.
+Em outros workers do gunicorn a alteração vale quando o TTL expira.
+
+Variáveis de ambiente:
+    PCP_PERMISSOES_TTL    segundos que um perfil fica no cache (padrão: 30)
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+import metricas
+
+# Ações de cada tipo de usuário
+PERMISSOES_POR_TIPO = {
+    "ADMIN": frozenset({"criar_obra", "editar_obra", "deletar_obra", "criar_op", "editar_op", "deletar_op",
+                        "criar_tarefa", "editar_tarefa", "deletar_tarefa", "visualizar", "administrar"}),
+    "GERENTE": frozenset({"criar_op", "editar_op", "criar_tarefa", "editar_tarefa", "visualizar"}),
+    "OPERADOR": frozenset({"editar_tarefa", "visualizar"}),
+    "ESPECIALISTA": frozenset({"criar_tarefa", "editar_tarefa", "deletar_tarefa", "visualizar"}),
+    "VISUALIZADOR": frozenset({"visualizar"}),
+}
+
+# Etapas liberadas para os especialistas criados por criar_usuarios_padrao()
+ETAPAS_ESPECIALISTAS_PADRAO = {
+    "estrutura@nexon.com": ["CORTE", "DOBRA", "PINTURA"],
+    "caldeiraria@nexon.com": ["CALDEIRARIA"],
+    "montagem@nexon.com": ["MONTAGEM"],
+    "startup@nexon.com": ["START UP"],
+}
+
+TTL = float(os.environ.get("PCP_PERMISSOES_TTL", "30"))
+
+
+@dataclass(frozen=True)
+class PerfilAcesso:
+    """Dados do usuário necessários para autorizar uma requisição"""
+    id: int
+    nome: str
+    email: str
+    tipo: str
+    ativo: bool
+    acoes: frozenset
+    etapas: frozenset
+
+    def tem_permissao(self, acao, etapa_nome=None):
+        """Mesma regra de Usuario.tem_permissao"""
+        if acao not in self.acoes:
+            return False
+        if self.tipo == "ESPECIALISTA" and etapa_nome:
+            return etapa_nome in self.etapas
+        return True
+
+
+def montar_perfil(usuario, etapas):
+    return PerfilAcesso(
+        id=usuario.id,
+        nome=usuario.nome,
+        email=usuario.email,
+        tipo=usuario.tipo,
+        ativo=bool(usuario.ativo),
+        acoes=PERMISSOES_POR_TIPO.get(usuario.tipo, frozenset()),
+        etapas=frozenset(etapas),
+    )
+
+
+class CachePerfis:
+    """usuario_id -> (expira_em, PerfilAcesso ou None)"""
+
+    def __init__(self, ttl=TTL):
+        self.ttl = ttl
+        self.trava = threading.Lock()
+        self.itens = {}
+
+    def obter(self, usuario_id, carregar):
+        agora = time.monotonic()
+        with self.trava:
+            item = self.itens.get(usuario_id)
+        if item and item[0] > agora:
+            metricas.cache("permissoes", True)
+            return item[1]
+
+        metricas.cache("permissoes", False)
+        perfil = carregar(usuario_id)
+        with self.trava:
+            self.itens[usuario_id] = (agora + self.ttl, perfil)
+        return perfil
+
+    def invalidar(self, usuario_id=None):
+        with self.trava:
+            if usuario_id is None:
+                self.itens.clear()
+            else:
+                self.itens.pop(usuario_id, None)
+
+
+cache = CachePerfis()
+
+
+# ============ INVALIDAÇÃO ============
+
+def _marcar_alterado(alvo, usuario_id):
+    sessao = object_session(alvo)
+    if sessao is not None:
+        sessao.info.setdefault("perfis_alterados", set()).add(usuario_id)
+
+
+def observar_modelo(modelo, usuario_id_de):
+    """Invalida o perfil quando uma linha de `modelo` muda (no commit)"""
+    def _alterado(mapper, connection, alvo):
+        _marcar_alterado(alvo, usuario_id_de(alvo))
+
+    for nome_evento in ("after_insert", "after_update", "after_delete"):
+        event.listen(modelo, nome_evento, _alterado)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidar_no_commit(sessao):
+    for usuario_id in sessao.info.pop("perfis_alterados", ()):
+        cache.invalidar(usuario_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_no_rollback(sessao):
+    sessao.info.pop("perfis_alterados", None)
@@ -0,0 +1,119 @@
+"""
+Resumo de tarefas atrasadas - agrupa, divide e evita mensagens repetidas
+
+Em vez de uma mensagem por tarefa atrasada a cada verificação, monta um
+resumo por obra (tarefas agrupadas por OP/etapa, com o responsável) e só
+envia quando o conteúdo do grupo muda. A "impressão digital" do grupo
+considera as tarefas, status, prazos e responsáveis, mas não os dias de
+atraso, que mudam todo dia sem que nada novo tenha acontecido.
+
+Mensagens maiores que o limite do Telegram são divididas em partes,
+sempre quebrando entre linhas. Uma linha sozinha maior que o limite perde
+a formatação e é cortada no texto, nunca no meio de uma tag ou entidade
+HTML (o Telegram recusa HTML desbalanceado).
+
+Variáveis de ambiente:
+    PCP_ATRASOS_LEMBRETE_HORAS   reenvia um resumo sem mudanças depois deste
+                                 tempo (padrão: 0 = só quando muda)
+"""
+
+import hashlib
+import os
+import re
+from collections import defaultdict
+from html import escape, unescape
+
+# Limite do Telegram é 4096; sobra espaço para o cabeçalho "(parte x/y)"
+LIMITE_MENSAGEM = 4000
+
+LEMBRETE_HORAS = float(os.environ.get("PCP_ATRASOS_LEMBRETE_HORAS", "0"))
+
+
+def chave_grupo(tarefa):
+    obra = tarefa.etapa.op.obra if tarefa.etapa and tarefa.etapa.op else None
+    return f"atrasos:obra:{obra.id if obra else 0}"
+
+
+def agrupar(tarefas):
+    """chave do grupo -> lista de tarefas (tarefas com etapa/op/obra carregados)"""
+    grupos = defaultdict(list)
+    for tarefa in tarefas:
+        grupos[chave_grupo(tarefa)].append(tarefa)
+    return grupos
+
+
+def impressao_digital(tarefas):
+    """Hash do que importa no grupo (sem os dias de atraso)"""
+    itens = sorted(
+        (t.id, t.status or "", str(t.data_fim_prev), t.responsavel_id or 0, t.titulo or "")
+        for t in tarefas
+    )
+    return hashlib.sha256(repr(itens).encode()).hexdigest()
+
+
+def titulo_grupo(tarefas):
+    primeira = tarefas[0]
+    obra = primeira.etapa.op.obra if primeira.etapa and primeira.etapa.op else None
+    if not obra:
+        return "Sem obra"
+    return f"{obra.codigo or ''} {obra.nome or ''}".strip() or f"Obra {obra.id}"
+
+
+def _linhas_grupo(tarefas, hoje):
+    linhas = [f"⚠️ <b>TAREFAS ATRASADAS</b> - 🏗️ <b>{escape(titulo_grupo(tarefas))}</b>",
+              f"{len(tarefas)} tarefa(s) atrasada(s)", ""]
+
+    por_etapa = defaultdict(list)
+    for t in tarefas:
+        op_numero = t.etapa.op.numero if t.etapa and t.etapa.op else "N/A"
+        etapa_nome = t.etapa.nome if t.etapa else "N/A"
+        por_etapa[(op_numero, etapa_nome)].append(t)
+
+    for (op_numero, etapa_nome), lista in sorted(por_etapa.items()):
+        linhas.append(f"🔧 <b>OP {escape(op_numero)}</b> · {escape(etapa_nome)}")
+        for t in sorted(lista, key=lambda t: t.data_fim_prev):
+            dias = (hoje - t.data_fim_prev).days
+            responsavel = escape(t.responsavel.nome) if t.responsavel else "Não atribuído"
+            linhas.append(f"  • {escape(t.titulo)} — 👤 {responsavel} — ⏰ {dias} dia(s)")
+        linhas.append("")
+    return linhas
+
+
+def _encurtar(linha, limite):
+    """Linha sem tags, cortada no texto e escapada de novo, com até `limite` caracteres"""
+    texto = unescape(re.sub(r"<[^>]*>", "", linha))
+    pedacos, tamanho = [], 0
+    for caractere in texto:
+        escapado = escape(caractere)
+        if tamanho + len(escapado) > limite - 1:
+            break
+        pedacos.append(escapado)
+        tamanho += len(escapado)
+    return "".join(pedacos) + "…"
+
+
+def dividir(linhas, limite=LIMITE_MENSAGEM):
+    """Junta as linhas em mensagens de até `limite` caracteres"""
+    partes = []
+    atual = ""
+    for linha in linhas:
+        if len(linha) > limite:
+            linha = _encurtar(linha, limite)
+        if atual and len(atual) + len(linha) + 1 > limite:
+            partes.append(atual.rstrip())
+            atual = ""
+        atual += linha + "\n"
+    if atual.strip():
+        partes.append(atual.rstrip())
+
+    if len(partes) > 1:
+        partes = [f"{p}\n\n<i>(parte {i}/{len(partes)})</i>" for i, p in enumerate(partes, 1)]
+    return partes
+
+
+def mensagens_grupo(tarefas, hoje):
+    return dividir(_linhas_grupo(tarefas, hoje))
+
+
+def mensagem_resolvido(titulo):
+    return f"✅ <b>Sem tarefas atrasadas</b> - 🏗️ {escape(titulo)}"
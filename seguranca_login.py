@@ -0,0 +1,146 @@
+"""
+Segurança do login - verificação de senha em pool limitado e limite de tentativas
+
+Verificar um hash de senha gasta CPU de propósito. Na troca de turno dezenas
+de operadores entram ao mesmo tempo e, sem limite, todas as threads do
+worker ficam calculando hash. Aqui as verificações rodam num pool pequeno
+de threads com fila limitada: se a fila encher, o login responde "servidor
+ocupado" na hora em vez de travar as outras telas.
+
+O custo do hash é configurável. Senhas gravadas com um custo diferente do
+atual são recalculadas no próximo login que der certo (rehash transparente).
+
+Tentativas de login passam por um token bucket por IP e por email, guardado
+em memória no próprio worker.
+
+Variáveis de ambiente:
+    PCP_SENHA_ITERACOES      iterações do pbkdf2:sha256 (padrão: 600000)
+    PCP_LOGIN_THREADS        verificações de senha simultâneas por worker (padrão: 2)
+    PCP_LOGIN_FILA           logins na fila ou verificando por worker (padrão:
+                             PCP_LOGIN_THREADS + 1, sempre abaixo das threads
+                             de requisição do worker)
+    PCP_LOGIN_IP_RAJADA      tentativas seguidas por IP (padrão: 60)
+    PCP_LOGIN_IP_POR_MIN     tentativas repostas por minuto por IP (padrão: 30)
+    PCP_LOGIN_EMAIL_RAJADA   tentativas seguidas por email (padrão: 5)
+    PCP_LOGIN_EMAIL_POR_MIN  tentativas repostas por minuto por email (padrão: 5)
+    PCP_LOGIN_PROXY          1 = usar o IP do X-Forwarded-For (atrás de proxy)
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import request
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from config_banco import concorrencia_por_worker, perfil_atual
+
+ITERACOES = int(os.environ.get("PCP_SENHA_ITERACOES", "600000"))
+THREADS = int(os.environ.get("PCP_LOGIN_THREADS", "2"))
+# Logins esperando o hash ocupam uma thread de requisição cada: sempre sobra
+# pelo menos uma para as outras telas
+FILA = max(min(int(os.environ.get("PCP_LOGIN_FILA", THREADS + 1)),
+               concorrencia_por_worker(perfil_atual()) - 1), 1)
+ESPERA_SEG = 10
+
+
+class Sobrecarga(Exception):
+    """Fila de verificação de senhas cheia"""
+
+
+def metodo_hash():
+    return f"pbkdf2:sha256:{ITERACOES}"
+
+
+def gerar_hash(senha):
+    return generate_password_hash(senha, method=metodo_hash())
+
+
+def precisa_rehash(senha_hash):
+    return senha_hash.split("$", 1)[0] != metodo_hash()
+
+
+# ============ POOL DE VERIFICAÇÃO ============
+
+_pool = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix="login")
+_vagas = threading.BoundedSemaphore(FILA)
+
+
+def _verificar(senha_hash, senha):
+    if not check_password_hash(senha_hash, senha):
+        return False, None
+    return True, gerar_hash(senha) if precisa_rehash(senha_hash) else None
+
+
+def verificar_senha(senha_hash, senha):
+    """Confere a senha no pool; devolve (ok, novo_hash ou None)
+
+    novo_hash vem preenchido quando a senha está certa mas foi gravada com
+    outro custo: quem chamou deve salvar o hash novo.
+    """
+    if not _vagas.acquire(blocking=False):
+        raise Sobrecarga("Muitos logins ao mesmo tempo")
+    try:
+        futuro = _pool.submit(_verificar, senha_hash, senha)
+    except BaseException:
+        _vagas.release()
+        raise
+    # A vaga só volta quando o hash termina: quem desistiu por timeout não
+    # deixa a fila real do pool crescer além de FILA
+    futuro.add_done_callback(lambda _: _vagas.release())
+    return futuro.result(timeout=ESPERA_SEG)
+
+
+# ============ LIMITE DE TENTATIVAS ============
+
+class TokenBucket:
+    """Baldes por chave: `rajada` fichas, repostas a `por_min` por minuto"""
+
+    MAX_CHAVES = 10000
+
+    def __init__(self, rajada, por_min):
+        self.rajada = float(rajada)
+        self.por_seg = por_min / 60.0
+        self.trava = threading.Lock()
+        self.baldes = {}  # chave -> (fichas, atualizado_em)
+
+    def consumir(self, chave):
+        """Gasta uma ficha; devolve 0 ou os segundos até haver uma ficha"""
+        agora = time.monotonic()
+        with self.trava:
+            fichas, atualizado = self.baldes.get(chave, (self.rajada, agora))
+            fichas = min(self.rajada, fichas + (agora - atualizado) * self.por_seg)
+            if fichas < 1:
+                self.baldes[chave] = (fichas, agora)
+                return int((1 - fichas) / self.por_seg) + 1 if self.por_seg else 60
+            self.baldes[chave] = (fichas - 1, agora)
+            if len(self.baldes) > self.MAX_CHAVES:
+                self._limpar(agora)
+            return 0
+
+    def _limpar(self, agora):
+        # Baldes que já estariam cheios de novo não precisam ficar guardados
+        cheios = [c for c, (f, t) in self.baldes.items() if f + (agora - t) * self.por_seg >= self.rajada]
+        for chave in cheios:
+            del self.baldes[chave]
+
+
+_por_ip = TokenBucket(int(os.environ.get("PCP_LOGIN_IP_RAJADA", "60")),
+                      float(os.environ.get("PCP_LOGIN_IP_POR_MIN", "30")))
+_por_email = TokenBucket(int(os.environ.get("PCP_LOGIN_EMAIL_RAJADA", "5")),
+                         float(os.environ.get("PCP_LOGIN_EMAIL_POR_MIN", "5")))
+
+
+def ip_cliente():
+    if os.environ.get("PCP_LOGIN_PROXY") == "1" and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr or "-"
+
+
+def limitar_tentativa(email):
+    """0 se a tentativa pode seguir, senão os segundos de espera"""
+    espera = _por_ip.consumir(ip_cliente())
+    if espera:
+        return espera
+    return _por_email.consumir(email.lower())
@@ -0,0 +1,92 @@
+"""
+Sequências - numeração de OPs e tarefas sem duplicar sob concorrência
+
+Cada sequência é uma linha da tabela `sequencia` (nome, valor). Pegar o
+próximo número é um único UPDATE atômico:
+
+    UPDATE sequencia SET valor = valor + :n WHERE nome = :nome RETURNING valor
+
+que trava a linha até o fim da transação (PostgreSQL) ou roda dentro da
+fila de escrita (SQLite), então duas requisições nunca recebem o mesmo
+número, e um rollback devolve os números sem deixar buracos.
+
+Na primeira vez que uma sequência é usada ela é criada com
+INSERT ... ON CONFLICT DO NOTHING, começando do maior número que já existe
+no banco (função `inicial`), e daí em diante não há mais varredura.
+
+    numero = sequencias.proximo("op", inicial=maior_numero_op)
+    primeiro = sequencias.reservar("tarefa:op:12", 40)   # bloco de 40 números
+"""
+
+from sqlalchemy import select
+
+_db = None
+_modelo = None
+
+
+def _inserir_se_nao_existe(nome, valor):
+    tabela = _modelo.__table__
+    dialeto = _db.session.get_bind(clause=tabela.insert()).dialect.name
+    if dialeto == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialeto == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        # Outros bancos: insere se não achar (sem garantia contra corrida na criação)
+        if _db.session.execute(select(tabela.c.nome).where(tabela.c.nome == nome)).first() is None:
+            _db.session.execute(tabela.insert().values(nome=nome, valor=valor))
+        return
+    _db.session.execute(insert(tabela).values(nome=nome, valor=valor).on_conflict_do_nothing(index_elements=["nome"]))
+
+
+def _incrementar(nome, quantidade):
+    tabela = _modelo.__table__
+    return _db.session.execute(
+        tabela.update()
+        .where(tabela.c.nome == nome)
+        .values(valor=tabela.c.valor + quantidade)
+        .returning(tabela.c.valor)
+    ).scalar()
+
+
+def reservar(nome, quantidade=1, inicial=None):
+    """Reserva `quantidade` números seguidos; devolve o primeiro deles
+
+    `inicial` é chamada só quando a sequência ainda não existe e deve
+    devolver o último número já usado (0 se nenhum).
+    """
+    if quantidade < 1:
+        raise ValueError("quantidade deve ser >= 1")
+    ultimo = _incrementar(nome, quantidade)
+    if ultimo is None:
+        _inserir_se_nao_existe(nome, inicial() if inicial else 0)
+        ultimo = _incrementar(nome, quantidade)
+    return ultimo - quantidade + 1
+
+
+def proximo(nome, inicial=None):
+    return reservar(nome, 1, inicial)
+
+
+def atual(nome):
+    """Último número usado, ou None se a sequência não existe"""
+    tabela = _modelo.__table__
+    return _db.session.execute(select(tabela.c.valor).where(tabela.c.nome == nome)).scalar()
+
+
+def definir(nome, valor):
+    """Reinicia a sequência: o próximo número será valor + 1"""
+    tabela = _modelo.__table__
+    _inserir_se_nao_existe(nome, valor)
+    _db.session.execute(tabela.update().where(tabela.c.nome == nome).values(valor=valor))
+
+
+def remover(nome):
+    tabela = _modelo.__table__
+    _db.session.execute(tabela.delete().where(tabela.c.nome == nome))
+
+
+def init_app(db, modelo):
+    """Liga as sequências ao modelo Sequencia"""
+    global _db, _modelo
+    _db, _modelo = db, modelo
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Sink HTTP local - recebe as notificações no lugar do Telegram/WhatsApp
+
+Serve para testar a fila de notificações sem internet e sem mandar
+mensagem de verdade. Cada POST recebido é mostrado no terminal.
+
+Uso:
+    python sink_notificacoes.py                  (porta 8025)
+    python sink_notificacoes.py --falhar 0.3     (30% das mensagens respondem 503)
+
+E no app:
+    PCP_NOTIF_REDIRECIONAR=http_local python app.py
+"""
+
+import argparse
+import json
+import random
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def criar_handler(taxa_falha):
+    class Handler(BaseHTTPRequestHandler):
+        recebidas = 0
+
+        def do_POST(self):
+            tamanho = int(self.headers.get("Content-Length", 0))
+            corpo = self.rfile.read(tamanho)
+
+            if random.random() < taxa_falha:
+                self.send_response(503)
+                self.end_headers()
+                print("💥 Falha simulada (503)")
+                return
+
+            Handler.recebidas += 1
+            try:
+                dados = json.loads(corpo)
+            except ValueError:
+                dados = {"mensagem": corpo.decode(errors="replace")}
+            print(f"📨 #{Handler.recebidas} destino={dados.get('destino') or '-'}")
+            print(f"   {dados.get('mensagem', '')[:300]}")
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b'{"ok": true}')
+
+        def log_message(self, formato, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sink local de notificações do PCP")
+    parser.add_argument("--porta", type=int, default=8025)
+    parser.add_argument("--falhar", type=float, default=0.0, help="fração de respostas 503")
+    args = parser.parse_args()
+
+    servidor = ThreadingHTTPServer(("127.0.0.1", args.porta), criar_handler(args.falhar))
+    print(f"🚀 Sink de notificações em http://127.0.0.1:{args.porta}/")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,8 @@
-import requests
 import os
-from dotenv import load_dotenv
 
-# Carregar variáveis de ambiente
-load_dotenv('.env.telegram')
+import canais
 
+# Credenciais vêm do .env.telegram (carregado em canais.py)
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TELEGRAM_USER_ID = os.getenv('TELEGRAM_USER_ID')
 
@@ -19,30 +17,16 @@ def enviar_notificacao_telegram(mensagem):
         bool: True se enviado com sucesso, False caso contrário
     """
     
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_USER_ID:
+    canal = canais.obter("telegram")
+    if not canal.configurado():
         print("❌ Credenciais do Telegram não configuradas!")
         print("Verifique o arquivo .env.telegram")
         return False
     
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    
-    dados = {
-        "chat_id": TELEGRAM_USER_ID,
-        "text": mensagem,
-        "parse_mode": "HTML"
-    }
-    
     try:
-        resposta = requests.post(url, json=dados, timeout=10)
-        
-        if resposta.status_code == 200:
-            print("✅ Notificação enviada com sucesso via Telegram!")
-            return True
-        else:
-            print(f"❌ Erro ao enviar notificação: Status {resposta.status_code}")
-            print(f"Resposta: {resposta.text}")
-            return False
-            
+        canal.enviar(mensagem)
+        print("✅ Notificação enviada com sucesso via Telegram!")
+        return True
     except Exception as e:
         print(f"❌ Erro ao enviar notificação: {str(e)}")
         return False
@@ -58,14 +42,19 @@ def enviar_notificacao_tarefas_atrasadas(tarefas_atrasadas):
     if not tarefas_atrasadas:
         return
     
+    canal = canais.obter("telegram")
+    
     # Construir mensagem
     mensagem = "⚠️ <b>TAREFAS ATRASADAS</b> ⚠️\n\n"
     
     for tarefa in tarefas_atrasadas:
-        mensagem += f"<b>OP:</b> {tarefa.get('op_numero', 'N/A')}\n"
-        mensagem += f"<b>Etapa:</b> {tarefa.get('etapa_nome', 'N/A')}\n"
-        mensagem += f"<b>Data Fim:</b> {tarefa.get('data_fim', 'N/A')}\n"
-        mensagem += f"<b>Dias Atrasado:</b> {tarefa.get('dias_atrasado', 'N/A')}\n"
+        mensagem += canal.renderizar(
+            "tarefa_atrasada_resumo",
+            op=tarefa.get('op_numero', 'N/A'),
+            etapa=tarefa.get('etapa_nome', 'N/A'),
+            data_fim=tarefa.get('data_fim', 'N/A'),
+            dias=tarefa.get('dias_atrasado', 'N/A'),
+        )
         mensagem += "─" * 30 + "\n"
     
     enviar_notificacao_telegram(mensagem)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Testes de agendador.py - expressões cron e a trava de líder em arquivo
+
+Não sobe o agendador (para isso rode python test_scheduler.py à mão).
+Roda sozinho (python test_agendador.py) ou pelo pytest.
+"""
+
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from agendador import Cron
+from travas import TravaArquivo, fcntl
+
+
+def _bate(cron, momento):
+    """Referência: o minuto casa com a expressão (regra do dia OU semana do cron)"""
+    dia = momento.day in cron.dias
+    semana = (momento.isoweekday() % 7) in cron.dias_semana
+    if cron._dia_livre or cron._semana_livre:
+        dia_ok = dia and semana
+    else:
+        dia_ok = dia or semana
+    return (momento.minute in cron.minutos and momento.hour in cron.horas
+            and momento.month in cron.meses and dia_ok)
+
+
+def _varrer(cron, depois_de, limite):
+    """Referência minuto a minuto (lenta, só para janelas curtas)"""
+    momento = depois_de.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    while momento <= limite:
+        if _bate(cron, momento):
+            return momento
+        momento += timedelta(minutes=1)
+    return None
+
+
+def test_proxima_exemplos():
+    base = datetime(2026, 10, 19, 10, 7, 30)  # segunda-feira
+    assert Cron("*/5 * * * *").proxima(base) == datetime(2026, 10, 19, 10, 10)
+    assert Cron("0 7 * * *").proxima(base) == datetime(2026, 10, 20, 7, 0)
+    assert Cron("30 17 * * 1-5").proxima(datetime(2026, 10, 23, 18)) == datetime(2026, 10, 26, 17, 30)
+    assert Cron("0 0 1 * *").proxima(base) == datetime(2026, 11, 1, 0, 0)
+    assert Cron("0 12 29 2 *").proxima(base) == datetime(2028, 2, 29, 12, 0)
+    # Estritamente depois: no próprio minuto vai para a próxima
+    assert Cron("7 10 * * *").proxima(datetime(2026, 10, 19, 10, 7)) == datetime(2026, 10, 20, 10, 7)
+    # Dia do mês e da semana restritos: vale qualquer um dos dois
+    assert Cron("0 8 1 * 0").proxima(base) == datetime(2026, 10, 25, 8, 0)
+
+
+def test_proxima_contra_varredura():
+    sorteio = random.Random(36)
+    campos = [
+        ["*", "*/15", "0", "5,35", "10-20/5"],
+        ["*", "*/6", "7", "8-17", "0,12"],
+        ["*", "1", "15", "1-7", "28-31"],
+        ["*", "*", "*", "2,3", "10-12"],
+        ["*", "1-5", "0", "6", "0,6"],
+    ]
+    for _ in range(60):
+        expressao = " ".join(sorteio.choice(opcoes) for opcoes in campos)
+        cron = Cron(expressao)
+        depois_de = datetime(2026, 1, 1) + timedelta(minutes=sorteio.randint(0, 365 * 24 * 60))
+        limite = depois_de + timedelta(days=40)
+        esperado = _varrer(cron, depois_de, limite)
+        if esperado is None:
+            assert cron.proxima(depois_de) > limite, expressao
+        else:
+            assert cron.proxima(depois_de) == esperado, (expressao, depois_de)
+
+
+def test_expressoes_invalidas():
+    for expressao in ("* * * *", "60 * * * *", "* 24 * * *", "* * 0 * *", "* * * * 7", "5-1 * * * *"):
+        try:
+            Cron(expressao)
+        except ValueError:
+            continue
+        raise AssertionError(f"{expressao!r} deveria ser inválida")
+    try:
+        Cron("0 0 31 2 *").proxima(datetime(2026, 1, 1))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("31 de fevereiro nunca dispara")
+
+
+def test_trava_arquivo():
+    if fcntl is None:
+        return
+    caminho = os.path.join(tempfile.mkdtemp(prefix="pcp_teste_trava_"), "lider.lock")
+    primeira, segunda = TravaArquivo(caminho), TravaArquivo(caminho)
+    assert primeira.tentar()
+    assert primeira.tentar()  # quem já é líder continua
+    assert not segunda.tentar()
+    primeira.arquivo.close()  # o processo líder morreu
+    assert segunda.tentar()
+
+
+if __name__ == "__main__":
+    for nome, teste in list(globals().items()):
+        if nome.startswith("test_") and callable(teste):
+            teste()
+            print(f"✅ {nome}")
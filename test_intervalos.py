@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Testes de intervalos.py - união, conflitos e o índice de sobreposição
+
+Roda sozinho (python test_intervalos.py) ou pelo pytest.
+"""
+
+import os
+import random
+import sys
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import intervalos
+
+
+def h(hora, minuto=0, dia=12):
+    return datetime(2026, 10, dia, hora, minuto)
+
+
+def sobrepoe(a, b):
+    """Referência ingênua: [a0, a1) e [b0, b1) se cruzam (fim None = aberto)"""
+    a1 = a[1] or intervalos.ABERTO
+    b1 = b[1] or intervalos.ABERTO
+    return a[0] < b1 and b[0] < a1
+
+
+def test_unir():
+    assert intervalos.unir([(h(8), h(10)), (h(9), h(11)), (h(13), h(14))]) == [(h(8), h(11)), (h(13), h(14))]
+    # Encostados viram um só; contido não muda nada; vazios e invertidos somem
+    assert intervalos.unir([(h(10), h(12)), (h(8), h(10))]) == [(h(8), h(12))]
+    assert intervalos.unir([(h(8), h(12)), (h(9), h(10))]) == [(h(8), h(12))]
+    assert intervalos.unir([(h(9), h(9)), (h(10), h(8))]) == []
+    assert intervalos.segundos_unidos([(h(8), h(10)), (h(9), h(11))]) == 3 * 3600
+    assert intervalos.segundos([(h(8), h(10)), (h(9), h(11))]) == 4 * 3600
+
+
+def test_por_dia():
+    partes = intervalos.por_dia([(h(22), h(2, dia=13))])
+    assert partes == {
+        date(2026, 10, 12): [(h(22), h(0, dia=13))],
+        date(2026, 10, 13): [(h(0, dia=13), h(2, dia=13))],
+    }
+    # Terminar exatamente à meia-noite não toca o dia seguinte
+    assert list(intervalos.por_dia([(h(20), h(0, dia=13))])) == [date(2026, 10, 12)]
+
+
+def test_conflitos():
+    itens = [
+        (h(8), h(10), "a"),
+        (h(9), h(11), "b"),
+        (h(10), h(12), "c"),  # encosta em "a": não conflita
+        (h(13), None, "d"),   # em andamento
+        (h(15), h(16), "e"),
+    ]
+    pares = {frozenset(p) for p in intervalos.conflitos(itens)}
+    assert pares == {frozenset("ab"), frozenset("bc"), frozenset("de")}
+
+
+def test_conflitos_contra_referencia():
+    sorteio = random.Random(45)
+    for _ in range(200):
+        itens = []
+        for valor in range(sorteio.randint(0, 12)):
+            inicio = h(0) + timedelta(minutes=sorteio.randint(0, 600))
+            fim = None if sorteio.random() < 0.1 else inicio + timedelta(minutes=sorteio.randint(1, 180))
+            itens.append((inicio, fim, valor))
+        esperado = {
+            frozenset((a[2], b[2]))
+            for i, a in enumerate(itens) for b in itens[i + 1:]
+            if sobrepoe(a, b)
+        }
+        pares = intervalos.conflitos(itens)
+        assert len(pares) == len(esperado)
+        assert {frozenset(p) for p in pares} == esperado
+
+
+def test_indice_sobreposicao():
+    indice = intervalos.IndiceIntervalos([(h(8), h(10), 1), (h(12), h(14), 2)])
+    assert len(indice) == 2
+    assert indice.sobreposicao(h(9), h(9, 30)) == 1
+    assert indice.sobreposicao(h(7), h(8, 1)) == 1
+    assert indice.sobreposicao(h(11), h(13)) == 2
+    assert indice.sobreposicao(h(10), h(12)) is None  # cabe exatamente no buraco
+    assert indice.sobreposicao(h(7), h(8)) is None
+    assert indice.sobreposicao(h(15)) is None
+    # Sem fim (em andamento) bate com tudo que vem depois
+    assert indice.sobreposicao(h(11)) == 2
+
+    indice.adicionar(h(16), None, 3)
+    assert indice.sobreposicao(h(20), h(21)) == 3
+    assert indice.sobreposicao(h(15), h(16)) is None
+
+
+def test_indice_contra_referencia():
+    sorteio = random.Random(44)
+    for _ in range(100):
+        indice = intervalos.IndiceIntervalos()
+        guardados = []
+        for valor in range(40):
+            inicio = h(0) + timedelta(minutes=sorteio.randint(0, 1000))
+            fim = inicio + timedelta(minutes=sorteio.randint(1, 90))
+            batem = [g[2] for g in guardados if sobrepoe(g, (inicio, fim))]
+            achado = indice.sobreposicao(inicio, fim)
+            if batem:
+                assert achado in batem
+            else:
+                assert achado is None
+                indice.adicionar(inicio, fim, valor)
+                guardados.append((inicio, fim, valor))
+        assert len(indice) == len(guardados)
+
+
+if __name__ == "__main__":
+    for nome, teste in list(globals().items()):
+        if nome.startswith("test_") and callable(teste):
+            teste()
+            print(f"✅ {nome}")
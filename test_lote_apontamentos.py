@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Testes de lote_apontamentos.py - validação, sobreposição e reenvio de lote
+
+Sobe o app num banco SQLite temporário (nunca no pcp.db) com eventos
+síncronos e sem despachante de notificações.
+Roda sozinho (python test_lote_apontamentos.py) ou pelo pytest.
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+if "app" in sys.modules:
+    # Outro teste já abriu o app apontando para outro banco
+    raise unittest.SkipTest("app já importado com outro banco")
+
+_PASTA = tempfile.mkdtemp(prefix="pcp_teste_lote_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_PASTA, 'pcp.db')}"
+os.environ["PCP_EVENTOS_SINCRONO"] = "1"
+os.environ["PCP_NOTIF_DESPACHANTE"] = "0"
+
+from app import (app, db, Apontamento, Etapa, HorasRealizadas, Maquina, Obra, OP, Operador,
+                 cache_cadastros, lote_apontamentos)
+
+DIA = "2026-11-02T"
+_cadastro = {}
+
+
+def _preparar():
+    if _cadastro:
+        return _cadastro
+    with app.app_context():
+        db.create_all()
+        obra = Obra(codigo="T1", nome="Obra teste", cliente="ACME", status="ATIVA")
+        db.session.add(obra)
+        db.session.flush()
+        ops = []
+        for numero, status in (("LOTE-A", "EM_EXECUCAO"), ("LOTE-B", "EM_EXECUCAO"), ("LOTE-C", "CONCLUIDA")):
+            op = OP(numero=numero, obra_id=obra.id, produto="P", status=status)
+            db.session.add(op)
+            db.session.flush()
+            for nome in ("CORTE", "DOBRA"):
+                db.session.add(Etapa(op_id=op.id, nome=nome))
+            ops.append(op)
+        operadores = [Operador(nome=f"Operador {i}", ativo=True) for i in range(3)]
+        maquina = Maquina(nome="Serra", setor="CORTE", ativo=True)
+        db.session.add_all(operadores + [maquina])
+        db.session.commit()
+        _cadastro.update(
+            op=ops[0].id,
+            etapas=[e.id for e in ops[0].etapas],
+            etapa_outra_op=ops[1].etapas[0].id,
+            op_concluida=ops[2].id,
+            etapa_concluida=ops[2].etapas[0].id,
+            operadores=[o.id for o in operadores],
+            maquina=maquina.id,
+        )
+    return _cadastro
+
+
+def _processar(eventos):
+    with app.app_context():
+        resultados = lote_apontamentos.processar(eventos)
+        db.session.commit()
+    return resultados
+
+
+def _inicio(operador, hora, ref=None, etapa=None, op=None, **extra):
+    cad = _preparar()
+    evento = {"tipo": "inicio", "op_id": op or cad["op"], "etapa_id": etapa or cad["etapas"][0],
+              "operador_id": cad["operadores"][operador], "em": DIA + hora, **extra}
+    if ref is not None:
+        evento["ref"] = ref
+    return evento
+
+
+def _horas(operador):
+    with app.app_context():
+        linhas = HorasRealizadas.query.filter_by(operador_id=_preparar()["operadores"][operador]).all()
+        return sum(r.segundos for r in linhas) / 3600
+
+
+def test_validacao_por_evento():
+    cad = _preparar()
+    resultados = _processar([
+        _inicio(1, "08:00:00", etapa=cad["etapa_outra_op"]),
+        _inicio(1, "08:00:00", op=99999),
+        {**_inicio(1, "08:00:00"), "operador_id": 99999},
+        _inicio(1, "08:00:00", op=cad["op_concluida"], etapa=cad["etapa_concluida"]),
+        _inicio(1, "08:00:00", maquina_id=99999),
+        {**_inicio(1, "08:00:00"), "em": "ontem"},
+        {"tipo": "fim", "ref": "nenhum", "em": DIA + "09:00:00"},
+        _inicio(1, "08:00:00", ref="r"),
+        {"tipo": "fim", "ref": "r", "em": DIA + "07:00:00"},
+        {"tipo": "xx"},
+        "não é objeto",
+    ])
+    assert [r["indice"] for r in resultados] == list(range(11))
+    assert [r["ok"] for r in resultados] == [False] * 7 + [True, False, False, False]
+    assert "não pertence" in resultados[0]["erro"]
+    assert "não encontrada" in resultados[1]["erro"]
+    assert "operador" in resultados[2]["erro"]
+    assert "concluída" in resultados[3]["erro"]
+    assert "máquina" in resultados[4]["erro"]
+    assert "inválido" in resultados[5]["erro"]
+    assert "nenhum início" in resultados[6]["erro"]
+    assert "fim antes do início" in resultados[8]["erro"]
+    # O início de ref "r" entrou (sem o fim inválido): fica em andamento
+    with app.app_context():
+        ap = db.session.get(Apontamento, resultados[7]["apontamento_id"])
+        assert ap.status == "EM_ANDAMENTO" and ap.fim is None
+
+
+def test_par_inicio_fim_sobreposicao_e_reenvio():
+    cad = _preparar()
+    lote = [
+        _inicio(0, "08:00:00", ref="a", maquina_id=cad["maquina"]),
+        {"tipo": "fim", "ref": "a", "em": DIA + "10:00:00", "qtd_boa": 5, "qtd_refugo": 1},
+        _inicio(0, "09:00:00", ref="b", etapa=cad["etapas"][1]),  # bate com "a"
+        _inicio(0, "10:00:00", ref="c"),                          # encosta no fim de "a"
+        {"tipo": "fim", "ref": "c", "em": DIA + "11:30:00"},
+    ]
+    antes = _horas(0)
+    resultados = _processar(lote)
+    assert [r["ok"] for r in resultados] == [True, True, False, True, True]
+    assert resultados[0]["apontamento_id"] == resultados[1]["apontamento_id"]
+    assert "operador já tem" in resultados[2]["erro"]
+    assert abs(_horas(0) - antes - 3.5) < 1e-9
+    with app.app_context():
+        ap = db.session.get(Apontamento, resultados[0]["apontamento_id"])
+        assert (ap.status, ap.qtd_boa, ap.qtd_refugo) == ("FINALIZADO", 5, 1)
+        assert ap.fim == datetime.fromisoformat(DIA + "10:00:00")
+        total = Apontamento.query.count()
+
+    # Reenvio do mesmo lote (terminal que não recebeu a resposta): nada entra
+    resultados = _processar(lote)
+    assert not any(r["ok"] for r in resultados)
+    assert all("operador já tem" in r["erro"] or "rejeitado" in r["erro"] for r in resultados)
+    assert abs(_horas(0) - antes - 3.5) < 1e-9
+    with app.app_context():
+        assert Apontamento.query.count() == total
+
+
+def test_finalizar_existente():
+    cad = _preparar()
+    with app.app_context():
+        aberto = Apontamento(obra_id=1, op_id=cad["op"], etapa_id=cad["etapas"][0],
+                             operador_id=cad["operadores"][2], inicio=datetime.fromisoformat(DIA + "07:00:00"),
+                             status="EM_ANDAMENTO")
+        db.session.add(aberto)
+        db.session.commit()
+        aberto_id = aberto.id
+    antes = _horas(2)
+    fim = {"tipo": "fim", "apontamento_id": aberto_id, "em": DIA + "09:00:00", "qtd_boa": 3}
+    resultados = _processar([
+        _inicio(2, "08:00:00"),  # bate com o aberto até ele ser fechado às 9h
+        fim,
+        _inicio(2, "09:00:00"),
+    ])
+    assert [r["ok"] for r in resultados] == [False, True, True]
+    assert abs(_horas(2) - antes - 2.0) < 1e-9
+    # Fechar de novo: já finalizado, horas não mudam
+    resultados = _processar([fim])
+    assert not resultados[0]["ok"] and "já está finalizado" in resultados[0]["erro"]
+    assert abs(_horas(2) - antes - 2.0) < 1e-9
+
+
+def test_cache_ve_op_nova():
+    cad = _preparar()
+    with app.app_context():
+        op = OP(numero="LOTE-D", obra_id=1, produto="P", status="EM_EXECUCAO")
+        db.session.add(op)
+        db.session.flush()
+        etapa = Etapa(op_id=op.id, nome="CORTE")
+        db.session.add(etapa)
+        db.session.commit()
+        op_id, etapa_id = op.id, etapa.id
+        assert op_id in cache_cadastros.cache.obter().ops
+    # Antes do apontamento que o operador 1 deixou aberto às 8h
+    resultados = _processar([
+        _inicio(1, "06:00:00", ref="d", op=op_id, etapa=etapa_id),
+        {"tipo": "fim", "ref": "d", "em": DIA + "07:00:00"},
+    ])
+    assert [r["ok"] for r in resultados] == [True, True], resultados
+
+
+if __name__ == "__main__":
+    for nome, teste in list(globals().items()):
+        if nome.startswith("test_") and callable(teste):
+            teste()
+            print(f"✅ {nome}")
+    print(f"📁 Banco de teste: {_PASTA}")
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Testes de modelos_op.py - compilação, blocos por hash, diferenças entre
+versões e o cálculo de data de fim usado na instanciação
+
+Roda sozinho (python test_modelos_op.py) ou pelo pytest.
+"""
+
+import os
+import random
+import sys
+import tempfile
+import threading
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import modelos_op
+
+
+def _tarefa(titulo, horas=9, **extra):
+    return {"titulo": titulo, "descricao": "", "horas_previstas": horas, "responsavel_id": None,
+            "data_inicio_prev": None, "data_fim_prev": None, **extra}
+
+
+def _conteudo():
+    return {"etapas": [
+        {"nome": "CORTE", "tarefas": [_tarefa("Cortar chapas", 18), _tarefa("Cortar perfis", 4.5)]},
+        {"nome": "START UP", "tarefas": [_tarefa("Comissionar", 9, data_inicio_prev="2026-10-01")]},
+        {"nome": "INSPEÇÃO", "tarefas": []},
+    ]}
+
+
+def test_compilar_dados():
+    plano = modelos_op.compilar_dados(_conteudo(), modelo_id=7)
+    assert plano.modelo_id == 7
+    assert plano.total_tarefas == 3
+    assert [(e.nome, e.deslocamento) for e in plano.etapas] == [("CORTE", 0), ("START UP", 1), ("INSPEÇÃO", None)]
+    tarefa = plano.etapas[1].tarefas[0]
+    assert tarefa.data_inicio_prev == date(2026, 10, 1) and tarefa.horas_previstas == 9.0
+    # O hash não depende da ordem das chaves
+    invertido = {"etapas": [{k: e[k] for k in reversed(list(e))} for e in _conteudo()["etapas"]]}
+    assert modelos_op.compilar_dados(invertido).hash == plano.hash
+
+
+def test_compilar_dados_invalidos():
+    invalidos = [
+        [],
+        {"etapas": "x"},
+        {"etapas": [{"tarefas": []}]},
+        {"etapas": [{"nome": "CORTE", "tarefas": {"titulo": "a"}}]},
+        {"etapas": [{"nome": "CORTE", "tarefas": ["x"]}]},
+        {"etapas": [{"nome": "CORTE", "tarefas": [_tarefa("  ")]}]},
+        {"etapas": [{"nome": "CORTE", "tarefas": [_tarefa("a", horas="muito")]}]},
+        {"etapas": [{"nome": "CORTE", "tarefas": [_tarefa("a", horas=-1)]}]},
+        {"etapas": [{"nome": "CORTE", "tarefas": [_tarefa("a", responsavel_id="3")]}]},
+        {"etapas": [{"nome": "CORTE", "tarefas": [_tarefa("a", data_fim_prev="31/12/2026")]}]},
+    ]
+    for dados in invalidos:
+        try:
+            modelos_op.compilar_dados(dados)
+        except modelos_op.ModeloInvalido:
+            continue
+        raise AssertionError(f"deveria ser inválido: {dados!r}")
+
+
+def test_decompor():
+    dados = _conteudo()
+    raiz, blocos = modelos_op.decompor(dados)
+    assert len(raiz["etapas"]) == 3
+    assert sorted(tipo for tipo, _ in blocos.values()) == ["etapa"] * 3 + ["tarefa"] * 3
+    # Remontar a partir dos blocos devolve o conteúdo original
+    etapas = [blocos[h][1] for h in raiz["etapas"]]
+    remontado = {"etapas": [
+        {"nome": e["nome"], "tarefas": [blocos[h][1] for h in e["tarefas"]]} for e in etapas
+    ]}
+    assert remontado == dados
+    # Mudar uma tarefa muda só o hash da etapa dela
+    dados["etapas"][0]["tarefas"][1]["horas_previstas"] = 6
+    raiz2, _ = modelos_op.decompor(dados)
+    assert raiz2["etapas"][0] != raiz["etapas"][0]
+    assert raiz2["etapas"][1:] == raiz["etapas"][1:]
+
+
+def test_diferencas():
+    antigo = _conteudo()
+    novo = _conteudo()
+    novo["etapas"][0]["tarefas"][1]["horas_previstas"] = 6
+    novo["etapas"][0]["tarefas"].append(_tarefa("Rebarbar"))
+    del novo["etapas"][0]["tarefas"][0]
+    novo["etapas"].pop(2)
+    novo["etapas"].append({"nome": "PINTURA", "tarefas": [_tarefa("Pintar")]})
+    # Modelos no formato antigo (etapas inteiras em `dados`) não precisam do banco
+    v1 = SimpleNamespace(id=1, versao=1, dados=antigo)
+    v2 = SimpleNamespace(id=2, versao=2, dados=novo)
+    d = modelos_op.diferencas(v1, v2)
+    assert d["de"] == {"id": 1, "versao": 1} and d["para"] == {"id": 2, "versao": 2}
+    assert d["etapas_adicionadas"] == ["PINTURA"]
+    assert d["etapas_removidas"] == ["INSPEÇÃO"]
+    assert list(d["etapas_alteradas"]) == ["CORTE"]  # START UP não mudou
+    corte = d["etapas_alteradas"]["CORTE"]
+    assert corte["tarefas_adicionadas"] == ["Rebarbar"]
+    assert corte["tarefas_removidas"] == ["Cortar chapas"]
+    assert corte["tarefas_alteradas"] == {"Cortar perfis": {"horas_previstas": [4.5, 6]}}
+
+
+def test_carregar_blocos_com_cache_cheio():
+    from sqlalchemy import JSON, Column, MetaData, String, Table, create_engine, insert
+    from sqlalchemy.orm import scoped_session, sessionmaker
+    from sqlalchemy.pool import StaticPool
+
+    tabela = Table("bloco", MetaData(), Column("hash", String(64), primary_key=True), Column("dados", JSON))
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    tabela.create(engine)
+    with engine.begin() as conexao:
+        conexao.execute(insert(tabela), [{"hash": f"h{i}", "dados": {"n": i}} for i in range(200)])
+    sessao = scoped_session(sessionmaker(engine))
+    anterior = (modelos_op._db, modelos_op._Bloco, modelos_op.BLOCOS_MAX)
+    modelos_op._db, modelos_op._Bloco = SimpleNamespace(session=sessao), SimpleNamespace(__table__=tabela)
+    modelos_op.BLOCOS_MAX = 10  # descartes o tempo todo
+    erros = []
+
+    def carregar(inicio):
+        try:
+            for j in range(30):
+                hashes = [f"h{(inicio + j + k) % 200}" for k in range(8)]
+                assert [b["n"] for b in modelos_op._carregar_blocos(hashes)] == [int(h[1:]) for h in hashes]
+        except Exception as e:
+            erros.append(e)
+        finally:
+            sessao.remove()
+
+    try:
+        threads = [threading.Thread(target=carregar, args=(i * 25,)) for i in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert not erros, erros
+        assert len(modelos_op._blocos) <= 10
+        try:
+            modelos_op._carregar_blocos(["nao-existe"])
+        except modelos_op.ModeloInvalido:
+            pass
+        else:
+            raise AssertionError("bloco inexistente deveria ser inválido")
+    finally:
+        modelos_op._db, modelos_op._Bloco, modelos_op.BLOCOS_MAX = anterior
+        modelos_op._blocos.clear()
+
+
+def _data_fim_antiga(data_inicio, horas_previstas, horas_por_dia=9):
+    """O laço dia a dia que calcular_data_fim substituiu"""
+    if not data_inicio or not horas_previstas or horas_previstas <= 0:
+        return data_inicio
+    horas_restantes = float(horas_previstas)
+    data_atual = data_inicio
+    while horas_restantes > 0:
+        if data_atual.weekday() < 5:
+            horas_restantes -= horas_por_dia
+        if horas_restantes > 0:
+            data_atual += timedelta(days=1)
+    return data_atual
+
+
+def test_calcular_data_fim_igual_ao_laco():
+    if "app" not in sys.modules:
+        # Só a função pura é usada; o app não deve tocar no pcp.db
+        os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="pcp_teste_"), "pcp.db")
+        os.environ.setdefault("PCP_NOTIF_DESPACHANTE", "0")
+    from app import calcular_data_fim
+
+    sorteio = random.Random(42)
+    casos = [(date(2026, 10, 17), 9), (date(2026, 10, 18), 9.5), (date(2026, 10, 23), 18), (None, 10),
+             (date(2026, 10, 19), 0), (date(2026, 10, 19), -3), (date(2026, 10, 19), 450)]
+    for _ in range(3000):
+        inicio = date(2026, 1, 1) + timedelta(days=sorteio.randint(0, 730))
+        horas = sorteio.choice([sorteio.randint(1, 400), sorteio.randint(1, 800) / 2, round(sorteio.uniform(0.1, 90), 2)])
+        casos.append((inicio, horas))
+    for inicio, horas in casos:
+        for por_dia in (9, 8):
+            assert calcular_data_fim(inicio, horas, por_dia) == _data_fim_antiga(inicio, horas, por_dia), (inicio, horas, por_dia)
+
+
+if __name__ == "__main__":
+    for nome, teste in list(globals().items()):
+        if nome.startswith("test_") and callable(teste):
+            teste()
+            print(f"✅ {nome}")
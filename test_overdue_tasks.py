@@ -2,6 +2,13 @@
 """
 Script de teste para verificar tarefas atrasadas e enviar notificações Telegram
 Executa a verificação AGORA, sem esperar 5 minutos!
+
+As mensagens entram na fila de notificações (notificacoes.py) e são enviadas
+no final do script, um resumo por obra e só se algo mudou desde o último
+envio (--forcar reenvia tudo). Para testar sem mandar nada de verdade:
+    python sink_notificacoes.py
+    PCP_NOTIF_REDIRECIONAR=http_local python test_overdue_tasks.py
+Pelo pytest as mensagens sempre vão para o canal "memoria" (canais.py).
 """
 
 import os
@@ -16,8 +23,13 @@ load_dotenv('.env.telegram')
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 # Importar o app e modelos
-from app import app, db, Tarefa
-from telegram_notifications import enviar_notificacao_telegram
+from app import app, db, Tarefa, verificar_tarefas_atrasadas
+import canais
+import notificacoes
+
+if __name__ != "__main__":
+    # Pelo pytest nada sai de verdade, mesmo com as credenciais configuradas
+    os.environ["PCP_NOTIF_REDIRECIONAR"] = "memoria"
 
 def testar_tarefas_atrasadas():
     """Testa a verificação de tarefas atrasadas"""
@@ -44,9 +56,6 @@ def testar_tarefas_atrasadas():
             print("\n💡 Dica: Crie uma tarefa com data fim anterior a hoje para testar!\n")
             return
         
-        # Enviar notificações
-        print("📤 Enviando notificações...\n")
-        
         for i, tarefa in enumerate(tarefas_atrasadas, 1):
             dias_atrasada = (hoje - tarefa.data_fim_prev).days
             
@@ -54,25 +63,19 @@ def testar_tarefas_atrasadas():
             print(f"   Título: {tarefa.titulo}")
             print(f"   Data Fim: {tarefa.data_fim_prev.strftime('%d/%m/%Y')}")
             print(f"   Dias Atrasada: {dias_atrasada}")
-            print(f"   Status: {tarefa.status}")
-            
-            mensagem = f"""⚠️ <b>TAREFA ATRASADA!</b> ⚠️
-
-📋 <b>Tarefa:</b> {tarefa.titulo}
-👤 <b>Responsável:</b> {tarefa.responsavel.nome if tarefa.responsavel else 'Não atribuído'}
-📅 <b>Data Fim:</b> {tarefa.data_fim_prev.strftime('%d/%m/%Y')}
-⏰ <b>Dias Atrasada:</b> {dias_atrasada}
-📊 <b>Status:</b> {tarefa.status}
-🔧 <b>OP:</b> {tarefa.etapa.op.numero if tarefa.etapa and tarefa.etapa.op else 'N/A'}
-🏗️ <b>Etapa:</b> {tarefa.etapa.nome if tarefa.etapa else 'N/A'}
-⏱️ <b>Horas Previstas:</b> {tarefa.horas_previstas} h
-
-⚠️ <b>Ação Necessária!</b>"""
-            
-            if enviar_notificacao_telegram(mensagem):
-                print(f"   ✅ Notificação enviada!\n")
-            else:
-                print(f"   ❌ Erro ao enviar notificação!\n")
+            print(f"   Status: {tarefa.status}\n")
+        
+        # Resumo por obra na fila (só o que mudou desde o último envio)
+        print("📤 Enfileirando resumos...\n")
+        forcar = "--forcar" in sys.argv
+        enfileiradas = verificar_tarefas_atrasadas(forcar=forcar)
+        print(f"📬 Mensagens na fila: {enfileiradas}" + ("" if enfileiradas or forcar else " (nada mudou; use --forcar para reenviar)") + "\n")
+        
+        # Enviar o que está na fila agora (no servidor quem envia é o despachante)
+        enviadas = notificacoes.processar_fila()
+        print(f"📨 Notificações processadas: {enviadas}\n")
+        if os.environ.get("PCP_NOTIF_REDIRECIONAR") == "memoria":
+            print(f"🧪 Guardadas em memória: {len(canais.obter('memoria').enviadas)}\n")
         
         print("="*60)
         print("✅ Teste concluído!")
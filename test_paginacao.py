@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Testes de paginacao.py - cursores para frente e para trás, com nulos
+
+Usa um SQLite em memória com uma tabela própria (não precisa do app).
+Roda sozinho (python test_paginacao.py) ou pelo pytest.
+"""
+
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import Column, Date, Integer, String, create_engine
+from sqlalchemy.orm import Session, declarative_base
+
+import paginacao
+
+Base = declarative_base()
+
+
+class Item(Base):
+    __tablename__ = "item"
+
+    id = Column(Integer, primary_key=True)
+    prioridade = Column(Integer, nullable=True)
+    prazo = Column(Date, nullable=True)
+    nome = Column(String(20), nullable=False)
+
+
+def _sessao(n=137, semente=50):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    sessao = Session(engine)
+    sorteio = random.Random(semente)
+    for i in range(1, n + 1):
+        sessao.add(Item(
+            id=i,
+            # Poucos valores distintos (muitos empates) e ~20% nulos
+            prioridade=None if sorteio.random() < 0.2 else sorteio.randint(1, 5),
+            prazo=None if sorteio.random() < 0.2 else date(2026, 1, 1) + timedelta(days=sorteio.randint(0, 9)),
+            nome=f"item {i}",
+        ))
+    sessao.commit()
+    return sessao
+
+
+def _esperado(sessao, campo, ordem):
+    """Ids na ordem de referência: (valor, id) na direção pedida, nulos por último"""
+    itens = sessao.query(Item).all()
+    reverso = ordem == "desc"
+    preenchidos = sorted((i for i in itens if getattr(i, campo) is not None),
+                         key=lambda i: (getattr(i, campo), i.id), reverse=reverso)
+    nulos = sorted((i for i in itens if getattr(i, campo) is None), key=lambda i: i.id, reverse=reverso)
+    return [i.id for i in preenchidos + nulos]
+
+
+def _para_frente(sessao, coluna, ordem, limite):
+    paginas, cursor = [], None
+    while True:
+        pagina = paginacao.paginar(sessao.query(Item), coluna, Item.id, ordem, apos=cursor, limite=limite)
+        paginas.append(pagina)
+        cursor = pagina.proximo
+        if cursor is None:
+            return paginas
+
+
+def test_para_frente_e_para_tras_com_nulos():
+    sessao = _sessao()
+    for campo in ("prioridade", "prazo"):
+        coluna = getattr(Item, campo)
+        for ordem in ("asc", "desc"):
+            for limite in (1, 7, 50, 500):
+                esperado = _esperado(sessao, campo, ordem)
+                paginas = _para_frente(sessao, coluna, ordem, limite)
+                ids = [i.id for p in paginas for i in p.itens]
+                assert ids == esperado, (campo, ordem, limite)
+                assert paginas[0].anterior is None
+
+                # Volta da última até a primeira pelo cursor "anterior"
+                voltando = [paginas[-1]]
+                while voltando[-1].anterior:
+                    voltando.append(paginacao.paginar(
+                        sessao.query(Item), coluna, Item.id, ordem, antes=voltando[-1].anterior, limite=limite))
+                assert [[i.id for i in p.itens] for p in reversed(voltando)] == \
+                       [[i.id for i in p.itens] for p in paginas], (campo, ordem, limite)
+
+
+def test_ordenado_pelo_id():
+    sessao = _sessao(n=23)
+    paginas = _para_frente(sessao, Item.id, "desc", 5)
+    assert [i.id for p in paginas for i in p.itens] == list(range(23, 0, -1))
+    volta = paginacao.paginar(sessao.query(Item), Item.id, Item.id, "desc", antes=paginas[2].anterior, limite=5)
+    assert [i.id for i in volta.itens] == [i.id for i in paginas[1].itens]
+
+
+def test_filtro_e_total():
+    sessao = _sessao()
+    consulta = sessao.query(Item).filter(Item.prioridade >= 3)
+    total = consulta.count()
+    pagina = paginacao.paginar(consulta, Item.prioridade, Item.id, "asc", limite=10, teto=1000)
+    assert (pagina.total, pagina.total_exato) == (total, True)
+    assert all(i.prioridade >= 3 for i in pagina.itens)
+    pagina = paginacao.paginar(consulta, Item.prioridade, Item.id, "asc", limite=10, teto=5)
+    assert (pagina.total, pagina.total_exato) == (5, False)
+
+
+def test_cursor_invalido():
+    sessao = _sessao(n=3)
+    for cursor in ("lixo", "WzEsMl0", "bnVsbA"):  # não-JSON, [1, 2] de tipo errado, null
+        try:
+            paginacao.paginar(sessao.query(Item), Item.prazo, Item.id, apos=cursor)
+        except paginacao.CursorInvalido:
+            continue
+        raise AssertionError(f"cursor {cursor!r} deveria ser inválido")
+
+
+def test_por_pagina():
+    assert paginacao.por_pagina(None) == paginacao.POR_PAGINA
+    assert paginacao.por_pagina("abc") == paginacao.POR_PAGINA
+    assert paginacao.por_pagina("0") == 1
+    assert paginacao.por_pagina("100000") == paginacao.POR_PAGINA_MAX
+
+
+if __name__ == "__main__":
+    for nome, teste in list(globals().items()):
+        if nome.startswith("test_") and callable(teste):
+            teste()
+            print(f"✅ {nome}")
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Testes de sequencias.py - blocos de números sem duplicar, inclusive com threads
+
+Usa um SQLite temporário com uma tabela própria (não precisa do app).
+Roda sozinho (python test_sequencias.py) ou pelo pytest.
+"""
+
+import os
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import Column, Integer, String, create_engine
+from sqlalchemy.orm import declarative_base, scoped_session, sessionmaker
+
+import sequencias
+
+Base = declarative_base()
+
+
+class Sequencia(Base):
+    __tablename__ = "sequencia"
+
+    nome = Column(String(80), primary_key=True)
+    valor = Column(Integer, nullable=False, default=0)
+
+
+@contextmanager
+def _ligar():
+    """Liga sequencias a um banco próprio e devolve a ligação anterior no fim"""
+    caminho = os.path.join(tempfile.mkdtemp(prefix="pcp_teste_seq_"), "seq.db")
+    engine = create_engine(f"sqlite:///{caminho}", connect_args={"timeout": 30})
+    Base.metadata.create_all(engine)
+    sessao = scoped_session(sessionmaker(engine))
+    anterior = (sequencias._db, sequencias._modelo)
+    sequencias.init_app(SimpleNamespace(session=sessao), Sequencia)
+    try:
+        yield sessao
+    finally:
+        sessao.remove()
+        sequencias.init_app(*anterior)
+
+
+def test_reservar_e_proximo():
+    with _ligar() as sessao:
+        chamadas = []
+
+        def inicial():
+            chamadas.append(1)
+            return 41
+
+        assert sequencias.proximo("op", inicial=inicial) == 42
+        assert sequencias.proximo("op", inicial=inicial) == 43
+        assert sequencias.reservar("op", 10, inicial=inicial) == 44
+        assert sequencias.proximo("op", inicial=inicial) == 54
+        assert chamadas == [1]  # `inicial` só na criação
+        sessao.commit()
+
+        assert sequencias.reservar("tarefa:op:1", 5) == 1
+        sessao.rollback()  # rollback devolve os números (e a própria sequência)
+        assert sequencias.reservar("tarefa:op:1", 5) == 1
+        sessao.commit()
+
+        sequencias.definir("tarefa:op:1", 100)
+        assert sequencias.proximo("tarefa:op:1") == 101
+        sequencias.remover("tarefa:op:1")
+        assert sequencias.proximo("tarefa:op:1", inicial=lambda: 7) == 8
+        sessao.commit()
+
+        try:
+            sequencias.reservar("op", 0)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("quantidade 0 deveria ser recusada")
+
+
+def test_threads_nao_repetem_numeros():
+    with _ligar() as sessao:
+        recebidos = []
+        trava = threading.Lock()
+        erros = []
+
+        def trabalhar(tamanho):
+            try:
+                for _ in range(25):
+                    primeiro = sequencias.reservar("concorrida", tamanho)
+                    sessao.commit()
+                    with trava:
+                        recebidos.extend(range(primeiro, primeiro + tamanho))
+            except Exception as e:
+                erros.append(e)
+            finally:
+                sessao.remove()
+
+        threads = [threading.Thread(target=trabalhar, args=(1 + i % 3,)) for i in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert not erros, erros
+        assert sorted(recebidos) == list(range(1, len(recebidos) + 1))
+
+
+if __name__ == "__main__":
+    for nome, teste in list(globals().items()):
+        if nome.startswith("test_") and callable(teste):
+            teste()
+            print(f"✅ {nome}")
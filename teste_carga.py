@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Teste de carga - compara a vazão de cada perfil do gunicorn
+
+Sobe o app com cada perfil de config_banco.PERFIS, simula vários usuários
+acessando as telas ao mesmo tempo (como na troca de turno) e mostra
+requisições por segundo, latência e erros de cada configuração.
+
+Uso:
+    python teste_carga.py
+    python teste_carga.py --perfis gthread gevent --usuarios 40 --duracao 30
+    python teste_carga.py --url http://127.0.0.1:5000   (servidor já rodando)
+"""
+
+import argparse
+import http.cookiejar
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from config_banco import PERFIS
+
+ROTAS_PADRAO = ["/dashboard", "/ops", "/obras", "/apontamentos", "/api/ops"]
+
+
+def criar_cliente(base_url, email, senha):
+    """Cria um opener com cookie de sessão já autenticado"""
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    dados = urllib.parse.urlencode({"email": email, "senha": senha}).encode()
+    try:
+        opener.open(f"{base_url}/login", data=dados, timeout=10).read()
+    except urllib.error.URLError as e:
+        print(f"⚠️ Falha no login: {e}")
+    return opener
+
+
+def aguardar_servidor(base_url, limite=30):
+    inicio = time.time()
+    while time.time() - inicio < limite:
+        try:
+            urllib.request.urlopen(f"{base_url}/login", timeout=2).read()
+            return True
+        except Exception:
+            time.sleep(0.5)
+    return False
+
+
+def executar_carga(base_url, rotas, usuarios, duracao, email, senha):
+    """Dispara requisições em paralelo e devolve as estatísticas"""
+    latencias = []
+    erros = [0]
+    trava = threading.Lock()
+    fim = time.time() + duracao
+
+    def usuario(indice):
+        opener = criar_cliente(base_url, email, senha)
+        i = indice
+        while time.time() < fim:
+            rota = rotas[i % len(rotas)]
+            i += 1
+            t0 = time.perf_counter()
+            try:
+                opener.open(base_url + rota, timeout=30).read()
+                ok = True
+            except Exception:
+                ok = False
+            dt = time.perf_counter() - t0
+            with trava:
+                if ok:
+                    latencias.append(dt)
+                else:
+                    erros[0] += 1
+
+    threads = [threading.Thread(target=usuario, args=(n,)) for n in range(usuarios)]
+    t0 = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    total = time.time() - t0
+
+    latencias.sort()
+
+    def pct(p):
+        if not latencias:
+            return 0.0
+        return latencias[min(int(len(latencias) * p), len(latencias) - 1)] * 1000
+
+    return {
+        "requisicoes": len(latencias),
+        "erros": erros[0],
+        "rps": len(latencias) / total if total else 0.0,
+        "p50": pct(0.50),
+        "p95": pct(0.95),
+        "p99": pct(0.99),
+    }
+
+
+def subir_servidor(perfil, porta):
+    env = dict(os.environ)
+    env["PCP_PERFIL"] = perfil
+    env["PORT"] = str(porta)
+    return subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app",
+         "--access-logfile", "/dev/null"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+    )
+
+
+def imprimir_resultados(resultados):
+    print("\n" + "=" * 78)
+    print(f"{'Perfil':<12}{'Req':>8}{'Erros':>8}{'Req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    print("-" * 78)
+    for nome, r in resultados:
+        print(f"{nome:<12}{r['requisicoes']:>8}{r['erros']:>8}{r['rps']:>10.1f}"
+              f"{r['p50']:>10.1f}{r['p95']:>10.1f}{r['p99']:>10.1f}")
+    print("=" * 78 + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do PCP Web")
+    parser.add_argument("--perfis", nargs="+", default=list(PERFIS), choices=list(PERFIS))
+    parser.add_argument("--usuarios", type=int, default=20)
+    parser.add_argument("--duracao", type=int, default=15, help="segundos por perfil")
+    parser.add_argument("--porta", type=int, default=5055)
+    parser.add_argument("--rotas", nargs="+", default=ROTAS_PADRAO)
+    parser.add_argument("--email", default="admin@nexon.com")
+    parser.add_argument("--senha", default="senha123")
+    parser.add_argument("--url", help="testar um servidor que já está rodando")
+    args = parser.parse_args()
+
+    resultados = []
+
+    if args.url:
+        print(f"🚀 Testando {args.url} com {args.usuarios} usuários por {args.duracao}s...")
+        r = executar_carga(args.url.rstrip("/"), args.rotas, args.usuarios, args.duracao, args.email, args.senha)
+        resultados.append(("externo", r))
+        imprimir_resultados(resultados)
+        return
+
+    for perfil in args.perfis:
+        print(f"\n🚀 Perfil {perfil}: subindo gunicorn na porta {args.porta}...")
+        processo = subir_servidor(perfil, args.porta)
+        base_url = f"http://127.0.0.1:{args.porta}"
+        try:
+            if not aguardar_servidor(base_url):
+                print(f"❌ Servidor não respondeu no perfil {perfil}")
+                continue
+            print(f"   {args.usuarios} usuários por {args.duracao}s...")
+            r = executar_carga(base_url, args.rotas, args.usuarios, args.duracao, args.email, args.senha)
+            resultados.append((perfil, r))
+        finally:
+            processo.terminate()
+            processo.wait(timeout=30)
+
+    imprimir_resultados(resultados)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+Tokens da API mobile - access/refresh tokens assinados (formato JWT HS256)
+
+O access token carrega o id, o tipo e as etapas liberadas do usuário e é
+validado só com a assinatura HMAC e a data de expiração, sem consultar o
+banco. O refresh token (validade longa) é usado em /api/token/refresh para
+emitir um novo par; nesse momento o usuário é relido do banco, então uma
+mudança de tipo/etapas ou um usuário desativado vale no próximo refresh.
+
+Revogação (logout): o jti do token entra na tabela token_revogado. Cada
+worker mantém uma cópia em memória dessa lista, recarregada a cada
+PCP_TOKEN_REVOGADOS_SEG segundos, com só os tokens ainda não expirados.
+O uso único do refresh token não depende dessa cópia: o refresh grava o
+jti na tabela antes de emitir o par novo, e quem perder o INSERT leva 401.
+
+Sem uma chave própria os tokens ficam desligados: como o access token vale
+sem consultar o banco, assinar com a SECRET_KEY padrão do repositório
+deixaria qualquer um forjar um token de ADMIN. Nesse caso o init_app loga
+um erro e as rotas de token respondem 503.
+
+Variáveis de ambiente:
+    PCP_TOKEN_SEGREDO          chave do HMAC (padrão: SECRET_KEY do app, se
+                               não for a do repositório)
+    PCP_TOKEN_ACESSO_MIN       validade do access token (padrão: 15)
+    PCP_TOKEN_REFRESH_DIAS     validade do refresh token (padrão: 30)
+    PCP_TOKEN_REVOGADOS_SEG    intervalo de recarga da lista de revogados (padrão: 30)
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+import uuid
+from functools import wraps
+
+from flask import g, jsonify, request
+
+import log_estruturado
+import permissoes
+
+ACESSO_SEG = int(os.environ.get("PCP_TOKEN_ACESSO_MIN", "15")) * 60
+REFRESH_SEG = int(os.environ.get("PCP_TOKEN_REFRESH_DIAS", "30")) * 86400
+REVOGADOS_SEG = float(os.environ.get("PCP_TOKEN_REVOGADOS_SEG", "30"))
+
+_CABECALHO = {"alg": "HS256", "typ": "JWT"}
+
+# SECRET_KEY que vem no código: não serve para assinar tokens
+SEGREDOS_INSEGUROS = frozenset({"", "pcp-secret"})
+
+log = log_estruturado.obter("tokens")
+
+_segredo = None
+
+
+class TokenInvalido(Exception):
+    pass
+
+
+class TokensDesativados(Exception):
+    pass
+
+
+def ativo():
+    return _segredo is not None
+
+
+def _b64(dados):
+    return base64.urlsafe_b64encode(dados).rstrip(b"=").decode()
+
+
+def _b64_decodificar(texto):
+    return base64.urlsafe_b64decode(texto + "=" * (-len(texto) % 4))
+
+
+def _assinar(mensagem):
+    if _segredo is None:
+        raise TokensDesativados("PCP_TOKEN_SEGREDO não configurado")
+    return hmac.new(_segredo, mensagem, hashlib.sha256).digest()
+
+
+def gerar_token(claims):
+    """Assina um dicionário de claims e devolve o token compacto"""
+    partes = _b64(json.dumps(_CABECALHO, separators=(",", ":")).encode()) + "." + \
+        _b64(json.dumps(claims, separators=(",", ":")).encode())
+    return partes + "." + _b64(_assinar(partes.encode()))
+
+
+def ler_token(token, tipo):
+    """Valida assinatura, tipo, expiração e revogação; devolve as claims"""
+    try:
+        cabecalho, corpo, assinatura = token.split(".")
+        esperado = _assinar(f"{cabecalho}.{corpo}".encode())
+        if not hmac.compare_digest(esperado, _b64_decodificar(assinatura)):
+            raise TokenInvalido("Assinatura inválida")
+        claims = json.loads(_b64_decodificar(corpo))
+    except (ValueError, TypeError) as e:
+        raise TokenInvalido("Token malformado") from e
+
+    if claims.get("typ") != tipo:
+        raise TokenInvalido("Tipo de token inválido")
+    if claims.get("exp", 0) < time.time():
+        raise TokenInvalido("Token expirado")
+    if revogados.contem(claims.get("jti")):
+        raise TokenInvalido("Token revogado")
+    return claims
+
+
+def emitir_par(perfil):
+    """Access + refresh token para um PerfilAcesso"""
+    agora = int(time.time())
+    acesso = {
+        "typ": "access",
+        "sub": perfil.id,
+        "nome": perfil.nome,
+        "email": perfil.email,
+        "tipo": perfil.tipo,
+        "etapas": sorted(perfil.etapas),
+        "iat": agora,
+        "exp": agora + ACESSO_SEG,
+        "jti": uuid.uuid4().hex,
+    }
+    refresh = {
+        "typ": "refresh",
+        "sub": perfil.id,
+        "iat": agora,
+        "exp": agora + REFRESH_SEG,
+        "jti": uuid.uuid4().hex,
+    }
+    return {
+        "access_token": gerar_token(acesso),
+        "refresh_token": gerar_token(refresh),
+        "token_type": "Bearer",
+        "expires_in": ACESSO_SEG,
+    }
+
+
+def perfil_das_claims(claims):
+    """Monta o PerfilAcesso a partir do access token (sem banco)"""
+    return permissoes.PerfilAcesso(
+        id=claims["sub"],
+        nome=claims.get("nome", ""),
+        email=claims.get("email", ""),
+        tipo=claims["tipo"],
+        ativo=True,
+        acoes=permissoes.PERMISSOES_POR_TIPO.get(claims["tipo"], frozenset()),
+        etapas=frozenset(claims.get("etapas", ())),
+    )
+
+
+# ============ LISTA DE REVOGADOS ============
+
+class ListaRevogados:
+    """jti -> exp dos tokens revogados que ainda não expiraram"""
+
+    def __init__(self, intervalo=REVOGADOS_SEG):
+        self.intervalo = intervalo
+        self.trava = threading.Lock()
+        self.jtis = {}
+        self.carregado_em = 0.0
+        self.carregar = None  # função que devolve {jti: exp} do banco
+
+    def contem(self, jti):
+        agora = time.monotonic()
+        if self.carregar is not None and agora - self.carregado_em > self.intervalo:
+            jtis = self.carregar()
+            with self.trava:
+                self.jtis = jtis
+                self.carregado_em = agora
+        return jti in self.jtis
+
+    def adicionar(self, jti, exp):
+        with self.trava:
+            self.jtis = {j: e for j, e in self.jtis.items() if e > time.time()}
+            self.jtis[jti] = exp
+
+
+revogados = ListaRevogados()
+
+
+# ============ DECORATOR ============
+
+def token_da_requisicao():
+    cabecalho = request.headers.get("Authorization", "")
+    if cabecalho.startswith("Bearer "):
+        return cabecalho[7:].strip()
+    return None
+
+
+def _resposta_desativado():
+    return jsonify({"success": False, "message": "API de tokens desativada: configure PCP_TOKEN_SEGREDO"}), 503
+
+
+def requer_segredo(f):
+    """503 enquanto não houver chave de assinatura (rotas que emitem tokens)"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not ativo():
+            return _resposta_desativado()
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def requer_token(f):
+    """Exige um access token válido e coloca o perfil em g.usuario_token"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not ativo():
+            return _resposta_desativado()
+        token = token_da_requisicao()
+        if not token:
+            return jsonify({"success": False, "message": "Token de acesso não informado"}), 401
+        try:
+            claims = ler_token(token, "access")
+        except TokenInvalido as e:
+            return jsonify({"success": False, "message": str(e)}), 401
+        g.token_claims = claims
+        g.usuario_token = perfil_das_claims(claims)
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def init_app(app, carregar_revogados):
+    """Define a chave de assinatura e a origem da lista de revogados"""
+    global _segredo
+    segredo = os.environ.get("PCP_TOKEN_SEGREDO") or app.config.get("SECRET_KEY") or ""
+    if segredo in SEGREDOS_INSEGUROS:
+        _segredo = None
+        log.error("API de tokens desativada: defina PCP_TOKEN_SEGREDO (ou uma SECRET_KEY própria); "
+                  "as rotas /api com token respondem 503")
+    else:
+        _segredo = segredo.encode()
+    revogados.carregar = carregar_revogados
@@ -0,0 +1,37 @@
+"""
+Travas entre processos da mesma máquina - flock num arquivo
+
+Quem pega a trava fica com ela até fechar o arquivo (ou o processo morrer),
+então um processo que cai libera a vez para outro. Usada na eleição do
+líder do agendador (agendador.py) e para escolher o único processo que abre
+o perfil do WhatsApp Web (canais.py).
+
+    trava = TravaArquivo("/tmp/pcp_agendador.lock")
+    if trava.tentar():   # não bloqueia; quem já tem continua tendo
+        ...
+"""
+
+try:
+    import fcntl
+except ImportError:  # Windows: um processo só, a trava sempre é concedida
+    fcntl = None
+
+
+class TravaArquivo:
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.arquivo = None
+
+    def tentar(self):
+        if self.arquivo is not None:
+            return True
+        if fcntl is None:
+            return True
+        arquivo = open(self.caminho, "a")
+        try:
+            fcntl.flock(arquivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            arquivo.close()
+            return False
+        self.arquivo = arquivo
+        return True
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Utilização de máquinas e OEE a partir dos apontamentos
+
+Os apontamentos finalizados de cada máquina são pré-agregados por dia na
+tabela maquina_dia (tempo ocupado, peças boas, refugo, apontamentos). O
+tempo ocupado é a união dos intervalos do dia: dois apontamentos
+simultâneos na mesma máquina não contam em dobro. As peças entram no dia
+em que o apontamento terminou.
+
+A linha do dia é recalculada quando um apontamento da máquina é finalizado
+(assinante de ApontamentoFinalizado), então os relatórios só somam linhas
+diárias, qualquer que seja o volume de apontamentos:
+
+    utilizacao_maquinas.resumo(date(2026, 1, 1), date(2026, 3, 31))
+
+Indicadores por máquina e por setor:
+    utilizacao      horas ocupadas / horas disponíveis (dias úteis x turno)
+    disponibilidade utilização limitada a 100% (componente do OEE)
+    qualidade       peças boas / peças produzidas
+    taxa_refugo     refugo / peças produzidas
+    throughput      peças produzidas por hora ocupada
+    oee             disponibilidade x qualidade (o desempenho precisa de um
+                    tempo de ciclo padrão, que o cadastro não tem; conta 100%)
+
+Linha de comando (recalcula a tabela a partir dos apontamentos):
+    python utilizacao_maquinas.py --reconstruir [AAAA-MM-DD AAAA-MM-DD]
+
+Variáveis de ambiente:
+    PCP_HORAS_TURNO   horas disponíveis por máquina em cada dia útil (padrão: 9)
+"""
+
+import os
+import sys
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import func, select
+
+import intervalos
+
+HORAS_TURNO = float(os.environ.get("PCP_HORAS_TURNO", "9"))
+
+_db = None
+_Apontamento = _Maquina = _MaquinaDia = None
+
+
+def _linhas_por_dia(apontamentos, dias=None):
+    """{dia: {segundos_ocupados, qtd_boa, qtd_refugo, apontamentos}} de uma máquina"""
+    linhas = defaultdict(lambda: {"segundos_ocupados": 0.0, "qtd_boa": 0, "qtd_refugo": 0, "apontamentos": 0})
+    spans = []
+    for ap in apontamentos:
+        spans.append((ap.inicio, ap.fim))
+        dia_fim = ap.fim.date()
+        if dias is None or dia_fim in dias:
+            linha = linhas[dia_fim]
+            linha["qtd_boa"] += ap.qtd_boa or 0
+            linha["qtd_refugo"] += ap.qtd_refugo or 0
+            linha["apontamentos"] += 1
+    for dia, partes in intervalos.por_dia(spans).items():
+        if dias is None or dia in dias:
+            linhas[dia]["segundos_ocupados"] = intervalos.segundos_unidos(partes)
+    return linhas
+
+
+def _finalizados(maquina_id, inicio=None, fim=None):
+    ap = _Apontamento
+    consulta = (_db.session.query(ap.maquina_id, ap.inicio, ap.fim, ap.qtd_boa, ap.qtd_refugo)
+                .filter(ap.status == "FINALIZADO", ap.inicio.isnot(None), ap.fim.isnot(None)))
+    if maquina_id is not None:
+        consulta = consulta.filter(ap.maquina_id == maquina_id)
+    else:
+        consulta = consulta.filter(ap.maquina_id.isnot(None))
+    if inicio is not None:
+        consulta = consulta.filter(ap.fim > inicio)
+    if fim is not None:
+        consulta = consulta.filter(ap.inicio < fim)
+    return consulta
+
+
+def _gravar(maquina_id, linhas, dias):
+    """Grava as linhas recalculadas dos dias (upsert) e apaga os dias que ficaram vazios
+
+    Dois apontamentos da mesma máquina finalizados juntos recalculam o mesmo
+    dia em transações diferentes; com DELETE + INSERT a segunda falhava na
+    chave primária. O upsert sobrescreve a linha com o valor recalculado.
+    """
+    tabela = _MaquinaDia.__table__
+    vazios = [dia for dia in dias if dia not in linhas]
+    if vazios:
+        _db.session.execute(tabela.delete().where(tabela.c.maquina_id == maquina_id, tabela.c.dia.in_(vazios)))
+    novas = [{"maquina_id": maquina_id, "dia": dia, **valores} for dia, valores in linhas.items()]
+    if not novas:
+        return
+    dialeto = _db.session.get_bind(clause=tabela.insert()).dialect.name
+    if dialeto in ("postgresql", "sqlite"):
+        if dialeto == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        comando = insert(tabela)
+        comando = comando.on_conflict_do_update(
+            index_elements=["maquina_id", "dia"],
+            set_={c: comando.excluded[c] for c in ("segundos_ocupados", "qtd_boa", "qtd_refugo", "apontamentos")},
+        )
+        for linha in novas:
+            _db.session.execute(comando, linha)
+        return
+    # Outros bancos: UPDATE e, se não havia linha, INSERT
+    for linha in novas:
+        chave = (tabela.c.maquina_id == maquina_id) & (tabela.c.dia == linha["dia"])
+        valores = {c: v for c, v in linha.items() if c not in ("maquina_id", "dia")}
+        if _db.session.execute(tabela.update().where(chave).values(**valores)).rowcount == 0:
+            _db.session.execute(tabela.insert().values(**linha))
+
+
+def atualizar_dias(maquina_id, dias):
+    """Recalcula as linhas diárias da máquina nos dias informados (sem commit)"""
+    dias = set(dias)
+    if not maquina_id or not dias:
+        return
+    # Uma atualização por máquina de cada vez (trava a linha da máquina): a
+    # segunda lê os apontamentos só depois que a primeira gravou. No SQLite o
+    # FOR UPDATE é omitido; lá o upsert de _gravar evita o erro de chave e o
+    # --reconstruir corrige uma linha eventualmente defasada
+
+    maquina = _Maquina.__table__
+    _db.session.execute(select(maquina.c.id).where(maquina.c.id == maquina_id).with_for_update())
+    inicio = datetime.combine(min(dias), time.min)
+    fim = datetime.combine(max(dias) + timedelta(days=1), time.min)
+    linhas = _linhas_por_dia(_finalizados(maquina_id, inicio, fim), dias)
+    _gravar(maquina_id, linhas, dias)
+
+
+def atualizar_apontamento(apontamento):
+    """Recalcula os dias tocados por um apontamento finalizado (sem commit)"""
+    if apontamento.maquina_id and apontamento.inicio and apontamento.fim:
+        # As peças entram no dia do fim, mesmo que o fim seja à meia-noite
+        dias = set(intervalos.dias(apontamento.inicio, apontamento.fim)) | {apontamento.fim.date()}
+        atualizar_dias(apontamento.maquina_id, dias)
+
+
+def reconstruir(inicio=None, fim=None):
+    """Recalcula maquina_dia inteira (ou entre as datas inicio e fim); devolve as linhas gravadas"""
+    tabela = _MaquinaDia.__table__
+    apagar = tabela.delete()
+    if inicio:
+        apagar = apagar.where(tabela.c.dia >= inicio)
+    if fim:
+        apagar = apagar.where(tabela.c.dia <= fim)
+    _db.session.execute(apagar)
+
+    de = datetime.combine(inicio, time.min) if inicio else None
+    ate = datetime.combine(fim + timedelta(days=1), time.min) if fim else None
+    por_maquina = defaultdict(list)
+    for ap in _finalizados(None, de, ate).order_by(_Apontamento.maquina_id).yield_per(5000):
+        por_maquina[ap.maquina_id].append(ap)
+
+    total = 0
+    for maquina_id, aps in por_maquina.items():
+        linhas = _linhas_por_dia(aps)
+        linhas = {d: v for d, v in linhas.items() if (not inicio or d >= inicio) and (not fim or d <= fim)}
+        novas = [{"maquina_id": maquina_id, "dia": dia, **valores} for dia, valores in linhas.items()]
+        if novas:
+            _db.session.execute(tabela.insert(), novas)
+        total += len(novas)
+    return total
+
+
+# ============ INDICADORES ============
+
+def dias_uteis(inicio, fim):
+    """Dias de segunda a sexta entre inicio e fim (inclusive)"""
+    if fim < inicio:
+        return 0
+    total = (fim - inicio).days + 1
+    semanas, resto = divmod(total, 7)
+    uteis = semanas * 5
+    for i in range(resto):
+        if (inicio.weekday() + i) % 7 < 5:
+            uteis += 1
+    return uteis
+
+
+def indicadores(segundos, qtd_boa, qtd_refugo, horas_disponiveis):
+    horas = segundos / 3600
+    pecas = qtd_boa + qtd_refugo
+    utilizacao = horas / horas_disponiveis if horas_disponiveis else 0.0
+    disponibilidade = min(utilizacao, 1.0)
+    qualidade = qtd_boa / pecas if pecas else 1.0
+    return {
+        "horas_ocupadas": round(horas, 2),
+        "horas_disponiveis": round(horas_disponiveis, 2),
+        "qtd_boa": qtd_boa,
+        "qtd_refugo": qtd_refugo,
+        "utilizacao": round(utilizacao * 100, 1),
+        "disponibilidade": round(disponibilidade * 100, 1),
+        "qualidade": round(qualidade * 100, 1),
+        "taxa_refugo": round(qtd_refugo / pecas * 100, 1) if pecas else 0.0,
+        "throughput": round(pecas / horas, 2) if horas else 0.0,
+        "oee": round(disponibilidade * qualidade * 100, 1),
+    }
+
+
+def resumo(inicio, fim):
+    """Indicadores por máquina e por setor entre as datas (inclusive)"""
+    md = _MaquinaDia
+    somas = {
+        maquina_id: (segundos or 0.0, boa or 0, refugo or 0, aps or 0)
+        for maquina_id, segundos, boa, refugo, aps in _db.session.query(
+            md.maquina_id, func.sum(md.segundos_ocupados), func.sum(md.qtd_boa),
+            func.sum(md.qtd_refugo), func.sum(md.apontamentos),
+        ).filter(md.dia >= inicio, md.dia <= fim).group_by(md.maquina_id)
+    }
+    horas_maquina = dias_uteis(inicio, fim) * HORAS_TURNO
+
+    maquinas = []
+    setores = defaultdict(lambda: [0.0, 0, 0, 0.0, 0])  # segundos, boa, refugo, horas disponíveis, máquinas
+    for maquina in _Maquina.query.order_by(_Maquina.nome).all():
+        segundos, boa, refugo, aps = somas.get(maquina.id, (0.0, 0, 0, 0))
+        if not maquina.ativo and not aps:
+            continue
+        maquinas.append({
+            "maquina_id": maquina.id,
+            "maquina": maquina.nome,
+            "setor": maquina.setor or "-",
+            "apontamentos": aps,
+            **indicadores(segundos, boa, refugo, horas_maquina),
+        })
+        setor = setores[maquina.setor or "-"]
+        setor[0] += segundos
+        setor[1] += boa
+        setor[2] += refugo
+        setor[3] += horas_maquina
+        setor[4] += 1
+
+    return {
+        "inicio": inicio.isoformat(),
+        "fim": fim.isoformat(),
+        "horas_turno": HORAS_TURNO,
+        "maquinas": maquinas,
+        "setores": [
+            {"setor": nome, "maquinas": n, **indicadores(segundos, boa, refugo, horas)}
+            for nome, (segundos, boa, refugo, horas, n) in sorted(setores.items())
+        ],
+    }
+
+
+def init_app(db, apontamento, maquina, maquina_dia):
+    """Liga o módulo aos modelos Apontamento, Maquina e MaquinaDia"""
+    global _db, _Apontamento, _Maquina, _MaquinaDia
+    _db, _Apontamento, _Maquina, _MaquinaDia = db, apontamento, maquina, maquina_dia
+
+
+def main():
+    from app import app, db
+
+    if len(sys.argv) < 2 or sys.argv[1] != "--reconstruir":
+        print("Uso: python utilizacao_maquinas.py --reconstruir [AAAA-MM-DD AAAA-MM-DD]")
+        return
+    inicio = date.fromisoformat(sys.argv[2]) if len(sys.argv) > 2 else None
+    fim = date.fromisoformat(sys.argv[3]) if len(sys.argv) > 3 else None
+    with app.app_context():
+        print("⚙️ Recalculando utilização diária das máquinas...")
+        linhas = reconstruir(inicio, fim)
+        db.session.commit()
+    print(f"✅ {linhas} linhas gravadas em maquina_dia")
+
+
+if __name__ == "__main__":
+    main()
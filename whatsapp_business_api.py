@@ -3,28 +3,24 @@ WhatsApp Business API Notifier - Envia notificações via WhatsApp Business API
 Versão Oficial e Confiável
 """
 
-import requests
-import json
-import os
-from datetime import date, datetime
-from dotenv import load_dotenv
+from datetime import date
 
-# Carregar variáveis de ambiente
-load_dotenv(".env.whatsapp")
+import canais
 
 
 class WhatsAppBusinessNotifier:
     """Classe para enviar notificações via WhatsApp Business API"""
     
     def __init__(self):
-        """Inicializa o notificador"""
-        self.api_token = os.getenv("WHATSAPP_API_TOKEN")
-        self.phone_number_id = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
-        self.business_account_id = os.getenv("WHATSAPP_BUSINESS_ACCOUNT_ID")
-        self.recipient_phone = os.getenv("WHATSAPP_RECIPIENT_PHONE", "+55 11 99999-9999")
-        self.api_url = f"https://graph.instagram.com/v18.0/{self.phone_number_id}/messages"
+        """Inicializa o notificador (credenciais do .env.whatsapp, ver canais.py)"""
+        self.canal = canais.obter("whatsapp_api")
+        self.api_token = self.canal.api_token
+        self.phone_number_id = self.canal.phone_number_id
+        self.business_account_id = self.canal.business_account_id
+        self.recipient_phone = self.canal.recipient_phone
+        self.api_url = self.canal.api_url
         
-        if not all([self.api_token, self.phone_number_id, self.business_account_id]):
+        if not self.canal.configurado():
             print("❌ Credenciais do WhatsApp Business não configuradas!")
             print("   Verifique o arquivo .env.whatsapp")
             return
@@ -44,54 +40,23 @@ class WhatsAppBusinessNotifier:
         Returns:
             bool: True se enviado com sucesso, False caso contrário
         """
+        recipient_phone = recipient_phone or self.recipient_phone
+        print(f"\n📤 Enviando mensagem para {recipient_phone}...")
         try:
-            if not recipient_phone:
-                recipient_phone = self.recipient_phone
-            
-            # Remover caracteres especiais do número
-            recipient_phone_clean = recipient_phone.replace(" ", "").replace("-", "").replace("+", "")
-            
-            # Preparar payload
-            payload = {
-                "messaging_product": "whatsapp",
-                "to": recipient_phone_clean,
-                "type": "text",
-                "text": {
-                    "body": message
-                }
-            }
-            
-            # Headers
-            headers = {
-                "Authorization": f"Bearer {self.api_token}",
-                "Content-Type": "application/json"
-            }
-            
-            print(f"\n📤 Enviando mensagem para {recipient_phone}...")
-            print(f"   URL: {self.api_url}")
-            
-            # Enviar requisição
-            response = requests.post(
-                self.api_url,
-                json=payload,
-                headers=headers,
-                timeout=10
-            )
-            
-            # Verificar resposta
-            if response.status_code == 200:
-                print(f"✅ Mensagem enviada com sucesso!")
-                return True
-            else:
-                print(f"❌ Erro ao enviar mensagem:")
-                print(f"   Status: {response.status_code}")
-                print(f"   Resposta: {response.text}")
-                return False
-        
+            self.canal.enviar(message, recipient_phone)
+            print(f"✅ Mensagem enviada com sucesso!")
+            return True
         except Exception as e:
             print(f"❌ Erro ao enviar mensagem: {str(e)}")
             return False
     
+    def send_messages(self, messages, recipient_phone=None):
+        """Envia várias mensagens pela mesma conexão; devolve quantas foram"""
+        erros = self.canal.enviar_varios(messages, recipient_phone or self.recipient_phone)
+        for erro in filter(None, erros):
+            print(f"❌ Erro ao enviar mensagem: {str(erro)}")
+        return erros.count(None)
+    
     def send_template_message(self, template_name, language="pt_BR", parameters=None, recipient_phone=None):
         """
         Envia uma mensagem de template via WhatsApp Business API
@@ -105,61 +70,12 @@ class WhatsAppBusinessNotifier:
         Returns:
             bool: True se enviado com sucesso, False caso contrário
         """
+        recipient_phone = recipient_phone or self.recipient_phone
+        print(f"\n📤 Enviando template '{template_name}' para {recipient_phone}...")
         try:
-            if not recipient_phone:
-                recipient_phone = self.recipient_phone
-            
-            # Remover caracteres especiais do número
-            recipient_phone_clean = recipient_phone.replace(" ", "").replace("-", "").replace("+", "")
-            
-            # Preparar payload
-            payload = {
-                "messaging_product": "whatsapp",
-                "to": recipient_phone_clean,
-                "type": "template",
-                "template": {
-                    "name": template_name,
-                    "language": {
-                        "code": language
-                    }
-                }
-            }
-            
-            # Adicionar parâmetros se fornecidos
-            if parameters:
-                payload["template"]["components"] = [
-                    {
-                        "type": "body",
-                        "parameters": [{"type": "text", "text": str(p)} for p in parameters]
-                    }
-                ]
-            
-            # Headers
-            headers = {
-                "Authorization": f"Bearer {self.api_token}",
-                "Content-Type": "application/json"
-            }
-            
-            print(f"\n📤 Enviando template '{template_name}' para {recipient_phone}...")
-            
-            # Enviar requisição
-            response = requests.post(
-                self.api_url,
-                json=payload,
-                headers=headers,
-                timeout=10
-            )
-            
-            # Verificar resposta
-            if response.status_code == 200:
-                print(f"✅ Template enviado com sucesso!")
-                return True
-            else:
-                print(f"❌ Erro ao enviar template:")
-                print(f"   Status: {response.status_code}")
-                print(f"   Resposta: {response.text}")
-                return False
-        
+            self.canal.enviar_template(template_name, language, parameters, recipient_phone)
+            print(f"✅ Template enviado com sucesso!")
+            return True
         except Exception as e:
             print(f"❌ Erro ao enviar template: {str(e)}")
             return False
@@ -176,22 +92,17 @@ def enviar_notificacao_tarefa_atrasada(tarefa):
     try:
         notifier = WhatsAppBusinessNotifier()
         
-        dias_atrasada = (date.today() - tarefa.data_fim_prev).days
-        
-        mensagem = f"""🚨 TAREFA ATRASADA!
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-📋 Tarefa: {tarefa.titulo}
-👤 Responsável: {tarefa.responsavel.nome if tarefa.responsavel else 'Não atribuído'}
-📅 Data Fim: {tarefa.data_fim_prev.strftime('%d/%m/%Y')}
-⏰ Dias Atrasada: {dias_atrasada}
-📊 Status: {tarefa.status}
-🔧 OP: {tarefa.etapa.op.numero if tarefa.etapa and tarefa.etapa.op else 'N/A'}
-🏗️ Etapa: {tarefa.etapa.nome if tarefa.etapa else 'N/A'}
-⏱️ Horas Previstas: {tarefa.horas_previstas} h
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-⚠️ Ação Necessária!"""
+        mensagem = notifier.canal.renderizar(
+            "tarefa_atrasada",
+            titulo=tarefa.titulo,
+            responsavel=tarefa.responsavel.nome if tarefa.responsavel else 'Não atribuído',
+            data_fim=tarefa.data_fim_prev.strftime('%d/%m/%Y'),
+            dias=(date.today() - tarefa.data_fim_prev).days,
+            status=tarefa.status,
+            op=tarefa.etapa.op.numero if tarefa.etapa and tarefa.etapa.op else 'N/A',
+            etapa=tarefa.etapa.nome if tarefa.etapa else 'N/A',
+            horas=tarefa.horas_previstas,
+        )
         
         return notifier.send_message(mensagem)
     
@@ -1,49 +1,130 @@
 """
 WhatsApp Notifier - Envia notificações via WhatsApp Web
 Versão Melhorada com Tratamento de Erros
+
+Sessão persistente: o Chrome abre uma vez e fica aberto, o grupo fica
+selecionado e a caixa de mensagem guardada entre os envios. Em vez de
+time.sleep fixos, cada passo espera pelo elemento de que precisa
+(WebDriverWait), então o envio anda na velocidade da página.
+
+Para vários alertas use o ServicoWhatsApp: as mensagens vão para uma fila
+e uma única thread envia em lote pela sessão aberta.
+
+    servico = ServicoWhatsApp(chromedriver_path, "PCP Alertas")
+    servico.iniciar()
+    for texto in alertas:
+        servico.enviar(texto)
+    servico.aguardar()
+
+No app o WhatsApp Web é o canal "whatsapp_web" de canais.py, que usa
+este serviço (PCP_WHATSAPP_CHROMEDRIVER e PCP_WHATSAPP_GRUPO). Com vários
+workers do gunicorn só o que detém a trava do perfil abre o Chrome.
+
+Variáveis de ambiente:
+    PCP_WHATSAPP_HEADLESS   1 = Chrome sem janela (precisa do perfil já logado)
 """
 
 from selenium import webdriver
+from selenium.common.exceptions import StaleElementReferenceException, TimeoutException, WebDriverException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.keys import Keys
-import time
+from concurrent.futures import Future
 import os
+import queue
+import threading
+import time
+
+try:
+    from selenium.webdriver.chrome.service import Service
+except ImportError:  # selenium 3
+    Service = None
+
+
+# Seletores testados, do mais específico para o mais genérico
+SELETORES_CONECTADO = [
+    (By.CLASS_NAME, "_8nE46"),
+    (By.XPATH, "//div[@role='listitem']"),
+    (By.XPATH, "//div[@id='pane-side']"),
+]
+SELETORES_PESQUISA = [
+    (By.XPATH, "//input[@title='Pesquisar ou começar uma conversa']"),
+    (By.XPATH, "//input[@placeholder='Pesquisar ou começar uma conversa']"),
+    (By.XPATH, "//div[@contenteditable='true'][@data-tab='3']"),
+    (By.XPATH, "//input[@type='text']"),
+]
+SELETORES_MENSAGEM = [
+    (By.XPATH, "//footer//div[@contenteditable='true'][@data-tab='10']"),
+    (By.XPATH, "//footer//div[@contenteditable='true'][@role='textbox']"),
+    (By.XPATH, "//div[@contenteditable='true'][@data-tab='10']"),
+]
+
+
+def _primeiro_visivel(seletores):
+    """Condição do WebDriverWait: o primeiro seletor que tiver elemento visível"""
+    def condicao(driver):
+        for por, valor in seletores:
+            for elemento in driver.find_elements(por, valor):
+                try:
+                    if elemento.is_displayed():
+                        return elemento
+                except StaleElementReferenceException:
+                    continue
+        return False
+    return condicao
 
 
 class WhatsAppNotifier:
     """Classe para enviar notificações via WhatsApp Web"""
-    
-    def __init__(self, chromedriver_path, group_name):
+
+    def __init__(self, chromedriver_path, group_name, headless=None):
         """
         Inicializa o notificador
-        
+
         Args:
             chromedriver_path: Caminho para o chromedriver.exe
             group_name: Nome do grupo do WhatsApp
+            headless: Chrome sem janela (padrão: PCP_WHATSAPP_HEADLESS)
         """
         self.chromedriver_path = chromedriver_path
         self.group_name = group_name
         self.driver = None
         self.is_connected = False
         self.profile_path = os.path.expanduser("~/.wpp_profile")
-    
+        if headless is None:
+            headless = os.environ.get("PCP_WHATSAPP_HEADLESS") == "1"
+        self.headless = headless
+        # Cache da sessão: grupo aberto e caixa de mensagem dele
+        self._grupo_aberto = False
+        self._caixa_mensagem = None
+
+    def _driver_vivo(self):
+        if not self.driver:
+            return False
+        try:
+            self.driver.current_url
+            return True
+        except WebDriverException:
+            return False
+
     def connect(self):
-        """Conecta ao WhatsApp Web com configurações otimizadas"""
+        """Conecta ao WhatsApp Web (reaproveita o Chrome se já estiver aberto)"""
+        if self.is_connected and self._driver_vivo():
+            return True
         try:
             print("\n🔄 Conectando ao WhatsApp Web...")
             print(f"   ChromeDriver: {self.chromedriver_path}")
             print(f"   Grupo: {self.group_name}")
-            
+
             chrome_options = Options()
-            
+
             # Adicionar perfil do usuário para manter login
             if not os.path.exists(self.profile_path):
                 os.makedirs(self.profile_path)
             chrome_options.add_argument(f"user-data-dir={self.profile_path}")
-            
+
             # Configurações otimizadas
             chrome_options.add_argument("--no-sandbox")
             chrome_options.add_argument("--disable-dev-shm-usage")
@@ -51,192 +132,241 @@ class WhatsAppNotifier:
             chrome_options.add_argument("--disable-blink-features=AutomationControlled")
             chrome_options.add_argument("--disable-extensions")
             chrome_options.add_argument("--start-maximized")
+            if self.headless:
+                chrome_options.add_argument("--headless=new")
+                chrome_options.add_argument("--window-size=1280,900")
             chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
             chrome_options.add_experimental_option('useAutomationExtension', False)
             chrome_options.add_experimental_option("prefs", {
                 "profile.default_content_setting_values.notifications": 2
             })
-            
+
             print("   Iniciando Chrome...")
-            self.driver = webdriver.Chrome(
-                self.chromedriver_path,
-                options=chrome_options
-            )
-            
+            if Service is not None:
+                self.driver = webdriver.Chrome(service=Service(self.chromedriver_path), options=chrome_options)
+            else:
+                self.driver = webdriver.Chrome(self.chromedriver_path, options=chrome_options)
+
             print("   Acessando WhatsApp Web...")
             self.driver.get("https://web.whatsapp.com")
-            
+
             print("\n📱 ESCANEIE O QR CODE COM SEU CELULAR!")
             print("⏳ Aguardando conexão (máximo 60 segundos)...\n")
-            
-            # Aguardar até que o chat seja carregado (com timeout maior)
-            try:
-                WebDriverWait(self.driver, 60).until(
-                    EC.presence_of_all_elements_located((By.CLASS_NAME, "_8nE46"))
-                )
-            except:
-                # Se não encontrar a classe, tenta outra abordagem
-                WebDriverWait(self.driver, 60).until(
-                    EC.presence_of_all_elements_located((By.XPATH, "//div[@role='listitem']"))
-                )
-            
+
+            # Qualquer um dos seletores da lista de conversas serve
+            WebDriverWait(self.driver, 60).until(_primeiro_visivel(SELETORES_CONECTADO))
+
             self.is_connected = True
+            self._grupo_aberto = False
+            self._caixa_mensagem = None
             print("✅ Conectado ao WhatsApp Web com sucesso!\n")
             return True
-            
+
         except Exception as e:
             print(f"\n❌ Erro ao conectar: {str(e)}\n")
             self.is_connected = False
             if self.driver:
                 try:
                     self.driver.quit()
-                except:
+                except Exception:
                     pass
+                self.driver = None
             return False
-    
+
+    def _grupo_ainda_aberto(self):
+        """O cabeçalho da conversa aberta ainda é o do grupo?"""
+        if not self._grupo_aberto or self._caixa_mensagem is None:
+            return False
+        try:
+            titulos = self.driver.find_elements(By.XPATH, f"//header//span[@title='{self.group_name}']")
+            return bool(titulos) and self._caixa_mensagem.is_displayed()
+        except (StaleElementReferenceException, WebDriverException):
+            return False
+
     def find_group(self):
-        """Encontra o grupo pelo nome com múltiplas tentativas"""
+        """Abre o grupo pelo nome (não faz nada se ele já estiver aberto)"""
+        if self._grupo_ainda_aberto():
+            return True
+        self._grupo_aberto = False
+        self._caixa_mensagem = None
         try:
             print(f"🔍 Procurando grupo '{self.group_name}'...")
-            
-            # Tentar encontrar a caixa de pesquisa
-            search_xpaths = [
-                "//input[@title='Pesquisar ou começar uma conversa']",
-                "//input[@placeholder='Pesquisar ou começar uma conversa']",
-                "//input[@type='text']",
-            ]
-            
-            search_box = None
-            for xpath in search_xpaths:
-                try:
-                    search_box = WebDriverWait(self.driver, 5).until(
-                        EC.presence_of_element_located((By.XPATH, xpath))
-                    )
-                    if search_box:
-                        break
-                except:
-                    continue
-            
-            if not search_box:
+
+            try:
+                search_box = WebDriverWait(self.driver, 10).until(_primeiro_visivel(SELETORES_PESQUISA))
+            except TimeoutException:
                 print("❌ Não foi possível encontrar a caixa de pesquisa")
                 return False
-            
+
             search_box.click()
-            time.sleep(1)
-            search_box.clear()
+            search_box.send_keys(Keys.CONTROL, "a")
+            search_box.send_keys(Keys.BACKSPACE)
             search_box.send_keys(self.group_name)
-            
             print(f"   Digitado: {self.group_name}")
-            time.sleep(2)
-            
-            # Tentar clicar no grupo
+
+            # Espera o resultado da pesquisa aparecer em vez de dormir
             group_xpaths = [
-                f"//span[@title='{self.group_name}']",
-                f"//div[@title='{self.group_name}']",
-                f"//span[contains(text(), '{self.group_name}')]",
+                (By.XPATH, f"//span[@title='{self.group_name}']"),
+                (By.XPATH, f"//div[@title='{self.group_name}']"),
+                (By.XPATH, f"//span[contains(text(), '{self.group_name}')]"),
             ]
-            
-            group = None
-            for xpath in group_xpaths:
-                try:
-                    group = WebDriverWait(self.driver, 5).until(
-                        EC.element_to_be_clickable((By.XPATH, xpath))
-                    )
-                    if group:
-                        break
-                except:
-                    continue
-            
-            if not group:
+            try:
+                group = WebDriverWait(self.driver, 10).until(_primeiro_visivel(group_xpaths))
+            except TimeoutException:
                 print(f"❌ Grupo '{self.group_name}' não encontrado")
                 print("   Verifique se o nome está exato")
                 return False
-            
+
             group.click()
-            time.sleep(2)
-            
+
+            # O grupo está aberto quando a caixa de mensagem aparece
+            self._caixa_mensagem = WebDriverWait(self.driver, 10).until(_primeiro_visivel(SELETORES_MENSAGEM))
+            self._grupo_aberto = True
+
             print(f"✅ Grupo '{self.group_name}' encontrado!\n")
             return True
-            
+
         except Exception as e:
             print(f"❌ Erro ao encontrar grupo: {str(e)}\n")
             return False
-    
+
+    def _digitar_e_enviar(self, message):
+        caixa = self._caixa_mensagem
+        caixa.click()
+        # Quebras de linha com Shift+Enter; Enter sozinho envia
+        linhas = message.split("\n")
+        for i, linha in enumerate(linhas):
+            if i:
+                caixa.send_keys(Keys.SHIFT, Keys.ENTER)
+            if linha:
+                caixa.send_keys(linha)
+        caixa.send_keys(Keys.ENTER)
+        # Enviado quando a caixa esvazia
+        WebDriverWait(self.driver, 10).until(lambda d: not caixa.text.strip())
+
     def send_message(self, message):
-        """Envia uma mensagem para o grupo com tratamento robusto"""
-        try:
-            if not self.is_connected:
-                print("❌ Não conectado ao WhatsApp Web!")
-                return False
-            
-            # Múltiplas tentativas para encontrar o campo de mensagem
-            message_xpaths = [
-                "//div[@contenteditable='true'][@data-tab='10']",
-                "//div[@contenteditable='true'][@role='textbox']",
-                "//div[@contenteditable='true']",
-            ]
-            
-            message_box = None
-            for xpath in message_xpaths:
-                try:
-                    message_box = WebDriverWait(self.driver, 5).until(
-                        EC.presence_of_element_located((By.XPATH, xpath))
-                    )
-                    if message_box:
-                        break
-                except:
-                    continue
-            
-            if not message_box:
-                print("❌ Não foi possível encontrar o campo de mensagem")
-                return False
-            
-            message_box.click()
-            time.sleep(0.5)
-            message_box.clear()
-            
-            # Enviar mensagem
-            message_box.send_keys(message)
-            time.sleep(0.5)
-            
-            # Enviar (pressionar Enter ou clicar no botão)
-            try:
-                message_box.send_keys(Keys.ENTER)
-            except:
-                send_button = self.driver.find_element(
-                    By.XPATH,
-                    "//button[@aria-label='Enviar']"
-                )
-                send_button.click()
-            
-            print(f"✅ Mensagem enviada com sucesso!\n")
-            return True
-            
-        except Exception as e:
-            print(f"❌ Erro ao enviar mensagem: {str(e)}\n")
+        """Envia uma mensagem para o grupo (abre o grupo só se precisar)"""
+        if not self.is_connected:
+            print("❌ Não conectado ao WhatsApp Web!")
             return False
-    
+
+        for tentativa in range(2):
+            try:
+                if not self.find_group():
+                    return False
+                self._digitar_e_enviar(message)
+                print(f"✅ Mensagem enviada com sucesso!\n")
+                return True
+            except (StaleElementReferenceException, TimeoutException) as e:
+                # A página redesenhou a conversa: procura o grupo de novo
+                self._grupo_aberto = False
+                self._caixa_mensagem = None
+                if tentativa:
+                    print(f"❌ Erro ao enviar mensagem: {str(e)}\n")
+            except Exception as e:
+                print(f"❌ Erro ao enviar mensagem: {str(e)}\n")
+                return False
+        return False
+
+    def send_messages(self, messages):
+        """Envia várias mensagens pela mesma sessão; devolve quantas foram"""
+        enviadas = 0
+        for message in messages:
+            if self.send_message(message):
+                enviadas += 1
+        return enviadas
+
     def disconnect(self):
         """Desconecta do WhatsApp Web"""
         try:
             if self.driver:
                 self.driver.quit()
-                self.is_connected = False
                 print("✅ Desconectado do WhatsApp Web\n")
         except Exception as e:
             print(f"❌ Erro ao desconectar: {str(e)}\n")
-    
+        finally:
+            self.driver = None
+            self.is_connected = False
+            self._grupo_aberto = False
+            self._caixa_mensagem = None
+
     def reconnect(self):
         """Reconecta ao WhatsApp Web"""
         try:
             print("\n🔄 Reconectando ao WhatsApp Web...")
             self.disconnect()
-            time.sleep(3)
-            if self.connect():
-                time.sleep(2)
-                if self.find_group():
-                    return True
-            return False
+            return self.connect() and self.find_group()
         except Exception as e:
             print(f"❌ Erro ao reconectar: {str(e)}\n")
             return False
+
+
+class ServicoWhatsApp:
+    """Sessão do WhatsApp Web sempre aberta com fila de envio
+
+    O WebDriver não aguenta várias threads, então uma única thread cuida do
+    Chrome: pega o que estiver na fila (até `lote` mensagens) e envia tudo
+    pela sessão aberta. enviar() devolve um Future com True/False.
+    """
+
+    def __init__(self, chromedriver_path, group_name, lote=20, headless=None):
+        self.notifier = WhatsAppNotifier(chromedriver_path, group_name, headless=headless)
+        self.lote = lote
+        self.fila = queue.Queue()
+        self._thread = None
+        self._parar = threading.Event()
+
+    def iniciar(self):
+        """Abre o Chrome e sobe a thread de envio"""
+        if self._thread is not None:
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._loop, name="whatsapp-web", daemon=True)
+        self._thread.start()
+
+    def enviar(self, mensagem):
+        futuro = Future()
+        self.fila.put((mensagem, futuro))
+        return futuro
+
+    def aguardar(self):
+        """Espera a fila esvaziar"""
+        self.fila.join()
+
+    def parar(self):
+        self._parar.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def _pegar_lote(self):
+        try:
+            itens = [self.fila.get(timeout=1)]
+        except queue.Empty:
+            return []
+        while len(itens) < self.lote:
+            try:
+                itens.append(self.fila.get_nowait())
+            except queue.Empty:
+                break
+        return itens
+
+    def _loop(self):
+        try:
+            while not self._parar.is_set():
+                itens = self._pegar_lote()
+                if not itens:
+                    continue
+                inicio = time.monotonic()
+                conectado = self.notifier.connect() or self.notifier.reconnect()
+                enviadas = 0
+                for mensagem, futuro in itens:
+                    ok = conectado and self.notifier.send_message(mensagem)
+                    if not ok and conectado and self.notifier.reconnect():
+                        ok = self.notifier.send_message(mensagem)
+                    enviadas += bool(ok)
+                    futuro.set_result(bool(ok))
+                    self.fila.task_done()
+                print(f"📤 Lote WhatsApp: {enviadas}/{len(itens)} em {time.monotonic() - inicio:.1f}s")
+        finally:
+            self.notifier.disconnect()